@@ -0,0 +1,286 @@
+"""
+PyGirl Emulator
+
+Headless Batch Runner
+
+Runs the jobs of a manifest without any display, sound or real input. Every
+job gets its own forked worker process with a fresh GameBoy, at most
+`workers` of them run at the same time. The ROMs are read once before the
+workers are forked, the workers share their pages until the process exits.
+
+Manifest, one job per line:
+    <rom path> <frames> [<input script path>]
+Input script, one joypad event per line:
+    <frame> <up|down|left|right|a|b|start|select> <press|release>
+Relative paths are taken relative to the file they appear in, lines starting
+with # are ignored.
+"""
+
+import os
+import time
+
+from rpython.rlib.rfloat import formatd
+from rpython.rlib.rmd5 import RMD5
+
+from pygirl import constants
+from pygirl.cartridge import CartridgeFile, \
+    CartridgeHeaderCorruptedException, CartridgeTruncatedException
+from pygirl.gameboy import GameBoy
+from pygirl.ram import InvalidMemoryAccess
+
+FPS = 1 << 6
+FRAME_CYCLES = constants.GAMEBOY_CLOCK / FPS
+
+BUTTONS = ["up", "down", "left", "right", "a", "b", "start", "select"]
+
+
+class BatchError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class InputEvent(object):
+    def __init__(self, frame, button, pressed):
+        self.frame = frame
+        self.button = button
+        self.pressed = pressed
+
+
+class BatchJob(object):
+    def __init__(self, rom_path, frames, input_events=None):
+        self.rom_path = rom_path
+        self.frames = frames
+        if input_events is None:
+            input_events = []
+        self.input_events = input_events
+
+
+class BatchResult(object):
+    def __init__(self, index, rom_path, frames=0, seconds=0.0,
+                 frame_hash="", ram_hash="", error=""):
+        self.index = index
+        self.rom_path = rom_path
+        self.frames = frames
+        self.seconds = seconds
+        self.frame_hash = frame_hash
+        self.ram_hash = ram_hash
+        self.error = error
+
+    def get_fps(self):
+        if self.seconds <= 0.0:
+            return 0.0
+        return self.frames / self.seconds
+
+    def serialize(self):
+        if self.error:
+            return "%d ERR %s\n" % (self.index, self.error)
+        return "%d %d %f %s %s\n" % (self.index, self.frames, self.seconds,
+                                     self.frame_hash, self.ram_hash)
+
+    def report(self):
+        if self.error:
+            return "%s ERR %s" % (self.rom_path, self.error)
+        return "%s %d %sfps %s %s" % (self.rom_path, self.frames,
+                                      formatd(self.get_fps(), "f", 1),
+                                      self.frame_hash, self.ram_hash)
+
+
+def deserialize_result(job, line):
+    parts = line.split(" ")
+    index = int(parts[0])
+    if parts[1] == "ERR":
+        return BatchResult(index, job.rom_path,
+                           error=" ".join(parts[2:]))
+    return BatchResult(index, job.rom_path, int(parts[1]), float(parts[2]),
+                       parts[3], parts[4])
+
+
+# MANIFEST ---------------------------------------------------------------------
+
+def read_file(path):
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+def resolve_path(path, base_path):
+    if path.startswith("/"):
+        return path
+    # os.path.dirname is not RPython
+    end = base_path.rfind("/")
+    if end < 0:
+        return path
+    assert end >= 0
+    return base_path[:end] + "/" + path
+
+
+def split_lines(text):
+    lines = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            lines.append([part for part in line.split(" ") if part])
+    return lines
+
+
+def parse_manifest(text, manifest_path=""):
+    jobs = []
+    for parts in split_lines(text):
+        if len(parts) < 2 or len(parts) > 3:
+            raise BatchError("invalid manifest line: %s" % " ".join(parts))
+        rom_path = resolve_path(parts[0], manifest_path)
+        input_events = None
+        if len(parts) == 3:
+            script_path = resolve_path(parts[2], manifest_path)
+            input_events = parse_input_script(read_file(script_path))
+        jobs.append(BatchJob(rom_path, int(parts[1]), input_events))
+    return jobs
+
+
+def parse_input_script(text):
+    events = []
+    for parts in split_lines(text):
+        if len(parts) != 3 or parts[1] not in BUTTONS or \
+                parts[2] not in ("press", "release"):
+            raise BatchError("invalid input line: %s" % " ".join(parts))
+        events.append(InputEvent(int(parts[0]), parts[1],
+                                 parts[2] == "press"))
+    return events
+
+
+def load_manifest(path):
+    return parse_manifest(read_file(path), path)
+
+
+# RUNNING ----------------------------------------------------------------------
+
+def hash_buffer(buffer):
+    return RMD5(str(buffer)).hexdigest()
+
+
+def toggle_button(driver, button, pressed):
+    if button == "up":
+        driver.button_up(pressed)
+    elif button == "down":
+        driver.button_down(pressed)
+    elif button == "left":
+        driver.button_left(pressed)
+    elif button == "right":
+        driver.button_right(pressed)
+    elif button == "a":
+        driver.button_a(pressed)
+    elif button == "b":
+        driver.button_b(pressed)
+    elif button == "start":
+        driver.button_start(pressed)
+    elif button == "select":
+        driver.button_select(pressed)
+
+
+def load_cartridges(jobs):
+    """
+    Reads every ROM of the jobs once. The ROMs are never written, so the
+    forked workers keep sharing the pages of the parent. ROMs which cannot
+    be read are left to the worker, which reports the error.
+    """
+    cartridges = {}
+    for job in jobs:
+        if job.rom_path in cartridges:
+            continue
+        try:
+            cartridges[job.rom_path] = CartridgeFile(job.rom_path)
+        except (IOError, OSError):
+            pass
+    return cartridges
+
+
+def run_job(job, index=0, cartridge=None):
+    if cartridge is None:
+        cartridge = CartridgeFile(job.rom_path)
+    gameboy = GameBoy()
+    try:
+        gameboy.load_cartridge(cartridge)
+    except (CartridgeHeaderCorruptedException, CartridgeTruncatedException):
+        gameboy.load_cartridge(cartridge, verify=False)
+    gameboy.reset()
+    events = job.input_events
+    event = 0
+    start = time.time()
+    for frame in range(job.frames):
+        while event < len(events) and events[event].frame <= frame:
+            toggle_button(gameboy.joypad_driver, events[event].button,
+                          events[event].pressed)
+            event += 1
+        gameboy.emulate(FRAME_CYCLES)
+    seconds = time.time() - start
+    ram = gameboy.ram
+    return BatchResult(index, job.rom_path, job.frames, seconds,
+                       hash_buffer(gameboy.video_driver.pixels),
+                       hash_buffer(ram.work_ram + ram.hi_ram))
+
+
+def run_worker(job, index, fd, cartridge=None):
+    try:
+        result = run_job(job, index, cartridge)
+    except InvalidMemoryAccess, error:
+        result = error_result(job, index, error, error.message)
+    except (IOError, OSError), error:
+        result = error_result(job, index, error, os.strerror(error.errno))
+    except Exception, error:
+        # RPython has no message for the other exceptions
+        result = error_result(job, index, error, "")
+    os.write(fd, result.serialize())
+
+
+def error_result(job, index, error, message):
+    description = error.__class__.__name__
+    if message:
+        description += " " + message.replace("\n", " ")
+    return BatchResult(index, job.rom_path, error=description)
+
+
+def read_result(fd):
+    data = []
+    while True:
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            break
+        data.append(chunk)
+    os.close(fd)
+    return "".join(data).strip()
+
+
+def run_batch(jobs, workers=1):
+    """
+    Runs every job in a forked worker process and returns the results in
+    the order of the jobs.
+    """
+    results = [None] * len(jobs)
+    cartridges = load_cartridges(jobs)
+    running = {}
+    next_job = 0
+    while next_job < len(jobs) or running:
+        if next_job < len(jobs) and len(running) < workers:
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                job = jobs[next_job]
+                run_worker(job, next_job, write_fd,
+                           cartridges.get(job.rom_path, None))
+                os._exit(0)
+            os.close(write_fd)
+            running[pid] = (next_job, read_fd)
+            next_job += 1
+            continue
+        pid, status = os.waitpid(-1, 0)
+        if pid not in running:
+            continue
+        index, read_fd = running[pid]
+        del running[pid]
+        line = read_result(read_fd)
+        if line:
+            results[index] = deserialize_result(jobs[index], line)
+        else:
+            results[index] = BatchResult(index, jobs[index].rom_path,
+                                         error="worker died")
+    return results
@@ -1,9 +1,10 @@
-import math
 import os
 
 from pygirl import constants
 from pygirl.timer import *
 from pygirl.ram import iMemory, InvalidMemoryAccess
+from pygirl.memory_map import BufferPage
+from pygirl.cpu_block import CodeCache
 
 
 # HELPERS ----------------------------------------------------------------------
@@ -30,6 +31,20 @@ def map_to_string(int_array):
     return "".join([chr(i) for i in int_array])
 
 
+def write_battery_file(path, contents):
+    # write a new file and move it over the old one, a crash leaves
+    # either of them complete
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as handle:
+        handle.write(str(contents))
+    os.rename(temporary_path, path)
+
+
+# The cartridge RAM is written back to the battery file in pages of this size
+BATTERY_PAGE_SHIFT = 9
+BATTERY_PAGE_SIZE = 1 << BATTERY_PAGE_SHIFT
+
+
 # EXCEPIONS --------------------------------------------------------------------
 
 class InvalidMemoryBankTypeError(Exception):
@@ -89,6 +104,18 @@ class CartridgeManager(object):
                                                self.rom, self.ram, self.clock)
         # print self
 
+    def share(self, other):
+        """
+        Uses the cartridge loaded by the other manager. The ROM and the blocks
+        decoded from it are shared, the RAM is copied.
+        """
+        self.cartridge = other.cartridge
+        self.rom = other.rom
+        self.ram = bytearray(str(other.ram))
+        self.mbc = self.create_bank_controller(self.get_memory_bank_type(),
+                                               self.rom, self.ram, self.clock)
+        self.mbc.share_code_cache(other.mbc.code_cache)
+
     def check_rom(self):
         if not self.verify_header():
             raise CartridgeHeaderCorruptedException("Cartridge Header is corrupted")
@@ -104,11 +131,25 @@ class CartridgeManager(object):
 
     def load_battery(self):
         if self.cartridge.has_battery():
-            self.ram = self.cartridge.read_battery()
+            # a copy, the cartridge keeps the contents of the file
+            self.ram = bytearray(str(self.cartridge.read_battery()))
 
     def save(self, cartridge_name):
-        if self.cartridge.has_battery():
-            self.cartridge.write_battery(self.ram)
+        self.save_battery()
+
+    def save_battery(self, background=False):
+        """
+        Writes the RAM pages changed since the last save to the battery file.
+        In the background the file is written by the forked battery writer of
+        a BackgroundCartridgeFile, a save still running is left alone and the
+        pages go with the next one.
+        """
+        if self.cartridge is None or not self.has_battery():
+            return
+        if self.mbc.ram_dirty:
+            self.cartridge.update_battery(self.ram,
+                                          self.mbc.take_dirty_ram_pages())
+        self.cartridge.flush_battery(background)
 
     def get_memory_bank_type(self):
         return self.rom[constants.CARTRIDGE_TYPE_ADDRESS]
@@ -196,6 +237,8 @@ class CartridgeFile(object):
         self.battery_name = ""
         self.battery_file_path = ""
         self.battery_file_contents = bytearray("")
+        # the battery contents differ from the file
+        self.battery_changed = False
 
     def load(self, cartridge_path):
         cartridge_path = str(cartridge_path)
@@ -208,22 +251,24 @@ class CartridgeFile(object):
     def load_battery(self, cartridge_file_path):
         self.battery_file_path = self.create_battery_file_path(cartridge_file_path)
         if self.has_battery():
-            self.read_battery()
+            self.read_battery_file()
 
-    def read_battery(self):
+    def read_battery_file(self):
         with open(self.battery_file_path, "rb") as handle:
             self.battery_file_contents = bytearray(handle.read())
 
     def create_battery_file_path(self, cartridge_file_path):
         if cartridge_file_path.endswith(constants.CARTRIDGE_FILE_EXTENSION):
-            return cartridge_file_path[-len(constants.CARTRIDGE_FILE_EXTENSION)] \
-                   + constants.BATTERY_FILE_EXTENSION
+            end = len(cartridge_file_path) - \
+                  len(constants.CARTRIDGE_FILE_EXTENSION)
         elif cartridge_file_path.endswith(
                 constants.CARTRIDGE_COLOR_FILE_EXTENSION):
-            return cartridge_file_path[-len(constants.CARTRIDGE_COLOR_FILE_EXTENSION)] \
-                   + constants.BATTERY_FILE_EXTENSION
+            end = len(cartridge_file_path) - \
+                  len(constants.CARTRIDGE_COLOR_FILE_EXTENSION)
         else:
-            return cartridge_file_path + constants.BATTERY_FILE_EXTENSION
+            end = len(cartridge_file_path)
+        assert end >= 0
+        return cartridge_file_path[:end] + constants.BATTERY_FILE_EXTENSION
 
     def has_battery(self):
         if self.battery_file_path is None:
@@ -237,8 +282,63 @@ class CartridgeFile(object):
         return self.battery_file_contents
 
     def write_battery(self, ram):
-        with open(self.battery_file_path, "wb") as handle: handle.write(ram)
-        self.battery_file_contents = ram
+        self.battery_file_contents = bytearray(str(ram))
+        self.battery_changed = True
+        self.flush_battery()
+
+    def update_battery(self, ram, pages):
+        """
+        Copies the given pages of the RAM into the battery contents. The
+        contents are replaced and never changed in place, so a writer can
+        keep the old ones as its snapshot.
+        """
+        if len(self.battery_file_contents) != len(ram):
+            self.battery_file_contents = bytearray(str(ram))
+            self.battery_changed = True
+            return
+        contents = self.battery_file_contents
+        index = 0
+        while index < len(pages):
+            # consecutive pages are copied in one slice
+            start = pages[index] << BATTERY_PAGE_SHIFT
+            index += 1
+            while index < len(pages) and pages[index] == pages[index - 1] + 1:
+                index += 1
+            end = min((pages[index - 1] + 1) << BATTERY_PAGE_SHIFT, len(ram))
+            assert start >= 0
+            assert end >= 0
+            contents = contents[:start] + ram[start:end] + contents[end:]
+        self.battery_file_contents = contents
+        self.battery_changed = True
+
+    def flush_battery(self, background=False):
+        if not self.poll_battery_writer():
+            if background:
+                return
+            self.wait_for_battery_writer()
+        if not self.battery_changed:
+            return
+        self.battery_changed = False
+        if background:
+            self.write_battery_in_background()
+        else:
+            self.write_battery_file()
+
+    def write_battery_in_background(self):
+        # plain cartridge files have no battery writer
+        self.write_battery_file()
+
+    def poll_battery_writer(self):
+        """
+        Returns True if no background writer is running.
+        """
+        return True
+
+    def wait_for_battery_writer(self):
+        pass
+
+    def write_battery_file(self):
+        write_battery_file(self.battery_file_path, self.battery_file_contents)
 
     def remove_battery(self):
         if self.has_battery() and self.battery_file_path is not None:
@@ -255,6 +355,91 @@ class CartridgeFile(object):
         return os.path.getsize(self.battery_file_path)
 
 
+# ------------------------------------------------------------------------------
+
+class BatteryWriter(object):
+    """
+    Writes battery files in a forked child, one at a time. The child works
+    on its own copy of the battery contents while the emulation goes on, a
+    failed write is reported on stderr by the child and through its exit
+    status to the parent.
+    """
+
+    def __init__(self):
+        self.pid = 0
+        self.failed = False
+
+    def start(self, path, contents):
+        self.wait()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(write_battery_file_in_child(path, contents))
+        self.pid = pid
+
+    def poll(self):
+        """
+        Returns True if no file is being written.
+        """
+        if self.pid == 0:
+            return True
+        pid, status = os.waitpid(self.pid, os.WNOHANG)
+        if pid == 0:
+            return False
+        self.finish(status)
+        return True
+
+    def wait(self):
+        if self.pid != 0:
+            pid, status = os.waitpid(self.pid, 0)
+            self.finish(status)
+
+    def finish(self, status):
+        self.pid = 0
+        if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+            self.failed = True
+
+
+def write_battery_file_in_child(path, contents):
+    try:
+        write_battery_file(path, contents)
+    except (IOError, OSError), error:
+        os.write(2, "could not write the battery file %s: %s\n"
+                    % (path, os.strerror(error.errno)))
+        return 1
+    return 0
+
+
+class BackgroundCartridgeFile(CartridgeFile):
+    """
+    A cartridge file whose battery is written in the background by a
+    BatteryWriter. A failed background write marks the battery as changed
+    again, the next flush retries it.
+    """
+
+    def __init__(self, file=None):
+        self.battery_writer = BatteryWriter()
+        CartridgeFile.__init__(self, file)
+
+    def write_battery_in_background(self):
+        self.battery_writer.start(self.battery_file_path,
+                                  self.battery_file_contents)
+
+    def poll_battery_writer(self):
+        if not self.battery_writer.poll():
+            return False
+        self.check_battery_writer()
+        return True
+
+    def wait_for_battery_writer(self):
+        self.battery_writer.wait()
+        self.check_battery_writer()
+
+    def check_battery_writer(self):
+        if self.battery_writer.failed:
+            self.battery_writer.failed = False
+            self.battery_changed = True
+
+
 # ==============================================================================
 # CARTRIDGE TYPES
 
@@ -264,6 +449,10 @@ class MBC(iMemory):
 
     def __init__(self, rom, ram, clock_driver):
         self.clock = clock_driver
+        # Pages handed to the memory map for direct ROM reads
+        self.code_cache = CodeCache(rom)
+        self.rom_page = BufferPage(rom, 0, 0x3FFF, self.code_cache)
+        self.rom_bank_page = BufferPage(rom, 0, 0x3FFF, self.code_cache)
         self.reset()
 
         banks = int(len(rom) / self.rom_bank_size)
@@ -281,13 +470,62 @@ class MBC(iMemory):
                                         hex(self.max_ram_bank_size)))
         self.ram = ram
         self.ram_size = constants.RAM_BANK_SIZE * banks - 1
+        self.ram_dirty_pages = [False] * ((len(ram) + BATTERY_PAGE_SIZE - 1) >>
+                                          BATTERY_PAGE_SHIFT)
+        self.ram_dirty = False
 
     def reset(self):
-        self.rom_bank = self.rom_bank_size
+        self.set_rom_bank(self.rom_bank_size)
         self.ram_bank = 0
         self.ram_enable = False
         self.ram_size = 0
 
+    def set_rom_bank(self, rom_bank):
+        self.rom_bank = rom_bank
+        self.rom_bank_page.base = rom_bank
+
+    def share_code_cache(self, code_cache):
+        # the ROM never changes, so its blocks stay valid for every MBC
+        # reading the same ROM
+        self.code_cache = code_cache
+        self.rom_page.code_cache = code_cache
+        self.rom_bank_page.code_cache = code_cache
+
+    def save_state(self, writer):
+        writer.write_int(self.rom_bank)
+        writer.write_int(self.ram_bank)
+        writer.write_bool(self.ram_enable)
+        writer.write_int(self.ram_size)
+        writer.write_buffer(self.ram)
+
+    def load_state(self, reader):
+        self.set_rom_bank(reader.read_int())
+        self.ram_bank = reader.read_int()
+        self.ram_enable = reader.read_bool()
+        self.ram_size = reader.read_int()
+        reader.read_buffer(self.ram)
+        for page in range(len(self.ram_dirty_pages)):
+            self.ram_dirty_pages[page] = True
+        self.ram_dirty = True
+
+    def set_ram(self, offset, data):
+        # every RAM write goes through here to mark its page for the battery
+        self.ram[offset] = data
+        self.ram_dirty_pages[offset >> BATTERY_PAGE_SHIFT] = True
+        self.ram_dirty = True
+
+    def take_dirty_ram_pages(self):
+        """
+        Returns the pages written since the last call and marks them clean.
+        """
+        pages = []
+        for page in range(len(self.ram_dirty_pages)):
+            if self.ram_dirty_pages[page]:
+                self.ram_dirty_pages[page] = False
+                pages.append(page)
+        self.ram_dirty = False
+        return pages
+
     def read(self, address):
         # 0000-3FFF  
         if address <= 0x3FFF:
@@ -321,7 +559,7 @@ class DefaultMBC(MBC):
     max_ram_bank_size = 0xFFFFFF
 
     def write(self, address, data):
-        self.ram[self.ram_bank + (address & 0x1FFF)] = data
+        self.set_ram(self.ram_bank + (address & 0x1FFF), data)
 
 
 # -------------------------------------------------------------------------------
@@ -346,6 +584,14 @@ class MBC1(MBC):
         MBC.reset(self)
         self.memory_model = 0
 
+    def save_state(self, writer):
+        MBC.save_state(self, writer)
+        writer.write_int(self.memory_model)
+
+    def load_state(self, reader):
+        MBC.load_state(self, reader)
+        self.memory_model = reader.read_int()
+
     def write(self, address, data):
         # 0000-1FFF
         if address <= 0x1FFF:
@@ -361,7 +607,7 @@ class MBC1(MBC):
             self.memory_model = data & 0x01
         # A000-BFFF
         elif 0xA000 <= address <= 0xBFFF and self.ram_enable:
-            self.ram[self.ram_bank + (address & 0x1FFF)] = data
+            self.set_ram(self.ram_bank + (address & 0x1FFF), data)
         else:
             return
             # raise InvalidMemoryAccess("MBC 1Invalid memory Access address: %s"
@@ -371,15 +617,15 @@ class MBC1(MBC):
         if (data & 0x1F) == 0:
             data = 1
         if self.memory_model == 0:
-            self.rom_bank = ((self.rom_bank & 0x180000) +
-                             ((data & 0x1F) << 14)) & self.rom_size
+            self.set_rom_bank(((self.rom_bank & 0x180000) +
+                               ((data & 0x1F) << 14)) & self.rom_size)
         else:
-            self.rom_bank = ((data & 0x1F) << 14) & self.rom_size
+            self.set_rom_bank(((data & 0x1F) << 14) & self.rom_size)
 
     def write_rom_bank_2(self, address, data):
         if self.memory_model == 0:
-            self.rom_bank = ((self.rom_bank & 0x07FFFF) +
-                             ((data & 0x03) << 19)) & self.rom_size
+            self.set_rom_bank(((self.rom_bank & 0x07FFFF) +
+                               ((data & 0x03) << 19)) & self.rom_size)
         else:
             self.ram_bank = ((data & 0x03) << 13) & self.ram_size
 
@@ -432,11 +678,11 @@ class MBC2(MBC):
             return
         if (data & 0x0F) == 0:
             data = 1
-        self.rom_bank = ((data & 0x0F) << 14) & self.rom_size
+        self.set_rom_bank(((data & 0x0F) << 14) & self.rom_size)
 
     def write_ram(self, address, data):
         if self.ram_enable:
-            self.ram[address & 0x01FF] = data & 0x0F
+            self.set_ram(address & 0x01FF, data & 0x0F)
 
     def write_ram_enable(self, address, data):
         if (address & 0x0100) == 0:
@@ -476,6 +722,38 @@ class MBC3(MBC):
         self.clock_latched_days = 0
         self.clock_latched_control = 0
 
+    def save_state(self, writer):
+        MBC.save_state(self, writer)
+        writer.write_int(self.clock_time)
+        writer.write_int(self.clock_latch)
+        writer.write_int(self.clock_register)
+        writer.write_int(self.clock_seconds)
+        writer.write_int(self.clock_minutes)
+        writer.write_int(self.clock_hours)
+        writer.write_int(self.clock_days)
+        writer.write_int(self.clock_control)
+        writer.write_int(self.clock_latched_seconds)
+        writer.write_int(self.clock_latched_minutes)
+        writer.write_int(self.clock_latched_hours)
+        writer.write_int(self.clock_latched_days)
+        writer.write_int(self.clock_latched_control)
+
+    def load_state(self, reader):
+        MBC.load_state(self, reader)
+        self.clock_time = reader.read_int()
+        self.clock_latch = reader.read_int()
+        self.clock_register = reader.read_int()
+        self.clock_seconds = reader.read_int()
+        self.clock_minutes = reader.read_int()
+        self.clock_hours = reader.read_int()
+        self.clock_days = reader.read_int()
+        self.clock_control = reader.read_int()
+        self.clock_latched_seconds = reader.read_int()
+        self.clock_latched_minutes = reader.read_int()
+        self.clock_latched_hours = reader.read_int()
+        self.clock_latched_days = reader.read_int()
+        self.clock_latched_control = reader.read_int()
+
     def read(self, address):
         # A000-BFFF
         if 0xA000 <= address <= 0xBFFF:
@@ -516,14 +794,14 @@ class MBC3(MBC):
         # A000-BFFF
         elif 0xA000 <= address <= 0xBFFF and self.ram_enable:
             if self.ram_bank >= 0:
-                self.ram[self.ram_bank + (address & 0x1FFF)] = data
+                self.set_ram(self.ram_bank + (address & 0x1FFF), data)
             else:
                 self.write_clock_data(address, data)
 
     def write_rom_bank(self, address, data):
         if data == 0:
             data = 1
-        self.rom_bank = ((data & 0x7F) << 14) & self.rom_size
+        self.set_rom_bank(((data & 0x7F) << 14) & self.rom_size)
 
     def write_ram_bank(self, address, data):
         if 0x00 <= data <= 0x03:
@@ -571,15 +849,15 @@ class MBC3(MBC):
         elapsed += self.clock_minutes * 60
         elapsed += self.clock_seconds
 
-        days = int(math.floor(elapsed / (24.0 * 60 * 60.0)))
+        days = elapsed // (24 * 60 * 60)
         self.clock_days += days
         elapsed -= days * 24 * 60 * 60
 
-        hours = int(math.floor(elapsed / (60 * 60)))
+        hours = elapsed // (60 * 60)
         self.clock_hours += hours
         elapsed -= hours * 60 * 60
 
-        minutes = int(math.floor(elapsed / 60))
+        minutes = elapsed // 60
         self.clock_minutes += minutes
         elapsed -= minutes * 60
 
@@ -618,18 +896,18 @@ class MBC5(MBC):
             self.write_ram_enable(address, data)
         # 2000-2FFF
         elif address <= 0x2FFF:
-            self.rom_bank = ((self.rom_bank & (0x01 << 22)) +
-                             (data << 14)) & self.rom_size
+            self.set_rom_bank(((self.rom_bank & (0x01 << 22)) +
+                               (data << 14)) & self.rom_size)
         # 3000-3FFF
         elif address <= 0x3FFF:
-            self.rom_bank = ((self.rom_bank & (0xFF << 14)) +
-                             ((data & 0x01) << 22)) & self.rom_size
+            self.set_rom_bank(((self.rom_bank & (0xFF << 14)) +
+                               ((data & 0x01) << 22)) & self.rom_size)
         # 4000-4FFF
         elif address <= 0x4FFF:
             self.write_ram_bank(address, data)
         # A000-BFFF
         elif 0xA000 <= address <= 0xBFFF and self.ram_enable:
-            self.ram[self.ram_bank + (address & 0x1FFF)] = data
+            self.set_ram(self.ram_bank + (address & 0x1FFF), data)
 
     def write_ram_bank(self, address, data):
         if self.rumble:
@@ -672,6 +950,22 @@ class HuC3(MBC):
         self.clock_shift = 0
         self.clock_time = self.clock.get_time()
 
+    def save_state(self, writer):
+        MBC.save_state(self, writer)
+        writer.write_int(self.ram_flag)
+        writer.write_int(self.ram_value)
+        writer.write_int(self.clock_register)
+        writer.write_int(self.clock_shift)
+        writer.write_int(self.clock_time)
+
+    def load_state(self, reader):
+        MBC.load_state(self, reader)
+        self.ram_flag = reader.read_int()
+        self.ram_value = reader.read_int()
+        self.clock_register = reader.read_int()
+        self.clock_shift = reader.read_int()
+        self.clock_time = reader.read_int()
+
     def read(self, address):
         # A000-BFFF
         if 0xA000 <= address <= 0xBFFF:
@@ -706,7 +1000,7 @@ class HuC3(MBC):
     def write_rom_bank(self, address, data):
         if (data & 0x7F) == 0:
             data = 1
-        self.rom_bank = ((data & 0x7F) << 14) & self.rom_size
+        self.set_rom_bank(((data & 0x7F) << 14) & self.rom_size)
 
     def write_ram_flag(self, address, data):
         if self.ram_flag == 0x0B:
@@ -714,7 +1008,7 @@ class HuC3(MBC):
         elif 0x0C <= self.ram_flag <= 0x0E:
             pass
         elif self.ram_flag == 0x0A and self.ram_size > 0:
-            self.ram[self.ram_bank + (address & 0x1FFF)] = data
+            self.set_ram(self.ram_bank + (address & 0x1FFF), data)
 
     def write_with_ram_flag_0x0B(self, address, data):
         compare = data & 0xF0
@@ -754,13 +1048,13 @@ class HuC3(MBC):
         now = self.clock.get_time()
         elapsed = now - self.clock_time
         # years (4 bits)
-        years = int(math.floor(elapsed / (365 * 24 * 60 * 60)))
+        years = elapsed // (365 * 24 * 60 * 60)
         elapsed -= years * 365 * 24 * 60 * 60
         # days (12 bits)
-        days = int(math.floor(elapsed / (24 * 60 * 60)))
+        days = elapsed // (24 * 60 * 60)
         elapsed -= days * 24 * 60 * 60
         # minutes (12 bits)
-        minutes = int(math.floor(elapsed / 60))
+        minutes = elapsed // 60
         elapsed -= minutes * 60
 
         self.clock_register |= years << 24
@@ -205,6 +205,8 @@ NR12 = 0xFF12  # AUD1ENV
 NR13 = 0xFF13  # AUD1LOW
 NR14 = 0xFF14  # AUD1HIGH
 
+NR20 = 0xFF15  # not used
+
 NR21 = 0xFF16  # AUD2LEN
 NR22 = 0xFF17  # AUD2ENV
 NR23 = 0xFF18  # AUD2LOW
@@ -216,6 +218,8 @@ NR32 = 0xFF1C  # AUD3LEVEL
 NR33 = 0xFF1D  # AUD3LOW
 NR34 = 0xFF1E  # AUD3HIGH
 
+NR40 = 0xFF1F  # not used
+
 NR41 = 0xFF20  # AUD4LEN
 NR42 = 0xFF21  # AUD4ENV
 NR43 = 0xFF22  # AUD4POLY
@@ -225,6 +229,10 @@ NR50 = 0xFF24  # AUDVOL
 NR51 = 0xFF25  # AUDTERM
 NR52 = 0xFF26  # AUDENA
 
+# 0xFF27 - 0xFF2F are not used
+AUDUNUSED = 0xFF27
+AUDUNUSEDEND = 0xFF2F
+
 AUD3WAVERAM = 0xFF30
 
 BUFFER_LOG_SIZE = 5
@@ -1,8 +1,9 @@
 from pygirl import constants
 from pygirl.interrupt import Interrupt
-from pygirl.cpu_register import Register, DoubleRegister, \
-    ReservedDoubleRegister, \
-    FlagRegister, ImmediatePseudoRegister
+from pygirl.cpu_register import CallWrapper, Register, DoubleRegister, \
+    ReservedDoubleRegister, FlagDoubleRegister, \
+    FlagRegister, ImmediatePseudoRegister, \
+    FlatRegister, FlatDoubleRegister, LazyFlagRegister
 
 
 # ---------------------------------------------------------------------------
@@ -28,6 +29,12 @@ class CPU(object):
 
     Central Unit Processor_a (Sharp LR35902 CPU)
     """
+    # Run straight-line code from decoded blocks, see cpu_block
+    use_block_cache = True
+    # Skip the iterations of cached loops which only poll memory
+    skip_idle_loops = True
+    # FlagRegister computes the flags right away, see LazyFlagCPU
+    flag_register_class = FlagRegister
 
     def __init__(self, interrupt, memory):
         assert isinstance(interrupt, Interrupt)
@@ -37,7 +44,9 @@ class CPU(object):
         self.halted = False
         self.cycles = 0
         self.ini_registers()
+        self.ini_callers()
         self.rom = bytearray("\x00")
+        self.rom_bank_page = None
         self.reset()
 
     def ini_registers(self):
@@ -58,8 +67,13 @@ class CPU(object):
         self.sp = ReservedDoubleRegister(self, reset_value=constants.RESET_SP)
 
         self.a = Register(self, constants.RESET_A)
-        self.flag = FlagRegister(self, constants.RESET_F)
-        self.af = DoubleRegister(self, self.a, self.flag)
+        self.flag = self.flag_register_class(self, constants.RESET_F)
+        self.af = FlagDoubleRegister(self, self.a, self.flag)
+
+    def ini_callers(self):
+        # shared by all handlers, so executing an op code allocates nothing
+        self.fetch_caller = CPUFetchCaller(self)
+        self.pop_caller = CPUPopCaller(self)
 
     def reset(self):
         self.reset_registers()
@@ -81,6 +95,32 @@ class CPU(object):
         self.sp.reset()
         self.pc.reset()
 
+    def save_state(self, writer):
+        writer.write_byte(self.a.get(use_cycles=False))
+        writer.write_byte(self.flag.get(use_cycles=False))
+        writer.write_int(self.bc.get(use_cycles=False))
+        writer.write_int(self.de.get(use_cycles=False))
+        writer.write_int(self.hl.get(use_cycles=False))
+        writer.write_int(self.sp.get(use_cycles=False))
+        writer.write_int(self.pc.get(use_cycles=False))
+        writer.write_bool(self.ime)
+        writer.write_bool(self.halted)
+        writer.write_int(self.cycles)
+
+    def load_state(self, reader):
+        # a and the flags are set separately, af.set would skip the flag
+        # register's own bookkeeping
+        self.a.set(reader.read_byte(), use_cycles=False)
+        self.flag.set(reader.read_byte(), use_cycles=False)
+        self.bc.set(reader.read_int(), use_cycles=False)
+        self.de.set(reader.read_int(), use_cycles=False)
+        self.hl.set(reader.read_int(), use_cycles=False)
+        self.sp.set(reader.read_int(), use_cycles=False)
+        self.pc.set(reader.read_int(), use_cycles=False)
+        self.ime = reader.read_bool()
+        self.halted = reader.read_bool()
+        self.cycles = reader.read_int()
+
     # ---------------------------------------------------------------
 
     def get_af(self):
@@ -135,19 +175,19 @@ class CPU(object):
 
     def is_z(self):
         """ zero flag"""
-        return self.flag.is_zero
+        return self.flag.get_zero()
 
     def is_c(self):
         """ carry flag, true if the result did not fit in the register"""
-        return self.flag.is_carry
+        return self.flag.get_carry()
 
     def is_h(self):
         """ half carry, carry from bit 3 to 4"""
-        return self.flag.is_half_carry
+        return self.flag.get_half_carry()
 
     def is_n(self):
         """ subtract flag, true if the last operation was a subtraction"""
-        return self.flag.is_subtraction
+        return self.flag.get_subtraction()
 
     def isS(self):
         return self.flag.s_flag
@@ -170,13 +210,69 @@ class CPU(object):
     def set_rom(self, banks):
         self.rom = banks
 
+    def set_rom_bank_page(self, page):
+        # the MBC moves the page to the selected bank, fetch indexes it
+        self.rom_bank_page = page
+
         # ---------------------------------------------------------------
 
     def emulate(self, ticks):
         self.cycles += ticks
         self.handle_pending_interrupts()
         while self.cycles > 0:
-            self.execute(self.fetch(use_cycles=False))
+            if not self.execute_block():
+                self.execute(self.fetch(use_cycles=False))
+
+    def execute_block(self):
+        """
+        Executes the cached block starting at pc. Returns False if there is
+        no block for pc and the instruction has to be interpreted.
+        """
+        if not self.use_block_cache:
+            return False
+        pc = self.pc.get(use_cycles=False)
+        page = self.memory.get_code_page(pc)
+        if page is None:
+            return False
+        block = page.code_cache.get_block(page, pc)
+        if block.is_empty():
+            return False
+        base = page.base
+        start = pc
+        a = flag = cycles = 0
+        if block.idle_loop:
+            a = self.a.get(use_cycles=False)
+            flag = self.flag.get(use_cycles=False)
+            cycles = self.cycles
+        for instruction in block.instructions:
+            pc = instruction.execute(self, pc)
+            # leave the block as soon as the straight line is left: cycles
+            # are used up, an interrupt was taken, the bank was switched or
+            # the code was overwritten
+            if self.cycles <= 0 or self.pc.get(use_cycles=False) != pc or \
+                    page.base != base or not block.valid:
+                break
+        if block.idle_loop and self.skip_idle_loops and self.cycles > 0 and \
+                self.pc.get(use_cycles=False) == start:
+            self.skip_idle_loop(block, a, flag, cycles - self.cycles)
+        return True
+
+    def skip_idle_loop(self, block, a, flag, cycles):
+        """
+        The block has just run one iteration of a loop which writes nothing
+        but A and the flags. If that iteration left them as it found them and
+        it only read memory which keeps its value until the next hardware
+        event, every further iteration up to the end of the slice does the
+        same, so they are charged at once instead of executed. The iteration
+        the slice ends in still runs normally.
+        """
+        if self.a.get(use_cycles=False) != a or cycles <= 0 or \
+                self.flag.get(use_cycles=False) != flag or \
+                not block.reads_idle_inputs(self):
+            return
+        iterations = (self.cycles - 1) / cycles
+        self.cycles -= iterations * cycles
+        self.instruction_counter += iterations * len(block.instructions)
 
     def emulate_step(self):
         self.handle_pending_interrupts()
@@ -239,6 +335,9 @@ class CPU(object):
         pc = self.pc.get(use_cycles)
         if pc <= 0x3FFF:
             data = self.rom[self.pc.get(use_cycles)]
+        elif pc <= 0x7FFF and self.rom_bank_page is not None:
+            page = self.rom_bank_page
+            data = page.buffer[page.base + (pc & 0x3FFF)]
         else:
             data = self.memory.read(self.pc.get(use_cycles))
         self.pc.inc(use_cycles)  # 2 cycles
@@ -250,7 +349,7 @@ class CPU(object):
         return (hi << 8) + lo
 
     def fetch_double_register(self, register):
-        self.double_register_inverse_call(CPUFetchCaller(self), register)
+        self.double_register_inverse_call(self.fetch_caller, register)
         self.cycles += 1
 
     def push(self, data, use_cycles=True):
@@ -272,7 +371,7 @@ class CPU(object):
 
     def pop_double_register(self, register):
         # 3 cycles
-        self.double_register_inverse_call(CPUPopCaller(self), register)
+        self.double_register_inverse_call(self.pop_caller, register)
         self.cycles += 1
 
     def double_register_inverse_call(self, getCaller, register):
@@ -292,15 +391,14 @@ class CPU(object):
         setCaller.set(value)  # 1 cycle
 
     def load_fetch_register(self, register):
-        self.load(CPUFetchCaller(self), RegisterCallWrapper(register))
+        self.load(self.fetch_caller, register)
 
     def store_hl_in_pc(self):
         # LD PC,HL, 1 cycle
-        self.load(DoubleRegisterCallWrapper(self.hl),
-                  DoubleRegisterCallWrapper(self.pc))
+        self.load(self.hl, self.pc)
 
     def fetch_load(self, getCaller, setCaller):
-        self.load(CPUFetchCaller(self), setCaller)
+        self.load(self.fetch_caller, setCaller)
 
     def add_a(self, getCaller, setCaller=None):
         # TODO: Test overflow -> carry flag
@@ -322,22 +420,17 @@ class CPU(object):
     def add_a_with_carry(self, getCaller, setCaller=None):
         # 1 cycle
         data = getCaller.get()
-        s = self.a.get() + data + int(self.flag.is_carry)
+        s = self.a.get() + data + int(self.flag.get_carry())
         self.add_sub_flag_finish(s, data)
 
     def subtract_with_carry_a(self, getCaller, setCaller=None):
         # 1 cycle
         data = getCaller.get()
-        s = self.a.get() - data - int(self.flag.is_carry)
-        self.add_sub_flag_finish(s, data)
-        self.flag.is_subtraction = True
+        s = self.a.get() - data - int(self.flag.get_carry())
+        self.add_sub_flag_finish(s, data, subtraction=True)
 
-    def add_sub_flag_finish(self, s, data):
-        self.flag.reset()
-        # set the h flag if the 0x10 bit was affected
-        self.flag.is_half_carry = (((s ^ self.a.get() ^ data) & 0x10) != 0)
-        self.flag.is_carry = (s > 0xFF or s < 0)
-        self.flag.zero_check(s)
+    def add_sub_flag_finish(self, s, data, subtraction=False):
+        self.flag.add_check(s, self.a.get(), data, subtraction)
         self.a.set(s & 0xFF)  # 1 cycle
 
     def subtract_a(self, getCaller, setCaller=None):
@@ -358,34 +451,23 @@ class CPU(object):
 
     def compare_a_simple(self, s):
         s = (self.a.get() - s) & 0xFF
-        self.flag.reset()
-        self.flag.is_subtraction = True
-        self.flag.zero_check(s)
-        self.subtract_his_carry_finish(s)
+        self.flag.compare_check(s, self.a.get())
         self.cycles -= 1
 
-    def subtract_his_carry_finish(self, data):
-        self.flag.is_carry = (data > self.a.get())
-        self.flag.is_half_carry_compare(data, self.a.get())
-
     def and_a(self, getCaller, setCaller=None):
         # 1 cycle
         self.a.set(self.a.get() & getCaller.get())  # 1 cycle
-        self.flag.reset()
-        self.flag.zero_check(self.a.get())
-        self.flag.is_half_carry = True
+        self.flag.logic_check(self.a.get(), half_carry=True)
 
     def xor_a(self, getCaller, setCaller=None):
         # 1 cycle
         self.a.set(self.a.get() ^ getCaller.get())  # 1 cycle
-        self.flag.reset()
-        self.flag.zero_check(self.a.get())
+        self.flag.logic_check(self.a.get())
 
     def or_a(self, getCaller, setCaller=None):
         # 1 cycle
         self.a.set(self.a.get() | getCaller.get())  # 1 cycle
-        self.flag.reset()
-        self.flag.zero_check(self.a.get())
+        self.flag.logic_check(self.a.get())
 
     def inc_double_register(self, register):
         # INC rr
@@ -403,13 +485,11 @@ class CPU(object):
     def dec(self, getCaller, setCaller):
         # 1 cycle
         data = (getCaller.get() - 1) & 0xFF
-        self.dec_inis_carry_finish(data, setCaller, 0x0F)
-        self.flag.is_subtraction = True
+        self.dec_inis_carry_finish(data, setCaller, 0x0F, subtraction=True)
 
-    def dec_inis_carry_finish(self, data, setCaller, compare):
-        self.flag.partial_reset(keep_is_carry=True)
-        self.flag.zero_check(data)
-        self.flag.is_half_carry = ((data & 0x0F) == compare)
+    def dec_inis_carry_finish(self, data, setCaller, compare,
+                              subtraction=False):
+        self.flag.inc_dec_check(data, compare, subtraction)
         setCaller.set(data)  # 1 cycle
 
     def rotate_left_circular(self, getCaller, setCaller):
@@ -421,19 +501,17 @@ class CPU(object):
 
     def rotate_left_circular_a(self):
         # RLCA rotate_left_circular_a 1 cycle
-        self.rotate_left_circular(RegisterCallWrapper(self.a),
-                                  RegisterCallWrapper(self.a))
+        self.rotate_left_circular(self.a, self.a)
 
     def rotate_left(self, getCaller, setCaller):
         # 1 cycle
         data = getCaller.get()
-        s = ((data & 0x7F) << 1) + int(self.flag.is_carry)
+        s = ((data & 0x7F) << 1) + int(self.flag.get_carry())
         self.flags_and_setter_finish(s, data, setCaller, 0x80)  # 1 cycle
 
     def rotate_left_a(self):
         # RLA  1 cycle
-        self.rotate_left(RegisterCallWrapper(self.a),
-                         RegisterCallWrapper(self.a))
+        self.rotate_left(self.a, self.a)
 
     def rotate_right_circular(self, getCaller, setCaller):
         data = getCaller.get()
@@ -443,21 +521,19 @@ class CPU(object):
 
     def rotate_right_circular_a(self):
         # RRCA 1 cycle
-        self.rotate_right_circular(RegisterCallWrapper(self.a),
-                                   RegisterCallWrapper(self.a))
+        self.rotate_right_circular(self.a, self.a)
 
     def rotate_right(self, getCaller, setCaller):
         # 1 cycle
         data = getCaller.get()
         s = (data >> 1)
-        if self.flag.is_carry:
+        if self.flag.get_carry():
             s += 0x80
         self.flags_and_setter_finish(s, data, setCaller)  # 1 cycle
 
     def rotate_right_a(self):
         # RRA 1 cycle
-        self.rotate_right(RegisterCallWrapper(self.a),
-                          RegisterCallWrapper(self.a))
+        self.rotate_right(self.a, self.a)
 
     def shift_left_arithmetic(self, getCaller, setCaller):
         # 2 cycles
@@ -480,17 +556,14 @@ class CPU(object):
     def flags_and_setter_finish(self, s, data, setCaller, compare_and=0x01):
         # 2 cycles
         s &= 0xFF
-        self.flag.reset()
-        self.flag.zero_check(s)
-        self.flag.is_carry_compare(data, compare_and)
+        self.flag.shift_check(s, data, compare_and)
         setCaller.set(s)  # 1 cycle
 
     def swap(self, getCaller, setCaller):
         # 1 cycle
         data = getCaller.get()
         s = ((data << 4) + (data >> 4)) & 0xFF
-        self.flag.reset()
-        self.flag.zero_check(s)
+        self.flag.logic_check(s)
         setCaller.set(s)
 
     def test_bit(self, getCaller, setCaller, n):
@@ -588,6 +661,7 @@ class CPU(object):
     def complement_a(self):
         # CPA
         self.a.set(self.a.get() ^ 0xFF)
+        self.flag.materialize()
         self.flag.is_subtraction = True
         self.flag.is_half_carry = True
 
@@ -688,7 +762,7 @@ class CPU(object):
 
     def ret(self):
         # RET 4 cycles
-        self.double_register_inverse_call(CPUPopCaller(self), self.pc)
+        self.double_register_inverse_call(self.pop_caller, self.pc)
 
     def conditional_return(self, cc):
         # RET cc 2,5 cycles
@@ -734,48 +808,54 @@ class CPU(object):
         self.fetch()
 
 
-# OP CODE META PROGRAMMING ===================================================
-# Call Wrappers --------------------------------------------------------------
-
-class CallWrapper(object):
-    def get(self, use_cycles=True):
-        raise Exception("called CallWrapper.get")
-
-    def set(self, value, use_cycles=True):
-        raise Exception("called CallWrapper.set")
+class FlatRegisterCPU(CPU):
+    """
+    The CPU on the flat register file: plain int registers and pairs composed
+    on access. Executes exactly like the CPU, the backend is chosen per
+    program (see GameBoy.cpu_class) so both can be benchmarked.
+    """
 
+    def ini_registers(self):
+        self.b = FlatRegister(self)
+        self.c = FlatRegister(self)
+        self.bc = FlatDoubleRegister(self, self.b, self.c, constants.RESET_BC)
 
-class NumberCallWrapper(CallWrapper):
-    def __init__(self, number):
-        self.number = number
+        self.d = FlatRegister(self)
+        self.e = FlatRegister(self)
+        self.de = FlatDoubleRegister(self, self.d, self.e, constants.RESET_DE)
 
-    def get(self, use_cycles=True):
-        return self.number
+        self.h = FlatRegister(self)
+        self.l = FlatRegister(self)
+        self.hl = FlatDoubleRegister(self, self.h, self.l, constants.RESET_HL)
 
-    def set(self, value, use_cycles=True):
-        raise Exception("called CallWrapper.set")
+        self.hli = ImmediatePseudoRegister(self, self.hl)
+        self.pc = ReservedDoubleRegister(self, reset_value=constants.RESET_PC)
+        self.sp = ReservedDoubleRegister(self, reset_value=constants.RESET_SP)
 
+        self.a = FlatRegister(self, constants.RESET_A)
+        self.flag = self.flag_register_class(self, constants.RESET_F)
+        self.af = FlagDoubleRegister(self, self.a, self.flag)
 
-class RegisterCallWrapper(CallWrapper):
-    def __init__(self, register):
-        self.register = register
 
-    def get(self, use_cycles=True):
-        return self.register.get(use_cycles)
+class LazyFlagCPU(FlatRegisterCPU):
+    """
+    The FlatRegisterCPU with lazily evaluated flags
+    """
+    flag_register_class = LazyFlagRegister
 
-    def set(self, value, use_cycles=True):
-        return self.register.set(value, use_cycles)
 
+# OP CODE META PROGRAMMING ===================================================
+# Call Wrappers --------------------------------------------------------------
 
-class DoubleRegisterCallWrapper(CallWrapper):
-    def __init__(self, register):
-        self.register = register
+class NumberCallWrapper(CallWrapper):
+    def __init__(self, number):
+        self.number = number
 
     def get(self, use_cycles=True):
-        return self.register.get(use_cycles)
+        return self.number
 
     def set(self, value, use_cycles=True):
-        return self.register.set(value, use_cycles)
+        raise Exception("called CallWrapper.set")
 
 
 class CPUPopCaller(CallWrapper):
@@ -795,9 +875,17 @@ class CPUFetchCaller(CallWrapper):
 
 
 # op_code LOOKUP TABLE GENERATION -----------------------------------------------
+# Every op code gets a dedicated handler (e.g. ld_b_c, add_a_hli, test_bit_3_h)
+# emitted at import time. The handlers pass the register fields of the CPU
+# straight to the implementing method, without wrapping or looking them up.
 
-GROUPED_REGISTERS = [CPU.get_b, CPU.get_c, CPU.get_d, CPU.get_e,
-                     CPU.get_h, CPU.get_l, CPU.get_hli, CPU.get_a]
+GROUPED_REGISTERS = ["b", "c", "d", "e", "h", "l", "hli", "a"]
+
+
+def emit_handler(name, call):
+    namespace = {"CPU": CPU}
+    exec "def %s(s):\n    %s\n" % (name, call) in namespace
+    return namespace[name]
 
 
 def create_group_op_codes(table):
@@ -805,32 +893,34 @@ def create_group_op_codes(table):
     for entry in table:
         op_code, step, function = entry[:3]
         if len(entry) == 4:
-            for registerGetter in GROUPED_REGISTERS:
+            for register in GROUPED_REGISTERS:
                 for n in entry[3]:
-                    op_codes.append((op_code, group_lambda(function, registerGetter, n)))
+                    op_codes.append((op_code, group_handler(function, register, n)))
                     op_code += step
         if len(entry) == 5:
             entryStep = entry[4]
-            for registerGetter in GROUPED_REGISTERS:
+            for register in GROUPED_REGISTERS:
                 stepop_code = op_code
                 for n in entry[3]:
-                    op_codes.append((stepop_code, group_lambda(function, registerGetter, n)))
+                    op_codes.append((stepop_code, group_handler(function, register, n)))
                     stepop_code += entryStep
                 op_code += step
         else:
-            for registerGetter in GROUPED_REGISTERS:
-                op_codes.append((op_code, group_lambda(function, registerGetter)))
+            for register in GROUPED_REGISTERS:
+                op_codes.append((op_code, group_handler(function, register)))
                 op_code += step
     return op_codes
 
 
-def group_lambda(function, register_getter, value=None):
+def group_handler(function, register, value=None):
+    name = function.__name__
     if value is None:
-        return lambda s: function(s, RegisterCallWrapper(register_getter(s)),
-                                  RegisterCallWrapper(register_getter(s)))
+        return emit_handler("%s_%s" % (name, register),
+                            "CPU.%s(s, s.%s, s.%s)" % (name, register, register))
     else:
-        return lambda s: function(s, RegisterCallWrapper(register_getter(s)),
-                                  RegisterCallWrapper(register_getter(s)), value)
+        return emit_handler("%s_%d_%s" % (name, value, register),
+                            "CPU.%s(s, s.%s, s.%s, %d)" % (name, register,
+                                                           register, value))
 
 
 def create_load_group_op_codes():
@@ -838,32 +928,33 @@ def create_load_group_op_codes():
     op_code = 0x40
     for storeRegister in GROUPED_REGISTERS:
         for loadRegister in GROUPED_REGISTERS:
-            if loadRegister != CPU.get_hli or storeRegister != CPU.get_hli:
-                op_codes.append((op_code, load_group_lambda(storeRegister, loadRegister)))
+            if loadRegister != "hli" or storeRegister != "hli":
+                op_codes.append((op_code, load_group_handler(storeRegister, loadRegister)))
             op_code += 1
     return op_codes
 
 
-def load_group_lambda(store_register, load_register):
-    return lambda s: CPU.load(s, RegisterCallWrapper(load_register(s)),
-                              RegisterCallWrapper(store_register(s)))
+def load_group_handler(store_register, load_register):
+    return emit_handler("ld_%s_%s" % (store_register, load_register),
+                        "CPU.load(s, s.%s, s.%s)" % (load_register,
+                                                     store_register))
 
 
 def create_register_op_codes(table):
     op_codes = []
     for entry in table:
         op_code, step, function = entry[:3]
-        for registerOrGetter in entry[3]:
-            op_codes.append((op_code, register_lambda(function, registerOrGetter)))
+        for argument in entry[3]:
+            op_codes.append((op_code, register_handler(function, argument)))
             op_code += step
     return op_codes
 
 
-def register_lambda(function, registerOrGetter):
-    if callable(registerOrGetter):
-        return lambda s: function(s, registerOrGetter(s))
-    else:
-        return lambda s: function(s, registerOrGetter)
+def register_handler(function, argument):
+    # argument is a register field ("bc") or a flag test ("is_z()")
+    name = function.__name__
+    return emit_handler("%s_%s" % (name, argument.rstrip("()")),
+                        "CPU.%s(s, s.%s)" % (name, argument))
 
 
 def initialize_op_code_table(table):
@@ -922,14 +1013,14 @@ FIRST_ORDER_OP_CODES = [
     (0xF8, CPU.store_fetch_added_sp_in_hl),
     (0xCB, CPU.fetch_execute),
     (0xCD, CPU.unconditional_call),
-    (0xC6, lambda s: CPU.add_a(s, CPUFetchCaller(s))),
-    (0xCE, lambda s: CPU.add_a_with_carry(s, CPUFetchCaller(s))),
+    (0xC6, lambda s: CPU.add_a(s, s.fetch_caller)),
+    (0xCE, lambda s: CPU.add_a_with_carry(s, s.fetch_caller)),
     (0xD6, CPU.fetch_subtract_a),
-    (0xDE, lambda s: CPU.subtract_with_carry_a(s, CPUFetchCaller(s))),
-    (0xE6, lambda s: CPU.and_a(s, CPUFetchCaller(s))),
-    (0xEE, lambda s: CPU.xor_a(s, CPUFetchCaller(s))),
-    (0xF6, lambda s: CPU.or_a(s, CPUFetchCaller(s))),
-    (0xFE, lambda s: CPU.compare_a(s, CPUFetchCaller(s))),
+    (0xDE, lambda s: CPU.subtract_with_carry_a(s, s.fetch_caller)),
+    (0xE6, lambda s: CPU.and_a(s, s.fetch_caller)),
+    (0xEE, lambda s: CPU.xor_a(s, s.fetch_caller)),
+    (0xF6, lambda s: CPU.or_a(s, s.fetch_caller)),
+    (0xFE, lambda s: CPU.compare_a(s, s.fetch_caller)),
     (0xC7, lambda s: CPU.restart(s, 0x00)),
     (0xCF, lambda s: CPU.restart(s, 0x08)),
     (0xD7, lambda s: CPU.restart(s, 0x10)),
@@ -956,9 +1047,9 @@ REGISTER_GROUP_OP_CODES = [
     (0x06, 0x08, CPU.fetch_load)
 ]
 
-REGISTER_SET_A = [CPU.get_bc, CPU.get_de, CPU.get_hl, CPU.get_sp]
-REGISTER_SET_B = [CPU.get_bc, CPU.get_de, CPU.get_hl, CPU.get_af]
-FLAG_REGISTER_SET = [CPU.is_not_z, CPU.is_z, CPU.is_not_c, CPU.is_c]
+REGISTER_SET_A = ["bc", "de", "hl", "sp"]
+REGISTER_SET_B = ["bc", "de", "hl", "af"]
+FLAG_REGISTER_SET = ["is_not_z()", "is_z()", "is_not_c()", "is_c()"]
 
 # Table for Register OP Codes: (startAddress, delta, method, registers)
 REGISTER_OP_CODES = [
@@ -0,0 +1,433 @@
+"""
+PyGirl Emulator
+
+Basic Block Cache
+
+Straight-line runs of code are decoded once into blocks of pre-bound
+instructions. Immediate operands are read while decoding, the handlers of
+those instructions get them from the block instead of fetching them. Blocks
+are keyed by their offset in the backing buffer (the ROM or the Work RAM) and
+not by the address, so switching ROM banks selects other blocks instead of
+flushing the cache. Writes into buffer pages that hold decoded code drop the
+blocks on that page.
+"""
+
+from pygirl import constants
+from pygirl.cpu import CPU, OP_CODES, FETCH_EXECUTE_OP_CODES, \
+                       process_2s_complement
+from pygirl.cpu_register import CallWrapper
+
+# Longest run of instructions decoded into a single block
+BLOCK_SIZE = 32
+
+# Buffer granularity used to invalidate blocks on writes
+CODE_PAGE_SHIFT = 8
+
+
+def create_instruction_lengths():
+    lengths = [1] * 256
+    for op_code in [0x06, 0x0E, 0x16, 0x1E, 0x26, 0x2E, 0x36, 0x3E,
+                    0x10, 0x18, 0x20, 0x28, 0x30, 0x38,
+                    0xC6, 0xCE, 0xD6, 0xDE, 0xE6, 0xEE, 0xF6, 0xFE,
+                    0xE0, 0xF0, 0xE8, 0xF8, 0xCB]:
+        lengths[op_code] = 2
+    for op_code in [0x01, 0x11, 0x21, 0x31, 0x08,
+                    0xC2, 0xC3, 0xCA, 0xD2, 0xDA,
+                    0xC4, 0xCC, 0xCD, 0xD4, 0xDC,
+                    0xEA, 0xFA]:
+        lengths[op_code] = 3
+    return lengths
+
+
+def create_block_end_op_codes():
+    # Instructions after which execution does not simply fall through:
+    # jumps, calls, returns, restarts, HALT/STOP and EI (which executes the
+    # next instruction itself).
+    ends = [False] * 256
+    for op_code in [0x18, 0x20, 0x28, 0x30, 0x38,
+                    0xC2, 0xC3, 0xCA, 0xD2, 0xDA, 0xE9,
+                    0xC4, 0xCC, 0xCD, 0xD4, 0xDC,
+                    0xC0, 0xC8, 0xC9, 0xD0, 0xD8, 0xD9,
+                    0xC7, 0xCF, 0xD7, 0xDF, 0xE7, 0xEF, 0xF7, 0xFF,
+                    0x10, 0x76, 0xFB]:
+        ends[op_code] = True
+    return ends
+
+
+# Memory operands of the idle loop instructions which are only known from the
+# registers when the loop runs
+READ_BC = -1
+READ_DE = -2
+READ_HL = -3
+READ_C = -4
+
+
+def create_idle_loop_op_codes():
+    # Instructions an idle loop may consist of: they change nothing but A and
+    # the flags, at most read memory and end the loop with a jump.
+    idle = create_idle_loop_jumps()
+    for op_code in [0x00, 0x0A, 0x1A, 0xF0, 0xF2, 0xFA,
+                    0xE6, 0xEE, 0xF6, 0xFE]:
+        idle[op_code] = True
+    for op_code in range(0x78, 0x80) + range(0xA0, 0xC0):
+        idle[op_code] = True
+    return idle
+
+
+def create_idle_loop_jumps():
+    jumps = [False] * 256
+    for op_code in [0x18, 0x20, 0x28, 0x30, 0x38,
+                    0xC2, 0xC3, 0xCA, 0xD2, 0xDA]:
+        jumps[op_code] = True
+    return jumps
+
+
+def create_idle_reads():
+    # Memory operand of the idle loop op codes which read through a register,
+    # immediate operands are resolved while decoding.
+    reads = [0] * 256
+    for op_code in [0x7E, 0xA6, 0xAE, 0xB6, 0xBE]:
+        reads[op_code] = READ_HL
+    reads[0x0A] = READ_BC
+    reads[0x1A] = READ_DE
+    reads[0xF2] = READ_C
+    return reads
+
+
+def is_idle_input(address):
+    """
+    Whether the value at address only changes through a write or a scheduled
+    hardware event. The divider and the timer counter are computed from the
+    cycles whenever they are read. The sound registers are left out, the
+    channel bits of NR52 change whenever the audio thread mixes.
+    """
+    if constants.NR10 <= address <= constants.AUD3WAVERAM + 0x0F:
+        return False
+    return address != constants.DIV and address != constants.TIMA
+
+
+# Immediate op code HANDLERS ---------------------------------------------------
+# Handlers of the op codes with an immediate operand, called with the CPU and
+# the decoded ImmediateInstruction. pc already points behind the operand. Each
+# one charges the cycles its fetching handler in the CPU does: a fetched byte
+# costs one cycle.
+
+def emit_immediate_handler(name, body):
+    namespace = {"CPU": CPU}
+    exec "def %s(s, i):\n    %s\n" % (name, body.replace("\n", "\n    ")) \
+        in namespace
+    return namespace[name]
+
+
+def create_immediate_op_codes():
+    op_codes = [None] * 256
+    # LD r,n and LD (HL),n
+    op_code = 0x06
+    for register in ["b", "c", "d", "e", "h", "l", "hli", "a"]:
+        op_codes[op_code] = emit_immediate_handler(
+            "ld_%s_immediate" % register,
+            "s.cycles -= 1\nCPU.load(s, i.operand, s.%s)" % register)
+        op_code += 0x08
+    # LD rr,nn
+    op_code = 0x01
+    for register in ["bc", "de", "hl", "sp"]:
+        op_codes[op_code] = emit_immediate_handler(
+            "ld_%s_immediate" % register,
+            "s.%s.set(i.value, use_cycles=False)\ns.cycles -= 3" % register)
+        op_code += 0x10
+    # ALU A,n
+    for op_code, function in [(0xC6, CPU.add_a),
+                              (0xCE, CPU.add_a_with_carry),
+                              (0xD6, CPU.subtract_a),
+                              (0xDE, CPU.subtract_with_carry_a),
+                              (0xE6, CPU.and_a),
+                              (0xEE, CPU.xor_a),
+                              (0xF6, CPU.or_a),
+                              (0xFE, CPU.compare_a)]:
+        op_codes[op_code] = emit_immediate_handler(
+            "%s_immediate" % function.__name__,
+            "s.cycles -= 1\nCPU.%s(s, i.operand)" % function.__name__)
+    # memory at an immediate address
+    op_codes[0xE0] = emit_immediate_handler(
+        "write_a_at_expanded_immediate_address",
+        "s.cycles -= 1\ns.write(0xFF00 + i.value, s.a.get())")
+    op_codes[0xF0] = emit_immediate_handler(
+        "store_memory_at_expanded_immediate_address_in_a",
+        "s.cycles -= 1\ns.a.set(s.read(0xFF00 + i.value))")
+    op_codes[0xEA] = emit_immediate_handler(
+        "store_a_at_immediate_address",
+        "s.cycles -= 2\ns.write(i.value, s.a.get())")
+    op_codes[0xFA] = emit_immediate_handler(
+        "store_immediate_memory_in_a",
+        "s.cycles -= 2\ns.a.set(s.read(i.value))")
+    # jumps and calls, the not taken branches skip the operand
+    op_codes[0x18] = emit_immediate_handler(
+        "relative_jump_immediate", "s.pc.add(i.value)")
+    op_codes[0xC3] = emit_immediate_handler(
+        "jump_immediate", "s.pc.set(i.value)\ns.cycles -= 3")
+    op_codes[0xCD] = emit_immediate_handler(
+        "unconditional_call_immediate", "s.cycles -= 2\ns.call(i.value)")
+    for index, condition in enumerate(["is_not_z()", "is_z()",
+                                       "is_not_c()", "is_c()"]):
+        name = condition.rstrip("()")
+        op_codes[0x20 + index * 0x08] = emit_immediate_handler(
+            "relative_conditional_jump_%s_immediate" % name,
+            "if s.%s:\n    s.pc.add(i.value)\nelse:\n    s.cycles -= 2"
+            % condition)
+        op_codes[0xC2 + index * 0x08] = emit_immediate_handler(
+            "conditional_jump_%s_immediate" % name,
+            "if s.%s:\n    s.pc.set(i.value)\n    s.cycles -= 3\n"
+            "else:\n    s.cycles -= 3" % condition)
+        op_codes[0xC4 + index * 0x08] = emit_immediate_handler(
+            "conditional_call_%s_immediate" % name,
+            "if s.%s:\n    s.cycles -= 2\n    s.call(i.value)\n"
+            "else:\n    s.cycles -= 3" % condition)
+    return op_codes
+
+
+INSTRUCTION_LENGTHS = create_instruction_lengths()
+BLOCK_END_OP_CODES = create_block_end_op_codes()
+IDLE_LOOP_JUMPS = create_idle_loop_jumps()
+IDLE_LOOP_OP_CODES = create_idle_loop_op_codes()
+IDLE_READS = create_idle_reads()
+IMMEDIATE_OP_CODES = create_immediate_op_codes()
+
+
+# ------------------------------------------------------------------------------
+
+class BlockInstruction(object):
+    def __init__(self, op_code, length):
+        self.op_code = op_code
+        self.length = length
+
+    def execute(self, cpu, pc):
+        """
+        Executes the instruction at pc and returns the address of the
+        instruction that follows it.
+        """
+        raise Exception("not implemented")
+
+
+class OpCodeInstruction(BlockInstruction):
+    def __init__(self, op_code, length):
+        BlockInstruction.__init__(self, op_code, length)
+        self.handler = OP_CODES[op_code]
+
+    def execute(self, cpu, pc):
+        # same bookkeeping as CPU.execute(CPU.fetch(use_cycles=False))
+        cpu.instruction_counter += 1
+        cpu.last_op_code = self.op_code
+        cpu.pc.set(pc + 1, use_cycles=False)
+        self.handler(cpu)
+        return (pc + self.length) & 0xFFFF
+
+
+class ImmediateOperand(CallWrapper):
+    """
+    The decoded immediate byte, passed where the handlers take a fetch caller
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, use_cycles=True):
+        return self.value
+
+
+class ImmediateInstruction(BlockInstruction):
+    """
+    An instruction with its immediate operand resolved while decoding. value
+    is the byte or little endian word, for relative jumps the signed offset.
+    """
+
+    def __init__(self, op_code, length, value):
+        BlockInstruction.__init__(self, op_code, length)
+        self.handler = IMMEDIATE_OP_CODES[op_code]
+        self.value = value
+        self.operand = ImmediateOperand(value)
+
+    def execute(self, cpu, pc):
+        # same bookkeeping as CPU.execute, pc skips the operand at once
+        cpu.instruction_counter += 1
+        cpu.last_op_code = self.op_code
+        next_pc = (pc + self.length) & 0xFFFF
+        cpu.pc.set(next_pc, use_cycles=False)
+        self.handler(cpu, self)
+        return next_pc
+
+
+class FetchExecuteInstruction(BlockInstruction):
+    """
+    A 0xCB prefixed instruction, the second op code is resolved while decoding
+    """
+
+    def __init__(self, fetch_execute_op_code):
+        BlockInstruction.__init__(self, 0xCB, 2)
+        self.fetch_execute_op_code = fetch_execute_op_code
+        self.handler = FETCH_EXECUTE_OP_CODES[fetch_execute_op_code]
+
+    def execute(self, cpu, pc):
+        # same bookkeeping as CPU.fetch_execute
+        cpu.instruction_counter += 1
+        cpu.last_op_code = 0xCB
+        cpu.last_fetch_execute_op_code = self.fetch_execute_op_code
+        cpu.pc.set(pc + 2, use_cycles=False)
+        cpu.cycles -= 1
+        self.handler(cpu)
+        return (pc + 2) & 0xFFFF
+
+
+# ------------------------------------------------------------------------------
+
+class CodeBlock(object):
+    def __init__(self, offset):
+        self.offset = offset
+        self.end = offset
+        self.instructions = []
+        self.valid = True
+        self.idle_loop = False
+        self.idle_reads = []
+
+    def is_empty(self):
+        return len(self.instructions) == 0
+
+    def reads_idle_inputs(self, cpu):
+        for read in self.idle_reads:
+            address = read
+            if read == READ_BC:
+                address = cpu.bc.get(use_cycles=False)
+            elif read == READ_DE:
+                address = cpu.de.get(use_cycles=False)
+            elif read == READ_HL:
+                address = cpu.hl.get(use_cycles=False)
+            elif read == READ_C:
+                address = 0xFF00 + cpu.c.get(use_cycles=False)
+            if not is_idle_input(address):
+                return False
+        return True
+
+
+class CodeCache(object):
+    """
+    Holds the decoded blocks of one buffer. Shared by all the BufferPages
+    which map a window of that buffer.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.blocks = {}
+        self.page_blocks = {}
+        self.code_pages = bytearray("\x00" * ((len(buffer) >>
+                                               CODE_PAGE_SHIFT) + 1))
+
+    def reset(self):
+        for block in self.blocks.values():
+            block.valid = False
+        self.blocks = {}
+        self.page_blocks = {}
+        for index in range(len(self.code_pages)):
+            self.code_pages[index] = 0
+
+    def get_block(self, page, address):
+        offset = page.base + (address & page.mask)
+        block = self.blocks.get(offset, None)
+        if block is None:
+            limit = min(page.base + page.mask + 1, len(self.buffer))
+            block = self.create_block(offset, limit)
+            self.add_block(block)
+        return block
+
+    def create_block(self, offset, limit):
+        block = CodeBlock(offset)
+        while len(block.instructions) < BLOCK_SIZE and offset < limit:
+            op_code = self.buffer[offset]
+            length = INSTRUCTION_LENGTHS[op_code]
+            if offset + length > limit:
+                break
+            if op_code == 0xCB:
+                instruction = FetchExecuteInstruction(self.buffer[offset + 1])
+            elif OP_CODES[op_code] is None:
+                break
+            elif IMMEDIATE_OP_CODES[op_code] is not None:
+                instruction = ImmediateInstruction(
+                    op_code, length, self.read_immediate(offset, length))
+            else:
+                instruction = OpCodeInstruction(op_code, length)
+            block.instructions.append(instruction)
+            offset += length
+            if BLOCK_END_OP_CODES[op_code]:
+                break
+        block.end = offset
+        self.check_idle_loop(block)
+        return block
+
+    def read_immediate(self, offset, length):
+        value = self.buffer[offset + 1]
+        if length == 3:
+            return value + (self.buffer[offset + 2] << 8)
+        if BLOCK_END_OP_CODES[self.buffer[offset]]:
+            # only the relative jumps end a block with a byte operand
+            return process_2s_complement(value)
+        return value
+
+    def check_idle_loop(self, block):
+        """
+        Marks the block as idle loop candidate if it ends with a jump and
+        otherwise only tests memory, see CPU.skip_idle_loop
+        """
+        if block.is_empty():
+            return
+        offset = block.offset
+        reads = []
+        for instruction in block.instructions:
+            op_code = instruction.op_code
+            if op_code == 0xCB:
+                # only BIT n,r
+                second = self.buffer[offset + 1]
+                if second < 0x40 or second >= 0x80:
+                    return
+                if (second & 0x07) == 0x06:
+                    reads.append(READ_HL)
+            elif not IDLE_LOOP_OP_CODES[op_code]:
+                return
+            elif op_code == 0xF0:
+                reads.append(0xFF00 + self.buffer[offset + 1])
+            elif op_code == 0xFA:
+                reads.append(self.buffer[offset + 1] +
+                             (self.buffer[offset + 2] << 8))
+            elif IDLE_READS[op_code] != 0:
+                reads.append(IDLE_READS[op_code])
+            offset += instruction.length
+        # whether the jump leads back to the start is seen when it is taken
+        if not IDLE_LOOP_JUMPS[block.instructions[-1].op_code]:
+            return
+        block.idle_loop = True
+        block.idle_reads = reads
+
+    def add_block(self, block):
+        self.blocks[block.offset] = block
+        first_page = block.offset >> CODE_PAGE_SHIFT
+        last_page = max(block.offset, block.end - 1) >> CODE_PAGE_SHIFT
+        for code_page in range(first_page, last_page + 1):
+            self.code_pages[code_page] = 1
+            if code_page in self.page_blocks:
+                self.page_blocks[code_page].append(block)
+            else:
+                self.page_blocks[code_page] = [block]
+
+    def write(self, offset):
+        """
+        Called for every write into the buffer, drops the blocks decoded from
+        the written page.
+        """
+        code_page = offset >> CODE_PAGE_SHIFT
+        if self.code_pages[code_page]:
+            self.invalidate_page(code_page)
+
+    def invalidate_page(self, code_page):
+        self.code_pages[code_page] = 0
+        for block in self.page_blocks[code_page]:
+            block.valid = False
+            if self.blocks.get(block.offset, None) is block:
+                del self.blocks[block.offset]
+        del self.page_blocks[code_page]
@@ -1,6 +1,21 @@
 # ---------------------------------------------------------------------------
 
-class AbstractRegister(object):
+class CallWrapper(object):
+    """
+    Source or target of a value for the op code handlers. Registers are call
+    wrappers themselves, so handlers can be bound to them directly.
+    """
+
+    def get(self, use_cycles=True):
+        raise Exception("called CallWrapper.get")
+
+    def set(self, value, use_cycles=True):
+        raise Exception("called CallWrapper.set")
+
+
+# ---------------------------------------------------------------------------
+
+class AbstractRegister(CallWrapper):
     invalid = False
 
     def get(self, use_cycles=True):
@@ -217,6 +232,103 @@ class ImmediatePseudoRegister(Register):
         return result
 
 
+# FLAT REGISTER FILE ===========================================================
+# Alternative backend without the lazy sync protocol of Register and
+# DoubleRegister: the 8bit registers are plain int fields and the pairs are
+# composed from them by shift and mask on every access. Selected by using the
+# FlatRegisterCPU.
+
+class FlatRegister(AbstractRegister):
+    def __init__(self, cpu, reset_value=0x00):
+        self.cpu = cpu
+        self.reset_value = self.value = reset_value
+
+    def reset(self):
+        self.value = self.reset_value
+
+    def get(self, use_cycles=True):
+        return self.value
+
+    def set(self, value, use_cycles=True):
+        self.value = value & 0xFF
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def add(self, value, use_cycles=True):
+        self.set(self.value + value, use_cycles)
+
+    def sub(self, value, use_cycles=True):
+        self.set(self.value - value, use_cycles)
+
+
+class FlatDoubleRegister(AbstractRegister):
+    def __init__(self, cpu, hi, lo, reset_value=0x0000):
+        self.cpu = cpu
+        self.reset_value = reset_value
+        self.hi = hi
+        self.lo = lo
+
+    def reset(self):
+        self.set(self.reset_value, use_cycles=False)
+
+    def get(self, use_cycles=True):
+        return (self.hi.value << 8) | self.lo.value
+
+    def set(self, value, use_cycles=True):
+        self.hi.value = (value >> 8) & 0xFF
+        self.lo.value = value & 0xFF
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def set_hi(self, hi=0, use_cycles=True):
+        self.hi.set(hi, use_cycles)
+
+    def set_lo(self, lo=0, use_cycles=True):
+        self.lo.set(lo, use_cycles)
+
+    def get_hi(self, use_cycles=True):
+        return self.hi.value
+
+    def get_lo(self, use_cycles=True):
+        return self.lo.value
+
+    def inc(self, use_cycles=True):
+        self.add(1, use_cycles=False)
+        if use_cycles:
+            self.cpu.cycles -= 2
+
+    def dec(self, use_cycles=True):
+        self.add(-1, use_cycles=False)
+        if use_cycles:
+            self.cpu.cycles -= 2
+
+    def add(self, value, use_cycles=True):
+        self.set(self.get() + value, use_cycles=False)
+        if use_cycles:
+            self.cpu.cycles -= 3
+
+
+# ------------------------------------------------------------------------------
+
+class FlagDoubleRegister(FlatDoubleRegister):
+    """
+    AF for both register files. The flags are not kept as the F byte and go
+    through get and set, so the pair is composed on every access.
+    """
+
+    def get(self, use_cycles=True):
+        return (self.hi.value << 8) | self.lo.get(use_cycles=False)
+
+    def set(self, value, use_cycles=True):
+        self.hi.value = (value >> 8) & 0xFF
+        self.lo.set(value & 0xFF, use_cycles=False)
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def get_lo(self, use_cycles=True):
+        return self.lo.get(use_cycles)
+
+
 # ------------------------------------------------------------------------------
 
 class FlagRegister(Register):
@@ -287,7 +399,66 @@ class FlagRegister(Register):
             self.s_flag = False
         self.lower = 0x00
 
-    def _get(self, use_cycles=True):
+    # Flag results of the ALU operations ---------------------------------------
+
+    def zero_check(self, value):
+        self.is_zero = ((value & 0xFF) == 0)
+
+    def add_check(self, s, a, data, subtraction=False):
+        # ADD, ADC and SBC, s is the unmasked result
+        self.reset()
+        # set the h flag if the 0x10 bit was affected
+        self.is_half_carry = (((s ^ a ^ data) & 0x10) != 0)
+        self.is_carry = (s > 0xFF or s < 0)
+        self.zero_check(s)
+        self.is_subtraction = subtraction
+
+    def compare_check(self, s, a):
+        # CP and SUB, s is the masked result
+        self.reset()
+        self.is_subtraction = True
+        self.zero_check(s)
+        self.is_carry = (s > a)
+        self.is_half_carry = (a & 0x0F) < (s & 0x0F)
+
+    def logic_check(self, s, half_carry=False):
+        # AND, XOR, OR and SWAP
+        self.reset()
+        self.zero_check(s)
+        self.is_half_carry = half_carry
+
+    def inc_dec_check(self, data, compare, subtraction=False):
+        # INC and DEC keep the carry
+        self.partial_reset(keep_is_carry=True)
+        self.zero_check(data)
+        self.is_half_carry = ((data & 0x0F) == compare)
+        self.is_subtraction = subtraction
+
+    def shift_check(self, s, data, compare_and):
+        # rotates and shifts, the carry is the shifted out bit of data
+        self.reset()
+        self.zero_check(s)
+        self.is_carry = ((data & compare_and) != 0)
+
+    # Reading the flags --------------------------------------------------------
+
+    def materialize(self):
+        # the flags are always up to date
+        pass
+
+    def get_zero(self):
+        return self.is_zero
+
+    def get_carry(self):
+        return self.is_carry
+
+    def get_half_carry(self):
+        return self.is_half_carry
+
+    def get_subtraction(self):
+        return self.is_subtraction
+
+    def get(self, use_cycles=True):
         value = 0
         value += (int(self.is_carry) << 4)
         value += (int(self.is_half_carry) << 5)
@@ -295,7 +466,7 @@ class FlagRegister(Register):
         value += (int(self.is_zero) << 7)
         return value + self.lower
 
-    def _set(self, value, use_cycles=True):
+    def set(self, value, use_cycles=True):
         self.is_carry = bool(value & (1 << 4))
         self.is_half_carry = bool(value & (1 << 5))
         self.is_subtraction = bool(value & (1 << 6))
@@ -304,13 +475,157 @@ class FlagRegister(Register):
         if use_cycles:
             self.cpu.cycles -= 1
 
-    def zero_check(self, value):
-        self.is_zero = ((value & 0xFF) == 0)
 
-    def is_carry_compare(self, value, compare_and=0x01, reset=False):
-        if reset:
-            self.reset()
-        self.is_carry = ((value & compare_and) != 0)
+# ------------------------------------------------------------------------------
+# Operations recorded by the LazyFlagRegister
+
+FLAGS_READY = 0
+FLAGS_ADD = 1
+FLAGS_COMPARE = 2
+FLAGS_LOGIC = 3
+FLAGS_INC_DEC = 4
+FLAGS_SHIFT = 5
 
-    def is_half_carry_compare(self, new, old):
-        self.is_half_carry = (old & 0x0F) < (new & 0x0F)
+
+class LazyFlagRegister(FlagRegister):
+    """
+    Most flag results are overwritten by the next ALU operation before a
+    conditional jump, PUSH AF or DAA looks at them. This register only
+    records the kind, result and operands of the last ALU operation, the
+    flags are computed once they are read (materialize). The flags known when
+    recording (N, the kept carry of INC/DEC, the half carry of AND) are
+    recorded as they are. Selected by using the LazyFlagCPU.
+    """
+
+    def reset(self):
+        self.operation = FLAGS_READY
+        self.result = 0
+        self.operand_a = 0
+        self.operand_b = 0
+        self.recorded_subtraction = False
+        self.recorded_half_carry = False
+        self.recorded_carry = False
+        FlagRegister.reset(self)
+
+    def partial_reset(self, keep_is_zero=False, keep_is_subtraction=False,
+                      keep_is_half_carry=False, keep_is_carry=False, \
+                      keep_p=False, keep_s=False):
+        if keep_is_zero or keep_is_subtraction or keep_is_half_carry or \
+                keep_is_carry:
+            self.materialize()
+        else:
+            self.operation = FLAGS_READY
+        FlagRegister.partial_reset(self, keep_is_zero, keep_is_subtraction,
+                                   keep_is_half_carry, keep_is_carry,
+                                   keep_p, keep_s)
+
+    # Recording the ALU operations ---------------------------------------------
+
+    def add_check(self, s, a, data, subtraction=False):
+        # ADD, ADC and SBC, s is the unmasked result
+        self.operation = FLAGS_ADD
+        self.result = s
+        self.operand_a = a
+        self.operand_b = data
+        self.recorded_subtraction = subtraction
+        self.lower = 0x00
+
+    def compare_check(self, s, a):
+        # CP and SUB, s is the masked result
+        self.operation = FLAGS_COMPARE
+        self.result = s
+        self.operand_a = a
+        self.recorded_subtraction = True
+        self.lower = 0x00
+
+    def logic_check(self, s, half_carry=False):
+        # AND, XOR, OR and SWAP
+        self.operation = FLAGS_LOGIC
+        self.result = s
+        self.recorded_subtraction = False
+        self.recorded_half_carry = half_carry
+        self.lower = 0x00
+
+    def inc_dec_check(self, data, compare, subtraction=False):
+        # INC and DEC keep the carry
+        self.recorded_carry = self.compute_carry()
+        self.operation = FLAGS_INC_DEC
+        self.result = data
+        self.operand_a = compare
+        self.recorded_subtraction = subtraction
+        self.lower = 0x00
+
+    def shift_check(self, s, data, compare_and):
+        # rotates and shifts, the carry is the shifted out bit of data
+        self.operation = FLAGS_SHIFT
+        self.result = s
+        self.operand_a = data
+        self.operand_b = compare_and
+        self.recorded_subtraction = False
+        self.lower = 0x00
+
+    # Computing the flags ------------------------------------------------------
+
+    def materialize(self):
+        if self.operation == FLAGS_READY:
+            return
+        self.is_zero = (self.result & 0xFF) == 0
+        self.is_subtraction = self.recorded_subtraction
+        self.is_half_carry = self.compute_half_carry()
+        self.is_carry = self.compute_carry()
+        self.p_flag = False
+        self.s_flag = False
+        self.operation = FLAGS_READY
+
+    def compute_half_carry(self):
+        operation = self.operation
+        s = self.result
+        if operation == FLAGS_ADD:
+            return ((s ^ self.operand_a ^ self.operand_b) & 0x10) != 0
+        elif operation == FLAGS_COMPARE:
+            return (self.operand_a & 0x0F) < (s & 0x0F)
+        elif operation == FLAGS_INC_DEC:
+            return (s & 0x0F) == self.operand_a
+        elif operation == FLAGS_LOGIC:
+            return self.recorded_half_carry
+        return False
+
+    def compute_carry(self):
+        operation = self.operation
+        if operation == FLAGS_READY:
+            return self.is_carry
+        elif operation == FLAGS_ADD:
+            return self.result > 0xFF or self.result < 0
+        elif operation == FLAGS_COMPARE:
+            return self.result > self.operand_a
+        elif operation == FLAGS_INC_DEC:
+            return self.recorded_carry
+        elif operation == FLAGS_SHIFT:
+            return (self.operand_a & self.operand_b) != 0
+        return False
+
+    def get_zero(self):
+        if self.operation != FLAGS_READY:
+            return (self.result & 0xFF) == 0
+        return self.is_zero
+
+    def get_carry(self):
+        if self.operation != FLAGS_READY:
+            return self.compute_carry()
+        return self.is_carry
+
+    def get_half_carry(self):
+        self.materialize()
+        return self.is_half_carry
+
+    def get_subtraction(self):
+        self.materialize()
+        return self.is_subtraction
+
+    def get(self, use_cycles=True):
+        self.materialize()
+        return FlagRegister.get(self, use_cycles)
+
+    def set(self, value, use_cycles=True):
+        self.operation = FLAGS_READY
+        FlagRegister.set(self, value, use_cycles)
@@ -94,6 +94,8 @@ class GameboyComparator(Comparator):
 
     @PrintFrame("comparing cycles")
     def compare_cycles(self, data):
+        # the components are evaluated lazily, catch them up first
+        self.gameboy.scheduler.sync_components()
         cmp = [
             ("video", self.gameboy.video.cycles, "video"),
             ("cpu", self.gameboy.cpu.cycles, "cpu"),
@@ -285,7 +287,6 @@ class VideoComparator(Comparator):
     @PrintFrame("comparing registers")
     def compare_registers(self, data):
         cmp = [
-            ("dirty", self.video.dirty, "dirty"),
             ("display", self.video.display, "display"),
             ("bgp", self.video.background_palette, "bgp"),
             ("dma", self.video.dma, "dma"),
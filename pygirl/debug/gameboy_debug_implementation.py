@@ -12,11 +12,16 @@ import pdb
 
 # GAMEBOY ----------------------------------------------------------------------
 class GameBoyDebugImplementation(GameBoyImplementation):
+    # the comparator checks the frame skip against the reference emulator
+    adaptive_frame_skip = False
+
     def __init__(self, debugger_port, debug_connection_class=None,
                  skip_execs=0, in_between_skip=1000):
         GameBoyImplementation.__init__(self)
         self.cpu = DebugCPU(self.interrupt, self)
         self.video = DebugVideo(self.video_driver, self.interrupt, self)
+        self.create_scheduler()
+        self.create_memory_map()
         self.rom = self.cpu.rom
         self.debug_connection = debug_connection_class(self, debugger_port,
                                                        skip_execs,
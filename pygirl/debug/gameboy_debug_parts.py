@@ -6,6 +6,9 @@ from pygirl.video_mode import *
 
 
 class DebugCPU(CPU):
+    # every executed op code has to go through execute
+    use_block_cache = False
+
     def fetch_execute(self):
         CPU.fetch_execute(self)
         debug_util.log(self.last_fetch_execute_op_code, is_fetch_execute=True)
@@ -18,6 +21,9 @@ class DebugCPU(CPU):
 
 
 class DebugVideo(Video):
+    # video.line and the palette are compared after every line
+    use_line_cache = False
+
     def __init__(self, video_driver, interrupt, memory):
         Video.__init__(self, video_driver, interrupt, memory)
         self.status = DebugStatusRegister(self)
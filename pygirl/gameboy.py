@@ -6,10 +6,15 @@ GameBoy Scheduler and Memory Mapper
 """
 from pygirl import constants
 from pygirl.cpu import CPU
+from pygirl.cpu_block import CodeCache
 from pygirl.interrupt import Interrupt
 from pygirl.cartridge import CartridgeManager
 from pygirl.joypad import Joypad, JoypadDriver
+from pygirl.memory_map import MemoryMap, BufferPage, IOPage
 from pygirl.ram import missingMemory, RAM
+from pygirl.save_state import StateWriter, StateReader, \
+    InvalidSaveStateException
+from pygirl.scheduler import Scheduler
 from pygirl.serial import Serial
 from pygirl.sound import Sound, SoundDriver
 from pygirl.timer import Timer, Clock
@@ -18,9 +23,15 @@ from pygirl.cartridge import CartridgeManager, CartridgeFile
 
 
 class GameBoy(object):
+    # CPU, FlatRegisterCPU or LazyFlagCPU, fixed per program since the
+    # register backends must not meet in one translation
+    cpu_class = CPU
+
     def __init__(self):
         self.create_drivers()
         self.create_gameboy_elements()
+        self.create_scheduler()
+        self.create_memory_map()
 
     def create_drivers(self):
         self.joypad_driver = JoypadDriver()
@@ -32,20 +43,41 @@ class GameBoy(object):
         self.ram = RAM()
         self.cartridge_manager = CartridgeManager(self.clock)
         self.interrupt = Interrupt()
-        self.cpu = CPU(self.interrupt, self)
+        self.cpu = self.cpu_class(self.interrupt, self)
         self.serial = Serial(self.interrupt)
         self.timer = Timer(self.interrupt)
         self.joypad = Joypad(self.joypad_driver, self.interrupt)
         self.video = Video(self.video_driver, self.interrupt, self)
         self.sound = Sound()
 
+    def create_scheduler(self):
+        # The sound never asks to be woken, it is synced to time its writes,
+        # the RTC clock is only synced when a cartridge reads the time.
+        self.scheduler = Scheduler(self.cpu)
+        self.scheduler.add_component(self.video)
+        self.scheduler.add_component(self.timer)
+        self.scheduler.add_component(self.serial)
+        self.scheduler.add_component(self.joypad)
+        self.scheduler.add_component(self.sound)
+        self.scheduler.add_component(self.clock)
+        self.scheduler.reset()
+
     def get_cartridge_manager(self):
         return self.cartridge_manager
 
     def load_cartridge(self, cartridge, verify=True):
         self.cartridge_manager.load(cartridge, verify)
+        self.attach_cartridge()
+
+    def share_cartridge(self, other):
+        self.cartridge_manager.share(other.cartridge_manager)
+        self.attach_cartridge()
+
+    def attach_cartridge(self):
         self.cpu.set_rom(self.cartridge_manager.get_rom())
         self.memory_bank_controller = self.cartridge_manager.get_memory_bank()
+        self.cpu.set_rom_bank_page(self.memory_bank_controller.rom_bank_page)
+        self.map_cartridge()
 
     def load_cartridge_file(self, path, verify=True):
         self.load_cartridge(CartridgeFile(path), verify)
@@ -67,6 +99,7 @@ class GameBoy(object):
 
     def reset(self):
         self.ram.reset()
+        self.work_ram_code_cache.reset()
         self.memory_bank_controller.reset()
         self.interrupt.reset()
         self.cpu.reset()
@@ -75,35 +108,80 @@ class GameBoy(object):
         self.joypad.reset()
         self.video.reset()
         self.sound.reset()
+        self.scheduler.reset()
         self.cpu.set_rom(self.cartridge_manager.get_rom())
         self.draw_logo()
 
+    def save_state(self):
+        """
+        Returns a snapshot of the whole machine. Only valid between two
+        emulate calls, the lazily evaluated components are caught up first.
+        """
+        self.scheduler.sync_components()
+        writer = StateWriter()
+        writer.write_int(self.cartridge_manager.get_checksum())
+        self.cpu.save_state(writer)
+        self.interrupt.save_state(writer)
+        self.ram.save_state(writer)
+        self.clock.save_state(writer)
+        self.memory_bank_controller.save_state(writer)
+        self.timer.save_state(writer)
+        self.serial.save_state(writer)
+        self.joypad.save_state(writer)
+        self.video.save_state(writer)
+        self.sound.save_state(writer)
+        return writer.get_data()
+
+    def load_state(self, data):
+        reader = StateReader(data)
+        if reader.read_int() != self.cartridge_manager.get_checksum():
+            raise InvalidSaveStateException("Save state of another cartridge")
+        self.cpu.load_state(reader)
+        self.interrupt.load_state(reader)
+        self.ram.load_state(reader)
+        self.clock.load_state(reader)
+        self.memory_bank_controller.load_state(reader)
+        self.timer.load_state(reader)
+        self.serial.load_state(reader)
+        self.joypad.load_state(reader)
+        self.video.load_state(reader)
+        self.sound.load_state(reader)
+        reader.check_end()
+        # blocks compiled from the old work ram are stale, the deadlines are
+        # recomputed from the loaded state
+        self.work_ram_code_cache.reset()
+        self.scheduler.reset()
+
+    def fork(self):
+        """
+        Returns an independent copy of this GameBoy, e.g. to try different
+        inputs from the same point. The copy shares the cartridge ROM and the
+        blocks decoded from it, everything mutable is copied through a save
+        state. Like save_state only valid between two emulate calls.
+        """
+        gameboy = GameBoy()
+        gameboy.share_cartridge(self)
+        gameboy.load_state(self.save_state())
+        return gameboy
+
     def get_cycles(self):
-        # RPython supports only two arguments in min()
-        return min(min(min(self.video.get_cycles(), self.serial.get_cycles()),
-                       self.timer.get_cycles()), self.joypad.get_cycles())
+        return self.scheduler.get_cycles()
 
     def emulate(self, ticks):
-        while ticks > 0:
-            count = self.get_cycles()
-            self.cpu.emulate(count)
-            self.serial.emulate(count)
-            self.timer.emulate(count)
-            self.video.emulate(count)
-            self.joypad.emulate(count)
-            # self.print_cycles()
-            if count == 0:
-                # self.print_cycles()
-                return 0
-            ticks -= count
+        self.wake_joypad()
+        self.scheduler.emulate(ticks)
         return 0
 
     def emulate_step(self):
+        self.wake_joypad()
         self.cpu.emulate_step()
-        self.serial.emulate(1)
-        self.timer.emulate(1)
-        self.video.emulate(1)
-        self.joypad.emulate(1)
+        self.scheduler.step(1)
+
+    def wake_joypad(self):
+        # the driver changes between emulate calls, a pressed button wakes
+        # the joypad at its next poll
+        self.joypad.sync()
+        self.joypad.reschedule()
 
     def print_cycles(self):
         return
@@ -115,11 +193,51 @@ class GameBoy(object):
         #    pass
 
     def write(self, address, data):
-        self.get_receiver(address).write(address, data)
-        if address in (constants.STAT, 0xFFFF):
+        self.memory_map.write(address, data)
+        # writes which can raise an enabled interrupt are serviced at once
+        if address in (constants.JOYP, constants.IF, constants.STAT,
+                       constants.LYC, constants.IE):
             self.cpu.handle_pending_interrupts()
 
-    def read(self, address): return self.get_receiver(address).read(address)
+    def read(self, address): return self.memory_map.read(address)
+
+    def copy_block(self, address, target, length):
+        self.memory_map.copy_block(address, target, length)
+
+    def create_memory_map(self):
+        """
+        Builds the page tables used by read and write. The layout is the one
+        described in get_receiver, except that plain memory (ROM, Work RAM and
+        the Video RAM for reading) is mapped as direct buffer pages.
+        """
+        self.memory_map = MemoryMap()
+        io_page = IOPage()
+        for address in range(0xFF00, 0xFFFF + 1):
+            io_page.map(address, self.get_receiver(address))
+        self.memory_map.map_pages(0x80, 0x9F,
+                                  BufferPage(self.video.vram, 0, 0x1FFF),
+                                  self.video)
+        self.work_ram_code_cache = CodeCache(self.ram.work_ram)
+        work_ram_page = BufferPage(self.ram.work_ram, 0, 0x1FFF,
+                                   self.work_ram_code_cache)
+        self.memory_map.map_pages(0xC0, 0xFD, work_ram_page,
+                                  code_page=work_ram_page)
+        self.memory_map.map_pages(0xFE, 0xFE, self.video)
+        self.memory_map.map_pages(0xFF, 0xFF, io_page)
+        if self.cartridge_manager.get_memory_bank() is not None:
+            self.map_cartridge()
+
+    def map_cartridge(self):
+        # The switchable bank page is moved by the MBC itself on bank switches
+        mbc = self.cartridge_manager.get_memory_bank()
+        self.memory_map.map_pages(0x00, 0x3F, mbc.rom_page, mbc,
+                                  code_page=mbc.rom_page)
+        self.memory_map.map_pages(0x40, 0x7F, mbc.rom_bank_page, mbc,
+                                  code_page=mbc.rom_bank_page)
+        self.memory_map.map_pages(0xA0, 0xBF, mbc)
+
+    def get_code_page(self, address):
+        return self.memory_map.get_code_page(address)
 
     def print_receiver_msg(self, address, name):
         # print "    recei: ", hex(address), name
@@ -127,6 +245,9 @@ class GameBoy(object):
 
     def get_receiver(self, address):
         """
+        Reference layout of the memory map, create_memory_map derives the
+        page tables from it.
+
         General Memory Map
         0000-3FFF   16KB ROM Bank 00     (in cartridge, fixed at bank 00)
         4000-7FFF   16KB ROM Bank 01..NN (in cartridge, switchable bank number)
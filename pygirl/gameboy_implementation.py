@@ -5,6 +5,7 @@ from pygirl.joypad import JoypadDriver
 from pygirl.video import VideoDriver
 from pygirl.sound import Sound, SoundDriver
 from pygirl.timer import Clock
+from pygirl.cartridge import BackgroundCartridgeFile
 from pygirl.video_meta import TileDataWindow, SpriteWindow, \
     WindowPreview, BackgroundPreview, \
     MapAViewer, MapBViewer, \
@@ -32,6 +33,18 @@ def delay(secs): return RSDL.Delay(int(secs * 1000))
 # 64 frames per second
 FPS = 64
 
+# Adaptive frame skip: drop up to MAX_FRAME_SKIP frames in a row once
+# FRAME_SKIP_PATIENCE cycles in a row missed their time budget, draw them
+# again once as many cycles in a row finished well within it
+MAX_FRAME_SKIP = 4
+FRAME_SKIP_PATIENCE = 8
+FRAME_SKIP_SPARE = 0.75
+
+# Seconds between two background saves of the battery RAM
+BATTERY_SAVE_INTERVAL = 5.0
+# Emulated seconds between two resyncs of the RTC to the wall clock
+RTC_RESYNC_INTERVAL = 60
+
 # RSDL hacks
 
 assignAudioCallbackSig = """
@@ -51,12 +64,30 @@ assignAudioCallback = rffi.llexternal("assignAudioCallback",
 # GAMEBOY ----------------------------------------------------------------------
 
 class GameBoyImplementation(GameBoy):
+    adaptive_frame_skip = True
+
     def __init__(self):
         GameBoy.__init__(self)
         self.is_running = False
         self.penalty = 0
         self.sync_time = int(time.time())
+        self.slow_cycles = 0
+        self.fast_cycles = 0
+        self.battery_save_interval = BATTERY_SAVE_INTERVAL
+        self.battery_save_time = 0.0
+
+    def create_gameboy_elements(self):
+        GameBoy.create_gameboy_elements(self)
+        # the SDL audio callback mixes the module level sound, it has to be
+        # the one mapped into the memory
         self.sound = getSound()
+        # the RTC follows the emulation, when it runs faster or slower than
+        # real time it is resynced to the wall clock now and then
+        self.clock.set_resync_interval(RTC_RESYNC_INTERVAL)
+
+    def load_cartridge_file(self, path, verify=True):
+        # the battery is saved in the background while the emulation runs
+        self.load_cartridge(BackgroundCartridgeFile(path), verify)
 
     def open_window(self):
         self.init_sdl()
@@ -85,8 +116,10 @@ class GameBoyImplementation(GameBoy):
     def mainLoop(self):
         self.reset()
         self.is_running = True
+        self.battery_save_time = time.time()
         while self.is_running:
             self.emulate_cycle()
+        self.cartridge_manager.save_battery()
         # try:
         #    while self.is_running:
         #        self.emulate_cycle()
@@ -100,6 +133,8 @@ class GameBoyImplementation(GameBoy):
         # Come back to this cycle every 1/FPS seconds
         self.emulate(constants.GAMEBOY_CLOCK / FPS)
         spent = time.time() - self.sync_time
+        if self.adaptive_frame_skip:
+            self.update_frame_skip(spent)
         left = 1.0 / FPS + self.penalty - spent
         if left > 0:
             delay(left)
@@ -108,6 +143,35 @@ class GameBoyImplementation(GameBoy):
             # Fade out penalties over time.
             self.penalty = left - self.penalty / 2
         self.sync_time = time.time()
+        if self.sync_time - self.battery_save_time >= self.battery_save_interval:
+            self.cartridge_manager.save_battery(background=True)
+            self.battery_save_time = self.sync_time
+
+    def update_frame_skip(self, spent):
+        """
+        Adjusts the frame skip to the time the last cycle took. Skipped frames
+        are still emulated, only drawing the lines and the frame is left out,
+        so the video timing and its interrupts stay exact.
+        """
+        budget = 1.0 / FPS
+        frame_skip = self.get_frame_skip()
+        if spent > budget:
+            self.slow_cycles += 1
+            self.fast_cycles = 0
+            if self.slow_cycles >= FRAME_SKIP_PATIENCE:
+                self.slow_cycles = 0
+                if frame_skip < MAX_FRAME_SKIP:
+                    self.set_frame_skip(frame_skip + 1)
+        elif spent < budget * FRAME_SKIP_SPARE:
+            self.fast_cycles += 1
+            self.slow_cycles = 0
+            if self.fast_cycles >= FRAME_SKIP_PATIENCE:
+                self.fast_cycles = 0
+                if frame_skip > 0:
+                    self.set_frame_skip(frame_skip - 1)
+        else:
+            self.slow_cycles = 0
+            self.fast_cycles = 0
 
     def handle_execution_error(self, error):
         lltype.free(self.event, flavor='raw')
@@ -154,6 +218,10 @@ class VideoDriverImplementation(VideoDriver):
         fmt = self.screen.c_format
         self.colors = [RSDL.MapRGB(fmt, *color) for color in self.COLOR_MAP]
         self.blit_rect = RSDL_helper.mallocrect(0, 0, self.scale, self.scale)
+        # Without HWSURFACE the screen is a software surface which keeps its
+        # contents between frames, so only changed rows have to be drawn
+        self.drawn_pixels = bytearray(str(self.pixels))
+        self.full_redraw = True
 
     def create_meta_windows(self, gameboy):
         upper_meta_windows = [SpritesWindow(gameboy),
@@ -192,15 +260,38 @@ class VideoDriverImplementation(VideoDriver):
         pixels = rffi.cast(rffi.UINTP, self.screen.c_pixels)
         # NB: pitch is pre-shifted for bytes/pixel, which is always 4
         pitch = rffi.getintfield(self.screen, "c_pitch") >> 2
+        scale = self.scale
+        row_size = rffi.cast(rffi.SIZE_T, constants.GAMEBOY_SCREEN_WIDTH *
+                             scale * rffi.sizeof(rffi.UINT))
         for y in range(constants.GAMEBOY_SCREEN_HEIGHT):
+            if not self.update_drawn_row(y) and not self.full_redraw:
+                continue
+            # expand the row once, the other scale - 1 rows are copies of it
+            row = y * scale * pitch
             for x in range(constants.GAMEBOY_SCREEN_WIDTH):
                 color = rffi.cast(rffi.UINT,
                                   self.colors[self.get_pixel(x, y)])
-                start_x = x * self.scale
-                start_y = y * self.scale
-                for sx in range(start_x, start_x + self.scale):
-                    for sy in range(start_y, start_y + self.scale):
-                        pixels[sx + sy * pitch] = color
+                start = row + x * scale
+                for sx in range(scale):
+                    pixels[start + sx] = color
+            source = rffi.cast(rffi.VOIDP, rffi.ptradd(pixels, row))
+            for sy in range(1, scale):
+                target = rffi.ptradd(pixels, row + sy * pitch)
+                rffi.c_memcpy(rffi.cast(rffi.VOIDP, target), source, row_size)
+        self.full_redraw = False
+
+    def update_drawn_row(self, y):
+        """
+        Copies the row to drawn_pixels, returns False if it did not change
+        since it was drawn last.
+        """
+        start = self.get_line_start(y)
+        changed = False
+        for index in range(start, start + constants.GAMEBOY_SCREEN_WIDTH):
+            if self.drawn_pixels[index] != self.pixels[index]:
+                self.drawn_pixels[index] = self.pixels[index]
+                changed = True
+        return changed
 
 
 # JOYPAD DRIVER ----------------------------------------------------------------
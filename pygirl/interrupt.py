@@ -84,6 +84,14 @@ class Interrupt(iMemory):
         for flag in self.interrupt_flags:
             flag.reset()
 
+    def save_state(self, writer):
+        writer.write_byte(self.get_enable_mask())
+        writer.write_byte(self.get_interrupt_flag())
+
+    def load_state(self, reader):
+        self.set_enable_mask(reader.read_byte())
+        self.set_interrupt_flag(reader.read_byte())
+
     def write(self, address, data):
         if address == constants.IE:
             self.set_enable_mask(data)
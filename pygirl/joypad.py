@@ -1,9 +1,9 @@
 from pygirl import constants
 from pygirl.interrupt import Interrupt
-from pygirl.ram import iMemory
+from pygirl.scheduler import ScheduledComponent, NO_EVENT
 
 
-class Joypad(iMemory):
+class Joypad(ScheduledComponent):
     """
     PyGirl Emulator
     Joypad Input
@@ -36,15 +36,31 @@ class Joypad(iMemory):
         self.button_code = 0xF
         self.cycles = constants.JOYPAD_CLOCK
 
+    def save_state(self, writer):
+        writer.write_byte(self.read_control)
+        writer.write_byte(self.button_code)
+        writer.write_int(self.cycles)
+
+    def load_state(self, reader):
+        self.read_control = reader.read_byte()
+        self.button_code = reader.read_byte()
+        self.cycles = reader.read_int()
+
     def get_cycles(self):
-        return self.cycles
+        # polling an unchanged driver does nothing, the joypad only has to be
+        # woken at its next poll when a button changed
+        if self.driver.raised:
+            return self.cycles
+        return NO_EVENT
 
     def emulate(self, ticks):
         self.cycles -= ticks
         if self.cycles <= 0:
             if self.driver.is_raised():
                 self.update()
-            self.cycles = constants.JOYPAD_CLOCK
+            # the polls keep their JOYPAD_CLOCK phase when catching up
+            self.cycles = constants.JOYPAD_CLOCK - \
+                (-self.cycles) % constants.JOYPAD_CLOCK
 
     def write(self, address, data):
         if address == constants.JOYP:
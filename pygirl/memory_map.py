@@ -0,0 +1,109 @@
+"""
+PyGirl Emulator
+
+Page Table Memory Map
+
+The 64KB address space is split into 256 pages of 256 bytes. Every page has a
+reader and a writer, so dispatching an access costs one list index and one
+call, no matter where the address lives.
+"""
+
+from pygirl.ram import iMemory, missingMemory
+
+PAGE_SIZE = 0x100
+PAGE_COUNT = 0x100
+
+
+class BufferPage(iMemory):
+    """
+    Maps a window of a bytearray straight into the address space.
+    The window starts at base and wraps with mask, so one page object can back
+    several consecutive pages (e.g. a whole 16KB ROM bank). Moving the window,
+    for instance on a bank switch, only means updating base.
+    Pages holding executable code carry the CodeCache of their buffer.
+    """
+
+    def __init__(self, buffer, base=0, mask=PAGE_SIZE - 1, code_cache=None):
+        self.buffer = buffer
+        self.base = base
+        self.mask = mask
+        self.code_cache = code_cache
+
+    def read(self, address):
+        return self.buffer[self.base + (address & self.mask)]
+
+    def copy_block(self, address, target, length):
+        buffer = self.buffer
+        offset = self.base + (address & self.mask)
+        for index in range(length):
+            target[index] = buffer[offset + index]
+
+    def write(self, address, data):
+        offset = self.base + (address & self.mask)
+        self.buffer[offset] = data & 0xFF
+        if self.code_cache is not None:
+            self.code_cache.write(offset)
+
+
+class IOPage(iMemory):
+    """
+    A page whose bytes belong to different receivers, like the I/O ports and
+    the High RAM in FF00-FFFF.
+    """
+
+    def __init__(self):
+        self.receivers = [missingMemory] * PAGE_SIZE
+
+    def map(self, address, receiver):
+        self.receivers[address & 0xFF] = receiver
+
+    def read(self, address):
+        return self.receivers[address & 0xFF].read(address)
+
+    def write(self, address, data):
+        self.receivers[address & 0xFF].write(address, data)
+
+
+class MemoryMap(iMemory):
+    def __init__(self):
+        self.readers = [missingMemory] * PAGE_COUNT
+        self.writers = [missingMemory] * PAGE_COUNT
+        self.code_pages = [None] * PAGE_COUNT
+
+    def map_pages(self, first_page, last_page, reader, writer=None,
+                  code_page=None):
+        """
+        Maps reader and writer on the given pages. code_page is the
+        BufferPage the CPU may decode blocks from, if the reader is one.
+        """
+        if writer is None:
+            writer = reader
+        for page in range(first_page, last_page + 1):
+            self.readers[page] = reader
+            self.writers[page] = writer
+            self.code_pages[page] = code_page
+
+    def get_reader(self, address):
+        return self.readers[(address >> 8) & 0xFF]
+
+    def get_writer(self, address):
+        return self.writers[(address >> 8) & 0xFF]
+
+    def get_code_page(self, address):
+        return self.code_pages[(address >> 8) & 0xFF]
+
+    def read(self, address):
+        address &= 0xFFFF
+        return self.readers[address >> 8].read(address)
+
+    def write(self, address, data):
+        address &= 0xFFFF
+        self.writers[address >> 8].write(address, data)
+
+    def copy_block(self, address, target, length):
+        """
+        Copies a block that lies within a single page, e.g. the source of an
+        OAM DMA transfer, into target with one dispatch for the whole block.
+        """
+        address &= 0xFFFF
+        self.readers[address >> 8].copy_block(address, target, length)
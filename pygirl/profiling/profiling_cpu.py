@@ -3,6 +3,9 @@ from pygirl.cpu import CPU
 
 
 class ProfilingCPU(CPU):
+    # op codes come from the list, not from memory
+    use_block_cache = False
+
     def __init__(self, interrupt, memory):
         CPU.__init__(self, interrupt, memory)
         self.op_codes = []
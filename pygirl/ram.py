@@ -20,6 +20,15 @@ class iMemory(object):
     def read(self, address):
         raise InvalidMemoryAccess("Abstract read always fails")
 
+    def copy_block(self, address, target, length):
+        """
+        Copies length consecutive bytes starting at address into the list
+        target. Receivers backed by a buffer override this to copy without
+        going through read for every byte.
+        """
+        for index in range(length):
+            target[index] = self.read(address + index)
+
 
 class MissingMemory(iMemory):
     def write(self, address, data): pass
@@ -28,11 +37,25 @@ missingMemory = MissingMemory()
 
 
 class RAM(iMemory):
-    def __init__(self): self.reset()
-
-    def reset(self):
+    def __init__(self):
         self.work_ram = bytearray("\x00" * 8192)
         self.hi_ram = bytearray("\x00" * 128)
+        self.reset()
+
+    def reset(self):
+        # Clear in place, the memory map keeps direct references to the banks
+        for index in range(len(self.work_ram)):
+            self.work_ram[index] = 0x00
+        for index in range(len(self.hi_ram)):
+            self.hi_ram[index] = 0x00
+
+    def save_state(self, writer):
+        writer.write_buffer(self.work_ram)
+        writer.write_buffer(self.hi_ram)
+
+    def load_state(self, reader):
+        reader.read_buffer(self.work_ram)
+        reader.read_buffer(self.hi_ram)
 
     def write(self, address, data):
         # C000-DFFF Work RAM (8KB)
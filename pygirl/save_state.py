@@ -0,0 +1,114 @@
+"""
+PyGirl Emulator
+
+Save States
+
+A save state is a flat binary snapshot of the whole machine: a header with the
+format version, followed by the state of every component in a fixed order.
+Integers are stored as 32 bit little endian values, memory blocks are copied
+in one piece together with their length.
+"""
+
+from rpython.rlib.objectmodel import we_are_translated
+
+STATE_MAGIC = "PYGIRLSS"
+STATE_VERSION = 3
+
+
+class InvalidSaveStateException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+# ------------------------------------------------------------------------------
+
+class StateWriter(object):
+    def __init__(self):
+        self.parts = []
+        self.write_header()
+
+    def write_header(self):
+        self.parts.append(STATE_MAGIC)
+        self.write_byte(STATE_VERSION)
+
+    def write_byte(self, value):
+        self.parts.append(chr(value & 0xFF))
+
+    def write_bool(self, value):
+        self.write_byte(int(value))
+
+    def write_int(self, value):
+        self.parts.append(chr(value & 0xFF) + chr((value >> 8) & 0xFF) +
+                          chr((value >> 16) & 0xFF) + chr((value >> 24) & 0xFF))
+
+    def write_buffer(self, buffer):
+        self.write_int(len(buffer))
+        self.parts.append(str(buffer))
+
+    def get_data(self):
+        return "".join(self.parts)
+
+
+class StateReader(object):
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+        self.read_header()
+
+    def read_header(self):
+        if self.data[:len(STATE_MAGIC)] != STATE_MAGIC:
+            raise InvalidSaveStateException("Not a save state")
+        self.position = len(STATE_MAGIC)
+        version = self.read_byte()
+        if version != STATE_VERSION:
+            raise InvalidSaveStateException("Unsupported save state version %d"
+                                            % version)
+
+    def check_available(self, length):
+        if self.position + length > len(self.data):
+            raise InvalidSaveStateException("Save state is truncated")
+
+    def read_byte(self):
+        self.check_available(1)
+        value = ord(self.data[self.position])
+        self.position += 1
+        return value
+
+    def read_bool(self):
+        return self.read_byte() != 0
+
+    def read_int(self):
+        data = self.read_data(4)
+        value = ord(data[0]) | (ord(data[1]) << 8) | (ord(data[2]) << 16) | \
+                (ord(data[3]) << 24)
+        if value & 0x80000000:
+            value -= 0x100000000
+        return value
+
+    def read_data(self, length):
+        self.check_available(length)
+        start = self.position
+        self.position += length
+        assert start >= 0
+        return self.data[start:self.position]
+
+    def read_buffer(self, buffer):
+        """
+        Copies a block into the existing buffer, the buffers are shared with
+        the memory map and must not be replaced.
+        """
+        length = self.read_int()
+        if length != len(buffer):
+            raise InvalidSaveStateException("Memory size mismatch: %d != %d"
+                                            % (length, len(buffer)))
+        data = self.read_data(length)
+        if not we_are_translated():
+            buffer[:] = data
+            return
+        # RPython cannot assign to a bytearray slice
+        for index in range(length):
+            buffer[index] = ord(data[index])
+
+    def check_end(self):
+        if self.position != len(self.data):
+            raise InvalidSaveStateException("Trailing data in save state")
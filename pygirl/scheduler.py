@@ -0,0 +1,167 @@
+"""
+PyGirl Emulator
+
+Event Scheduler
+
+The components which run next to the CPU (Video, Timer, Serial and Joypad) tell
+the scheduler how many cycles are left until they have something to do. The CPU
+runs uninterrupted up to the earliest of these deadlines and only the
+components which are due are woken afterwards. The others catch up with the
+elapsed cycles the next time they are woken or synced.
+"""
+
+from pygirl.ram import iMemory
+
+# Deadline of a component which does not expect anything to happen
+NO_EVENT = 1 << 30
+
+
+class ScheduledComponent(iMemory):
+    """
+    A component driven by the Scheduler. emulate(ticks) advances it by the
+    cycles elapsed since it was woken last, get_cycles returns the cycles
+    until it has to be woken again or NO_EVENT.
+    Register writes changing the deadline have to sync() the component before
+    and reschedule() it after changing its state.
+    """
+    scheduler = None
+    deadline = 0
+    synced = 0
+    queued = False
+
+    def get_cycles(self):
+        return NO_EVENT
+
+    def emulate(self, ticks):
+        pass
+
+    def sync(self):
+        if self.scheduler is not None:
+            self.scheduler.sync(self)
+
+    def reschedule(self):
+        if self.scheduler is not None:
+            self.scheduler.schedule(self)
+
+
+# ------------------------------------------------------------------------------
+
+class Scheduler(object):
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.components = []
+        self.queue = []
+        self.now = 0
+        self.slice_end = 0
+        self.running = False
+
+    def add_component(self, component):
+        component.scheduler = self
+        self.components.append(component)
+
+    def reset(self):
+        self.now = 0
+        self.slice_end = 0
+        self.queue = []
+        for component in self.components:
+            component.synced = 0
+            component.queued = False
+            self.schedule(component)
+
+    def get_cycles(self):
+        """
+        Cycles until the next component is due
+        """
+        return self.queue[0].deadline - self.now
+
+    def get_time(self):
+        """
+        The cycle the CPU is at. While it runs a slice this is ahead of now by
+        the cycles it has executed so far.
+        """
+        if self.running:
+            return self.slice_end - self.cpu.cycles
+        return self.now
+
+    def schedule(self, component):
+        """
+        (Re)inserts the component at the position of its new deadline. A
+        deadline moved into the slice the CPU is currently running shortens
+        that slice.
+        """
+        if component.queued:
+            index = self.find(component.deadline)
+            while self.queue[index] is not component:
+                index += 1
+            del self.queue[index]
+        cycles = component.get_cycles()
+        if cycles < 0:
+            cycles = 0
+        component.deadline = self.get_time() + cycles
+        # behind the components due at the same cycle
+        self.queue.insert(self.find(component.deadline + 1), component)
+        component.queued = True
+        if component.deadline < self.slice_end:
+            self.cpu.cycles -= self.slice_end - component.deadline
+            self.slice_end = component.deadline
+
+    def find(self, deadline):
+        """
+        Index of the first queued component due at or after deadline
+        """
+        low = 0
+        high = len(self.queue)
+        while low < high:
+            middle = (low + high) >> 1
+            if self.queue[middle].deadline < deadline:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def sync(self, component):
+        """
+        Brings the component up to the cycle the CPU is at
+        """
+        time = self.get_time()
+        ticks = time - component.synced
+        if ticks > 0:
+            component.emulate(ticks)
+            component.synced = time
+
+    def sync_components(self):
+        for component in self.components:
+            self.sync(component)
+
+    def emulate(self, ticks):
+        end = self.now + ticks
+        while self.now < end:
+            self.slice_end = min(self.queue[0].deadline, end)
+            self.running = True
+            self.cpu.emulate(self.slice_end - self.now)
+            self.running = False
+            self.now = self.slice_end
+            self.wake_due_components()
+        self.rebase()
+
+    def step(self, ticks):
+        # used when the CPU is driven instruction by instruction
+        self.now += ticks
+        self.wake_due_components()
+        self.rebase()
+
+    def wake_due_components(self):
+        while self.queue[0].deadline <= self.now:
+            component = self.queue.pop(0)
+            component.queued = False
+            component.emulate(self.now - component.synced)
+            component.synced = self.now
+            self.schedule(component)
+
+    def rebase(self):
+        # keep the timestamps small, only the differences matter
+        for component in self.components:
+            component.deadline -= self.now
+            component.synced -= self.now
+        self.slice_end -= self.now
+        self.now = 0
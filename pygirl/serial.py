@@ -1,9 +1,9 @@
 from pygirl import constants
 from pygirl.interrupt import Interrupt
-from pygirl.ram import iMemory
+from pygirl.scheduler import ScheduledComponent, NO_EVENT
 
 
-class Serial(iMemory):
+class Serial(ScheduledComponent):
     """
     PyGirl Emulator
     Serial Link Controller
@@ -19,7 +19,19 @@ class Serial(iMemory):
         self.serial_data = 0x00
         self.serial_control = 0x00
 
+    def save_state(self, writer):
+        writer.write_int(self.cycles)
+        writer.write_byte(self.serial_data)
+        writer.write_byte(self.serial_control)
+
+    def load_state(self, reader):
+        self.cycles = reader.read_int()
+        self.serial_data = reader.read_byte()
+        self.serial_control = reader.read_byte()
+
     def get_cycles(self):
+        if (self.serial_control & 0x81) != 0x81:
+            return NO_EVENT
         return self.cycles
 
     def emulate(self, ticks):
@@ -42,9 +54,11 @@ class Serial(iMemory):
         self.serial_data = data
 
     def set_serial_control(self, data):
+        self.sync()
         self.serial_control = data
         # HACK: delay the serial interrupt
         self.cycles = constants.SERIAL_IDLE_CLOCK + constants.SERIAL_CLOCK
+        self.reschedule()
 
     def read(self, address):
         if address == constants.SERIAL_TRANSFER_DATA:
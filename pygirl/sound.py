@@ -63,7 +63,14 @@ from rsdl import RSDL
 
 from pygirl import constants
 from pygirl.constants import *
-from pygirl.ram import iMemory
+from pygirl.scheduler import ScheduledComponent
+
+# Register writes waiting for the audio thread, a power of two
+AUDIO_EVENT_QUEUE_SIZE = 1 << 10
+AUDIO_EVENT_QUEUE_MASK = AUDIO_EVENT_QUEUE_SIZE - 1
+# A write further than this from the mixer's position is taken as the new
+# position, e.g. after the emulation was paused or ran ahead
+AUDIO_LATENCY = GAMEBOY_CLOCK / 16
 
 
 class theAudioLock(object):
@@ -88,6 +95,22 @@ class Channel(object):
         self.set_length(0xFF)
         self.set_playback(0xBF)
 
+    def save_state(self, writer):
+        writer.write_int(self.envelope)
+        writer.write_int(self.frequency)
+        writer.write_int(self.index)
+        writer.write_int(self.length)
+        writer.write_int(self.playback)
+        writer.write_bool(self.enabled)
+
+    def load_state(self, reader):
+        self.envelope = reader.read_int()
+        self.frequency = reader.read_int()
+        self.index = reader.read_int()
+        self.length = reader.read_int()
+        self.playback = reader.read_int()
+        self.enabled = reader.read_bool()
+
     def update_audio(self):
         self.update_enabled()
         self.update_envelope_and_volume()
@@ -102,6 +125,14 @@ class Channel(object):
     def update_frequency_and_playback(self):
         pass
 
+    def mix_samples(self, left, right, start, count, output_terminal):
+        """
+        Adds count samples to the left and right buffers starting at start.
+        The registers do not change while the samples are mixed, so the
+        channels only need to step their wave within the block.
+        """
+        pass
+
     def get_length(self):
         return self.length
 
@@ -145,6 +176,24 @@ class SquareWaveChannel(Channel):
         self.set_frequency(0xFF)
         # Audio Channel 1
 
+    def save_state(self, writer):
+        Channel.save_state(self, writer)
+        writer.write_int(self.raw_sample_sweep)
+        writer.write_int(self.sample_sweep_length)
+        writer.write_int(self.raw_length)
+        writer.write_int(self.volume)
+        writer.write_int(self.envelope_length)
+        writer.write_int(self.raw_frequency)
+
+    def load_state(self, reader):
+        Channel.load_state(self, reader)
+        self.raw_sample_sweep = reader.read_int()
+        self.sample_sweep_length = reader.read_int()
+        self.raw_length = reader.read_int()
+        self.volume = reader.read_int()
+        self.envelope_length = reader.read_int()
+        self.raw_frequency = reader.read_int()
+
     def get_sweep(self):
         return self.raw_sample_sweep
 
@@ -171,6 +220,9 @@ class SquareWaveChannel(Channel):
         else:
             self.volume = (self.volume + 2) & 0x0F
 
+    def get_frequency(self):
+        return self.raw_frequency
+
     def set_frequency(self, data):
         self.raw_frequency = data
         index = self.raw_frequency + ((self.playback & 0x07) << 8)
@@ -235,14 +287,17 @@ class SquareWaveChannel(Channel):
             self.enabled = False
             # self.output_enable &= ~0x01
 
-    def next_samples(self, output_terminal):
-        self.index += self.frequency
+    def mix_samples(self, left, right, start, count, output_terminal):
+        # the output does not depend on the wave position yet
+        self.index += self.frequency * count
         # wave_pattern = self.get_current_wave_pattern()
         # if (self.index & (0x1F << 22)) >= wave_pattern:
         # output_terminal & 0x20 for the second SquareWaveChannel
         l = self.volume if output_terminal & 0x10 else 0
         r = self.volume if output_terminal & 0x01 else 0
-        return l, r
+        for i in range(start, start + count):
+            left[i] += l
+            right[i] += r
 
     def get_current_wave_pattern(self):
         wave_pattern = 0x18
@@ -278,6 +333,24 @@ class VoluntaryWaveChannel(Channel):
         self.set_frequency(0xFF)
         self.set_playback(0xBF)
 
+    def save_state(self, writer):
+        Channel.save_state(self, writer)
+        writer.write_int(self.enable)
+        writer.write_int(self.level)
+        writer.write_int(self.raw_length)
+        writer.write_int(self.raw_frequency)
+        for index in range(len(self.wave_pattern)):
+            writer.write_byte(self.wave_pattern[index])
+
+    def load_state(self, reader):
+        Channel.load_state(self, reader)
+        self.enable = reader.read_int()
+        self.level = reader.read_int()
+        self.raw_length = reader.read_int()
+        self.raw_frequency = reader.read_int()
+        for index in range(len(self.wave_pattern)):
+            self.wave_pattern[index] = reader.read_byte()
+
     def get_enable(self):
         return self.enable
 
@@ -325,21 +398,30 @@ class VoluntaryWaveChannel(Channel):
     def update_audio(self):
         if (self.playback & 0x40) != 0 and self.length > 0:
             self.length -= 1
-            self.enabled = self.length <= 0
-            # self.output_enable &= ~0x04
+            if self.length <= 0:
+                self.enabled = False
 
-    def next_samples(self, output_terminal):
+    def mix_samples(self, left, right, start, count, output_terminal):
         # wave_pattern = self.get_current_wave_pattern()
-        self.index += self.frequency
-        sample = self.wave_pattern[(self.index >> 23) & 0x0F]
-        if (self.index & (1 << 22)) != 0:
-            sample = (sample >> 0) & 0x0F
-        else:
-            sample = (sample >> 4) & 0x0F
-        sample = int(((sample - 8) << 1) >> self.level)
-        l = sample if output_terminal & 0x40 else 0
-        r = sample if output_terminal & 0x04 else 0
-        return l, r
+        index = self.index
+        frequency = self.frequency
+        level = self.level
+        wave_pattern = self.wave_pattern
+        to_left = output_terminal & 0x40
+        to_right = output_terminal & 0x04
+        for i in range(start, start + count):
+            index += frequency
+            sample = wave_pattern[(index >> 23) & 0x0F]
+            if (index & (1 << 22)) != 0:
+                sample = sample & 0x0F
+            else:
+                sample = (sample >> 4) & 0x0F
+            sample = int(((sample - 8) << 1) >> level)
+            if to_left:
+                left[i] += sample
+            if to_right:
+                right[i] += sample
+        self.index = index
 
     def get_current_wave_pattern(self):
         wave_pattern = 2
@@ -352,6 +434,37 @@ class VoluntaryWaveChannel(Channel):
         return wave_pattern << 22
 
 
+def create_7_step_noise_table():
+    # Noise Tables
+    table = [0] * 4
+    polynomial = 0x7F
+    #  7 steps
+    for index in range(0, 0x7F):
+        polynomial = (((polynomial << 6) ^ (polynomial << 5)) & 0x40) | \
+                     (polynomial >> 1)
+        if (index & 0x1F) == 0:
+            table[index >> 5] = 0
+        table[index >> 5] |= (polynomial & 0x01) << (index & 0x1F)
+    return table
+
+
+def create_15_step_noise_table():
+    #  15 steps&
+    table = [0] * 1024
+    polynomial = 0x7FFF
+    for index in range(0, 0x7FFF):
+        polynomial = (((polynomial << 14) ^ (polynomial << 13)) & \
+                      0x4000) | (polynomial >> 1)
+        if (index & 0x1F) == 0:
+            table[index >> 5] = 0
+        table[index >> 5] |= (polynomial & 0x01) << (index & 0x1F)
+    return table
+
+
+NOISE_STEP_7_TABLE = create_7_step_noise_table()
+NOISE_STEP_15_TABLE = create_15_step_noise_table()
+
+
 # --------------------------------------------------------------------------- 
 
 class NoiseGenerator(Channel):
@@ -377,6 +490,20 @@ class NoiseGenerator(Channel):
         self.set_polynomial(0x00)
         self.set_playback(0xBF)
 
+    def save_state(self, writer):
+        Channel.save_state(self, writer)
+        writer.write_int(self.polynomial)
+        writer.write_int(self.raw_length)
+        writer.write_int(self.volume)
+        writer.write_int(self.envelope_length)
+
+    def load_state(self, reader):
+        Channel.load_state(self, reader)
+        self.polynomial = reader.read_int()
+        self.raw_length = reader.read_int()
+        self.volume = reader.read_int()
+        self.envelope_length = reader.read_int()
+
     def generate_noise_frequency_ratio_table(self):
         # Polynomial Noise Frequency Ratios
         # 4194304 Hz * 1 / 2^3 * 2 4194304 Hz * 1 / 2^3 * 1 4194304 Hz * 1 / 2^3 *
@@ -391,40 +518,17 @@ class NoiseGenerator(Channel):
                                               sampleFactor
 
     def generate_noise_tables(self):
-        self.create_7_step_noise_table()
-        self.create_15_step_noise_table()
-
-    def create_7_step_noise_table(self):
-        # Noise Tables
-        self.noise_step_7_table = [0] * 4
-        polynomial = 0x7F
-        #  7 steps
-        for index in range(0, 0x7F):
-            polynomial = (((polynomial << 6) ^ (polynomial << 5)) & 0x40) | \
-                         (polynomial >> 1)
-            if (index & 0x1F) == 0:
-                self.noise_step_7_table[index >> 5] = 0
-            self.noise_step_7_table[index >> 5] |= (polynomial & 0x01) << \
-                                                   (index & 0x1F)
-
-    def create_15_step_noise_table(self):
-        #  15 steps&
-        self.noise_step_15_table = [0] * 1024
-        polynomial = 0x7FFF
-        for index in range(0, 0x7FFF):
-            polynomial = (((polynomial << 14) ^ (polynomial << 13)) & \
-                          0x4000) | (polynomial >> 1)
-            if (index & 0x1F) == 0:
-                self.noise_step_15_table[index >> 5] = 0
-            self.noise_step_15_table[index >> 5] |= (polynomial & 0x01) << \
-                                                    (index & 0x1F)
+        # the tables do not depend on the sample rate, all generators share
+        # the ones computed at import time
+        self.noise_step_7_table = NOISE_STEP_7_TABLE
+        self.noise_step_15_table = NOISE_STEP_15_TABLE
 
     def get_length(self):
         return self.raw_length
 
     def set_length(self, data):
         self.raw_length = data
-        self.length = (SOUND_CLOCK / 256) * (64 - (self.length & 0x3F))
+        self.length = (SOUND_CLOCK / 256) * (64 - (self.raw_length & 0x3F))
 
     def set_envelope(self, data):
         self.envelope = data
@@ -465,8 +569,8 @@ class NoiseGenerator(Channel):
     def update_enabled(self):
         if (self.playback & 0x40) != 0 and self.length > 0:
             self.length -= 1
-            self.enabled = self.length <= 0
-            # self.output_enable &= ~0x08
+            if self.length <= 0:
+                self.enabled = False
 
     def update_envelope_and_volume(self):
         if self.envelope_length <= 0:
@@ -481,28 +585,41 @@ class NoiseGenerator(Channel):
             self.volume -= 1
         self.envelope_length += (SOUND_CLOCK / 64) * (self.envelope & 0x07)
 
-    def next_samples(self, output_terminal):
-        self.index += self.frequency
-        # polynomial
+    def mix_samples(self, left, right, start, count, output_terminal):
+        index = self.index
+        frequency = self.frequency
         if (self.polynomial & 0x08) != 0:
             #  7 steps
-            self.index &= 0x7FFFFF
-            polynomial = self.noise_step_7_table[self.index >> 21] >> \
-                         ((self.index >> 16) & 0x1F)
+            table = self.noise_step_7_table
+            mask = 0x7FFFFF
         else:
             #  15 steps
-            self.index &= 0x7FFFFFFF
-            polynomial = self.noise_step_15_table[self.index >> 21] >> \
-                         ((self.index >> 16) & 0x1F)
+            table = self.noise_step_15_table
+            mask = 0x7FFFFFFF
         l = self.volume if output_terminal & 0x80 else 0
         r = self.volume if output_terminal & 0x08 else 0
-        return (-l, -r) if polynomial & 1 else (l, r)
+        for i in range(start, start + count):
+            index = (index + frequency) & mask
+            if (table[index >> 21] >> ((index >> 16) & 0x1F)) & 1:
+                left[i] -= l
+                right[i] -= r
+            else:
+                left[i] += l
+                right[i] += r
+        self.index = index
 
 
 # ------------------------------------------------------------------------------
 
 
-class Sound(iMemory):
+class Sound(ScheduledComponent):
+    """
+    The CPU and the audio thread share the sound through a queue of register
+    writes. write only appends to the queue and updates the registers read
+    returns, the audio thread applies the writes to the channels at the
+    sample matching the cycle they were made at. Everything else touching
+    the channels has to hold theAudioLock.
+    """
     outputLevel = 0
     output_terminal = 0
     output_enable = 0
@@ -512,10 +629,33 @@ class Sound(iMemory):
     spareCycles = 0
 
     def __init__(self):
+        self.time = 0
         self.generate_frequency_table()
         self.create_channels()
+        self.create_mix_buffers(0)
+        self.create_event_queue()
+        self.registers = [0xFF] * (AUD3WAVERAM + 0x10 - NR10)
         self.reset()
 
+    def create_event_queue(self):
+        """
+        A single producer/single consumer ring buffer: only the emulation
+        adds writes and moves write_index, only the audio thread removes
+        them and moves read_index. An entry is filled in before write_index
+        moves past it, so neither side has to lock.
+        """
+        self.event_times = [0] * AUDIO_EVENT_QUEUE_SIZE
+        self.event_addresses = [0] * AUDIO_EVENT_QUEUE_SIZE
+        self.event_data = [0] * AUDIO_EVENT_QUEUE_SIZE
+        self.write_index = 0
+        self.read_index = 0
+        self.mix_time = 0
+        self.channel_status = 0
+
+    def create_mix_buffers(self, samples):
+        self.left_samples = [0] * samples
+        self.right_samples = [0] * samples
+
     def create_channels(self):
         self.channel1 = SquareWaveChannel(self.sample_rate, self.frequency_table)
         self.channel2 = SquareWaveChannel(self.sample_rate, self.frequency_table)
@@ -535,128 +675,280 @@ class Sound(iMemory):
                 self.frequency_table[period] = skip
 
     def reset(self):
-        self.channel1.reset()
-        self.channel2.reset()
-        self.channel3.reset()
-        self.channel4.reset()
+        with theAudioLock():
+            self.drop_events()
+            self.channel1.reset()
+            self.channel2.reset()
+            self.channel3.reset()
+            self.channel4.reset()
+
+            self.set_output_level(0x00)
+            self.set_output_terminal(0xF0)
+            self.set_output_enable(0xFF)
+
+            for address in range(0xFF30, 0xFF3F):
+                write = 0xFF
+                if (address & 1) == 0:
+                    write = 0x00
+                self.write_register(address, write)
+            self.publish_channel_status()
+        self.update_registers()
+
+    def save_state(self, writer):
+        with theAudioLock():
+            self.apply_all_events()
+            for channel in self.channels:
+                channel.save_state(writer)
+            writer.write_int(self.outputLevel)
+            writer.write_int(self.output_terminal)
+            writer.write_int(self.output_enable)
+            writer.write_int(self.spareCycles)
 
-        self.set_output_level(0x00)
-        self.set_output_terminal(0xF0)
-        self.set_output_enable(0xFF)
+    def load_state(self, reader):
+        with theAudioLock():
+            self.drop_events()
+            for channel in self.channels:
+                channel.load_state(reader)
+            self.outputLevel = reader.read_int()
+            self.output_terminal = reader.read_int()
+            self.output_enable = reader.read_int()
+            self.spareCycles = reader.read_int()
+            self.publish_channel_status()
+        self.update_registers()
 
-        for address in range(0xFF30, 0xFF3F):
-            write = 0xFF
-            if (address & 1) == 0:
-                write = 0x00
-            self.write(address, write)
+    def emulate(self, ticks):
+        # the cycles are only counted to time the register writes
+        self.time += ticks
 
-    def read(self, address):
-        with theAudioLock():
-            # TODO map the read/write in groups directly to the channels
-            address = int(address)
-            if address == NR10:
-                return self.channel1.get_sweep()
-            elif address == NR11:
-                return self.channel1.get_length()
-            elif address == NR12:
-                return self.channel1.get_envelope()
-            elif address == NR13:
-                return self.channel1.get_frequency()
-            elif address == NR14:
-                return self.channel1.get_playback()
-
-            elif address == NR21:
-                return self.channel2.get_length()
-            elif address == NR22:
-                return self.channel2.get_envelope()
-            elif address == NR23:
-                return self.channel2.get_frequency()
-            elif address == NR24:
-                return self.channel2.get_playback()
+    # Register access from the CPU ---------------------------------------------
 
-            elif address == NR30:
-                return self.channel3.get_enable()
-            elif address == NR31:
-                return self.channel3.get_length()
-            elif address == NR32:
-                return self.channel3.get_level()
-            elif address == NR33:
-                return self.channel4.get_frequency()
-            elif address == NR34:
-                return self.channel3.get_playback()
-
-            elif address == NR41:
-                return self.channel4.get_length()
-            elif address == NR42:
-                return self.channel4.get_envelope()
-            elif address == NR43:
-                return self.channel4.get_polynomial()
-            elif address == NR44:
-                return self.channel4.get_playback()
-
-            elif address == NR50:
-                return self.get_output_level()
-            elif address == NR51:
-                return self.get_output_terminal()
-            elif address == NR52:
-                return self.get_output_enable()
-
-            elif AUD3WAVERAM <= address <= AUD3WAVERAM + 0x3F:
-                return self.channel3.get_wave_pattern(address)
-            return 0xFF
+    def read(self, address):
+        address = int(address)
+        if address == NR52:
+            return self.read_output_enable()
+        if NR10 <= address < NR10 + len(self.registers):
+            return self.registers[address - NR10]
+        return 0xFF
 
     def write(self, address, data):
-        with theAudioLock():
-            address = int(address)
-            if address == NR10:
-                self.channel1.set_sweep(data)
-            elif address == NR11:
-                self.channel1.set_length(data)
-            elif address == NR12:
-                self.channel1.set_envelope(data)
-            elif address == NR13:
-                self.channel1.set_frequency(data)
-            elif address == NR14:
-                self.channel1.set_playback(data)
-
-            elif address == NR21:
-                self.channel2.set_length(data)
-            elif address == NR22:
-                self.channel2.set_envelope(data)
-            elif address == NR23:
-                self.channel2.set_frequency(data)
-            elif address == NR24:
-                self.channel2.set_playback(data)
-
+        address = int(address)
+        if not NR10 <= address < NR10 + len(self.registers):
+            return
+        self.update_register(address, data)
+        self.add_event(address, data)
+
+    def update_register(self, address, data):
+        """
+        Keeps the value read returns in step with the write, the channels
+        only see it once the audio thread got to it.
+        """
+        if address == NR20 or address == NR40 or \
+                AUDUNUSED <= address <= AUDUNUSEDEND:
+            return
+        index = address - NR10
+        if address == NR30:
+            data &= 0x80
+        elif address == NR52:
+            data = (self.registers[index] & 0x7F) | (data & 0x80)
+            if (data & 0x80) == 0x00:
+                data &= 0xF0
+        self.registers[index] = data
+
+    def read_output_enable(self):
+        data = self.registers[NR52 - NR10]
+        if (data & 0x80) == 0:
+            return data
+        return (data & 0xF0) | self.get_channel_status()
+
+    def get_channel_status(self):
+        """
+        The sound on bits of NR52. The audio thread publishes the status of
+        the channels together with the number of writes it has applied, the
+        writes still queued are replayed on top of that.
+        """
+        published = self.channel_status
+        status = published & 0x0F
+        wave_enabled = (published & 0x10) != 0
+        index = published >> 5
+        while index != self.write_index:
+            slot = index & AUDIO_EVENT_QUEUE_MASK
+            address = self.event_addresses[slot]
+            data = self.event_data[slot]
+            if address == NR52 and (data & 0x80) == 0:
+                status = 0
             elif address == NR30:
-                self.channel3.set_enable(data)
-            elif address == NR31:
-                self.channel3.set_length(data)
-            elif address == NR32:
-                self.channel3.set_level(data)
-            elif address == NR33:
-                self.channel3.set_frequency(data)
-            elif address == NR34:
-                self.channel3.set_playback(data)
-
-            elif address == NR41:
-                self.channel4.set_length(data)
-            elif address == NR42:
-                self.channel4.set_envelope(data)
-            elif address == NR43:
-                self.channel4.set_polynomial(data)
-            elif address == NR44:
-                self.channel4.set_playback(data)
-
-            elif address == NR50:
-                self.set_output_level(data)
-            elif address == NR51:
-                self.set_output_terminal(data)
-            elif address == NR52:
-                self.set_output_enable(data)
-
-            elif AUD3WAVERAM <= address <= AUD3WAVERAM + 0x3F:
-                self.channel3.set_wave_pattern(address, data)
+                wave_enabled = (data & 0x80) != 0
+                if not wave_enabled:
+                    status &= ~0x04
+            elif (data & 0x80) != 0:
+                if address == NR14:
+                    status |= 0x01
+                elif address == NR24:
+                    status |= 0x02
+                elif address == NR34 and wave_enabled:
+                    status |= 0x04
+                elif address == NR44:
+                    status |= 0x08
+            index += 1
+        return status
+
+    def update_registers(self):
+        # called with the queue empty, the channels are up to date then
+        for address in range(NR10, NR10 + len(self.registers)):
+            self.registers[address - NR10] = self.read_register(address)
+
+    def add_event(self, address, data):
+        self.sync()
+        if self.write_index - self.read_index >= AUDIO_EVENT_QUEUE_SIZE:
+            # the audio thread fell behind or is not running at all
+            with theAudioLock():
+                self.apply_all_events()
+        slot = self.write_index & AUDIO_EVENT_QUEUE_MASK
+        self.event_times[slot] = self.time
+        self.event_addresses[slot] = address
+        self.event_data[slot] = data
+        self.write_index += 1
+
+    # Register writes in the audio thread ----------------------------------------
+
+    def has_event(self):
+        return self.read_index != self.write_index
+
+    def get_event_time(self):
+        return self.event_times[self.read_index & AUDIO_EVENT_QUEUE_MASK]
+
+    def apply_event(self):
+        slot = self.read_index & AUDIO_EVENT_QUEUE_MASK
+        self.write_register(self.event_addresses[slot], self.event_data[slot])
+        self.read_index += 1
+
+    def apply_events_until(self, time):
+        while self.has_event() and self.get_event_time() <= time:
+            self.apply_event()
+
+    def apply_all_events(self):
+        while self.has_event():
+            self.apply_event()
+        self.publish_channel_status()
+
+    def publish_channel_status(self):
+        # a single store, the emulation never sees the status and the number
+        # of applied writes out of step
+        status = self.read_index << 5
+        if (self.channel3.enable & 0x80) != 0:
+            status |= 0x10
+        for i in range(len(self.channels)):
+            if self.channels[i].enabled:
+                status |= 1 << i
+        self.channel_status = status
+
+    def drop_events(self):
+        # only while holding theAudioLock, the audio thread owns read_index
+        self.read_index = self.write_index
+
+    def read_register(self, address):
+        # TODO map the read/write in groups directly to the channels
+        if address == NR10:
+            return self.channel1.get_sweep()
+        elif address == NR11:
+            return self.channel1.get_length()
+        elif address == NR12:
+            return self.channel1.get_envelope()
+        elif address == NR13:
+            return self.channel1.get_frequency()
+        elif address == NR14:
+            return self.channel1.get_playback()
+
+        elif address == NR21:
+            return self.channel2.get_length()
+        elif address == NR22:
+            return self.channel2.get_envelope()
+        elif address == NR23:
+            return self.channel2.get_frequency()
+        elif address == NR24:
+            return self.channel2.get_playback()
+
+        elif address == NR30:
+            return self.channel3.get_enable()
+        elif address == NR31:
+            return self.channel3.get_length()
+        elif address == NR32:
+            return self.channel3.get_level()
+        elif address == NR33:
+            return self.channel3.get_frequency()
+        elif address == NR34:
+            return self.channel3.get_playback()
+
+        elif address == NR41:
+            return self.channel4.get_length()
+        elif address == NR42:
+            return self.channel4.get_envelope()
+        elif address == NR43:
+            return self.channel4.get_polynomial()
+        elif address == NR44:
+            return self.channel4.get_playback()
+
+        elif address == NR50:
+            return self.get_output_level()
+        elif address == NR51:
+            return self.get_output_terminal()
+        elif address == NR52:
+            return self.get_output_enable()
+
+        elif AUD3WAVERAM <= address <= AUD3WAVERAM + 0x3F:
+            return self.channel3.get_wave_pattern(address)
+        return 0xFF
+
+    def write_register(self, address, data):
+        if address == NR10:
+            self.channel1.set_sweep(data)
+        elif address == NR11:
+            self.channel1.set_length(data)
+        elif address == NR12:
+            self.channel1.set_envelope(data)
+        elif address == NR13:
+            self.channel1.set_frequency(data)
+        elif address == NR14:
+            self.channel1.set_playback(data)
+
+        elif address == NR21:
+            self.channel2.set_length(data)
+        elif address == NR22:
+            self.channel2.set_envelope(data)
+        elif address == NR23:
+            self.channel2.set_frequency(data)
+        elif address == NR24:
+            self.channel2.set_playback(data)
+
+        elif address == NR30:
+            self.channel3.set_enable(data)
+        elif address == NR31:
+            self.channel3.set_length(data)
+        elif address == NR32:
+            self.channel3.set_level(data)
+        elif address == NR33:
+            self.channel3.set_frequency(data)
+        elif address == NR34:
+            self.channel3.set_playback(data)
+
+        elif address == NR41:
+            self.channel4.set_length(data)
+        elif address == NR42:
+            self.channel4.set_envelope(data)
+        elif address == NR43:
+            self.channel4.set_polynomial(data)
+        elif address == NR44:
+            self.channel4.set_playback(data)
+
+        elif address == NR50:
+            self.set_output_level(data)
+        elif address == NR51:
+            self.set_output_terminal(data)
+        elif address == NR52:
+            self.set_output_enable(data)
+
+        elif AUD3WAVERAM <= address <= AUD3WAVERAM + 0x3F:
+            self.channel3.set_wave_pattern(address, data)
 
     def set_sample_rate(self, sample_rate):
         self.sample_rate = sample_rate
@@ -680,26 +972,84 @@ class Sound(iMemory):
                 total += 1
 
     def mix_audio(self, buffer, length):
-        if (self.output_enable & 0x80) == 0: return
+        # XXX Stereo length is off by a factor of two between SDL and PA/PW?
+        samples = length >> 1
+        # writes the mixer is already past take effect right away
+        self.apply_events_until(self.mix_time)
+        start_time = self.update_mix_time()
+        end_time = start_time + samples * GAMEBOY_CLOCK / self.sample_rate
+        self.mix_time = end_time
+        if (self.output_enable & 0x80) == 0:
+            self.apply_events_until(end_time)
+            self.publish_channel_status()
+            return
+        if len(self.left_samples) < samples:
+            self.create_mix_buffers(samples)
+        left = self.left_samples
+        right = self.right_samples
+        for i in range(samples):
+            left[i] = 0
+            right[i] = 0
+        self.mix_blocks(left, right, samples, start_time, end_time)
+        for i in range(samples):
+            buffer[i << 1] = r_uchar(left[i])
+            buffer[(i << 1) | 1] = r_uchar(right[i])
+        self.publish_channel_status()
+
+    def update_mix_time(self):
+        """
+        Returns the cycle the first sample of the next buffer belongs to. The
+        mixer follows the emulation at a distance, it jumps to the next write
+        when it is out of reach.
+        """
+        if self.has_event():
+            distance = self.get_event_time() - self.mix_time
+            if distance > AUDIO_LATENCY or distance < -AUDIO_LATENCY:
+                self.mix_time = self.get_event_time()
+        return self.mix_time
+
+    def get_event_offset(self, samples, start_time, end_time):
+        # the sample the next write has to be applied before
+        time = self.get_event_time()
+        if time <= start_time:
+            return 0
+        if time >= end_time:
+            return samples
+        return (time - start_time) * self.sample_rate / GAMEBOY_CLOCK
+
+    def mix_blocks(self, left, right, samples, start_time, end_time):
+        """
+        Mixes the samples block by block. A block runs from one clock tick
+        of the synthesizer to the sample before the next one, the channels
+        only change their length, envelope and sweep on those ticks. Blocks
+        are split further at the register writes falling into them.
+        """
         clock = self.spareCycles
         trainIndex = 0
-        # XXX Stereo length is off by a factor of two between SDL and PA/PW?
-        for i in range(length >> 1):
-            left = right = 0
+        i = 0
+        while i < samples:
+            next_event = samples
+            while self.has_event():
+                next_event = self.get_event_offset(samples, start_time,
+                                                   end_time)
+                if next_event > i:
+                    break
+                self.apply_event()
+                next_event = samples
             clock -= 1
             doCycle = clock <= 0
             if doCycle:
                 clock += self.cycleSamples[trainIndex]
                 trainIndex += 1
                 if trainIndex >= len(self.cycleSamples): trainIndex = 0
+            count = min(max(clock, 1), next_event - i)
             for channel in self.channels:
                 if doCycle: channel.update_audio()
                 if channel.enabled:
-                    l, r = channel.next_samples(self.output_terminal)
-                    left += l
-                    right += r
-            buffer[i << 1] = r_uchar(left)
-            buffer[(i << 1) | 1] = r_uchar(right)
+                    channel.mix_samples(left, right, i, count,
+                                        self.output_terminal)
+            clock -= count - 1
+            i += count
         self.spareCycles = clock
 
     def get_output_level(self):
@@ -722,6 +1072,9 @@ class Sound(iMemory):
         self.output_enable = (self.output_enable & 0x7F) | (data & 0x80)
         if (self.output_enable & 0x80) == 0x00:
             self.output_enable &= 0xF0
+            # switching the sound off stops all channels
+            for channel in self.channels:
+                channel.enabled = False
 
 
 # SOUND DRIVER -----------------------------------------------------------------
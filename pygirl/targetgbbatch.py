@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+import sys
+from pygirl.batch import load_manifest, run_batch
+
+
+def entry_point(argv=None):
+    if argv is None or len(argv) < 2:
+        print "usage: targetgbbatch.py <manifest> [workers]"
+        return 1
+    workers = 1
+    if len(argv) > 2:
+        workers = int(argv[2])
+    jobs = load_manifest(argv[1])
+    failed = 0
+    for result in run_batch(jobs, workers):
+        print result.report()
+        if result.error:
+            failed += 1
+    return int(failed > 0)
+
+
+# _____ Define and setup target ___
+
+def target(*args):
+    return entry_point, None
+
+
+def test_target():
+    entry_point(sys.argv)
+
+
+# STARTPOINT ===================================================================
+
+if __name__ == '__main__':
+    test_target()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import os, py, pdb, sys, time
 from pygirl.profiling.gameboy_profiling_implementation import GameBoyProfiler
+from pygirl.cpu import FlatRegisterCPU, LazyFlagCPU
 
 ROM_PATH = str(py.path.local(__file__).dirpath().dirpath().dirpath()) + "/lang/gameboy/rom"
 
@@ -26,13 +27,24 @@ def entry_point(argv=None):
     return 0
 
 
+def select_register_file(args):
+    # the register backend is chosen before translating, pass --flat-registers
+    # or --lazy-flags to benchmark them against the default one
+    if "--flat-registers" in args:
+        GameBoyProfiler.cpu_class = FlatRegisterCPU
+    elif "--lazy-flags" in args:
+        GameBoyProfiler.cpu_class = LazyFlagCPU
+
+
 # _____ Define and setup target ___
 
-def target(*args):
+def target(driver, args):
+    select_register_file(args)
     return entry_point, None
 
 
 def test_target():
+    select_register_file(sys.argv)
     entry_point(sys.argv)
 
 
@@ -0,0 +1,64 @@
+import py
+
+from pygirl.batch import *
+
+ROM_PATH = str(py.path.local(__file__).dirpath().dirpath() / "rom")
+
+
+def test_resolve_path():
+    assert resolve_path("rom.gb", "jobs/manifest") == "jobs/rom.gb"
+    assert resolve_path("rom.gb", "manifest") == "rom.gb"
+    assert resolve_path("/roms/rom.gb", "jobs/manifest") == "/roms/rom.gb"
+    assert resolve_path("rom.gb", "/manifest") == "/rom.gb"
+
+
+def test_parse_manifest():
+    jobs = parse_manifest("# comment\n\nrom3.gb 10\n  /a/rom9.gb  20 \n",
+                          "jobs/manifest")
+    assert len(jobs) == 2
+    assert jobs[0].rom_path == "jobs/rom3.gb"
+    assert jobs[0].frames == 10
+    assert jobs[0].input_events == []
+    assert jobs[1].rom_path == "/a/rom9.gb"
+    assert jobs[1].frames == 20
+
+
+def test_parse_manifest_invalid_line():
+    py.test.raises(BatchError, parse_manifest, "rom3.gb\n")
+    py.test.raises(BatchError, parse_manifest, "rom3.gb 1 a b\n")
+
+
+def test_parse_input_script():
+    events = parse_input_script("3 start press\n5 start release\n")
+    assert [(event.frame, event.button, event.pressed)
+            for event in events] == [(3, "start", True), (5, "start", False)]
+    py.test.raises(BatchError, parse_input_script, "3 turbo press\n")
+    py.test.raises(BatchError, parse_input_script, "3 a hold\n")
+
+
+def test_serialize_result():
+    result = BatchResult(2, "rom.gb", 10, 0.5, "abc", "def")
+    copy = deserialize_result(BatchJob("rom.gb", 10), result.serialize().strip())
+    assert copy.index == 2
+    assert copy.frames == 10
+    assert copy.seconds == 0.5
+    assert copy.frame_hash == "abc"
+    assert copy.ram_hash == "def"
+    error = BatchResult(1, "rom.gb", error="IOError No such file")
+    copy = deserialize_result(BatchJob("rom.gb", 10), error.serialize().strip())
+    assert copy.error == "IOError No such file"
+
+
+def test_run_batch():
+    rom = ROM_PATH + "/rom3/rom3.gb"
+    jobs = [BatchJob(rom, 5), BatchJob(ROM_PATH + "/missing.gb", 5),
+            BatchJob(rom, 5)]
+    results = run_batch(jobs, 2)
+    assert [result.index for result in results] == [0, 1, 2]
+    assert not results[0].error
+    assert results[0].frames == 5
+    # the same job gives the same frame and RAM
+    assert results[0].frame_hash == results[2].frame_hash
+    assert results[0].ram_hash == results[2].ram_hash
+    assert results[0].frame_hash == run_job(jobs[0]).frame_hash
+    assert results[1].error == "IOError No such file or directory"
@@ -0,0 +1,34 @@
+import py
+
+from pygirl.cartridge import BackgroundCartridgeFile
+
+
+def create_cartridge_file(path):
+    cartridge = BackgroundCartridgeFile()
+    cartridge.battery_file_path = str(path)
+    cartridge.battery_file_contents = bytearray("\x12" * 16)
+    cartridge.battery_changed = True
+    return cartridge
+
+
+def test_battery_is_written_in_the_background(tmpdir):
+    path = tmpdir / "game.sav"
+    cartridge = create_cartridge_file(path)
+    cartridge.flush_battery(background=True)
+    cartridge.wait_for_battery_writer()
+    assert path.read("rb") == "\x12" * 16
+    assert not cartridge.battery_changed
+
+
+def test_failed_background_write_is_retried(tmpdir):
+    path = tmpdir / "missing" / "game.sav"
+    cartridge = create_cartridge_file(path)
+    cartridge.flush_battery(background=True)
+    cartridge.wait_for_battery_writer()
+    assert cartridge.battery_changed
+    # the synchronous flush reports the error to the caller
+    py.test.raises(IOError, cartridge.flush_battery)
+    tmpdir.mkdir("missing")
+    cartridge.battery_changed = True
+    cartridge.flush_battery()
+    assert path.read("rb") == "\x12" * 16
@@ -0,0 +1,52 @@
+from pygirl.cpu_block import *
+from pygirl.test.test_save_state import create_gameboy, emulate_frames, \
+                                         get_machine
+
+
+def create_code_cache(code):
+    return CodeCache(bytearray(code + [0x00] * (256 - len(code))))
+
+
+def test_immediates_are_resolved_while_decoding():
+    # LD B,0x12; LD HL,0x3456; CP 0x78; JR NZ,-7
+    cache = create_code_cache([0x06, 0x12, 0x21, 0x56, 0x34, 0xFE, 0x78,
+                               0x20, 0xF9])
+    block = cache.create_block(0, 256)
+    assert [instruction.__class__ for instruction in block.instructions] == \
+           [ImmediateInstruction] * 4
+    assert [instruction.value for instruction in block.instructions] == \
+           [0x12, 0x3456, 0x78, -7]
+    assert block.end == 9
+
+
+def test_instructions_without_immediates_are_bound_to_their_handler():
+    # NOP; SET 0,A; HALT
+    cache = create_code_cache([0x00, 0xCB, 0xC7, 0x76])
+    block = cache.create_block(0, 256)
+    assert [instruction.__class__ for instruction in block.instructions] == \
+           [OpCodeInstruction, FetchExecuteInstruction, OpCodeInstruction]
+
+
+def test_blocks_execute_like_the_interpreter():
+    for rom in ["/rom3/rom3.gb", "/rom9/rom9.gb"]:
+        machines = []
+        for use_block_cache in [False, True]:
+            gameboy = create_gameboy(rom)
+            gameboy.cpu.use_block_cache = use_block_cache
+            emulate_frames(gameboy, 30)
+            machines.append((get_machine(gameboy),
+                             gameboy.cpu.instruction_counter))
+        assert machines[0] == machines[1]
+
+
+def test_polling_the_sound_status_is_no_idle_loop():
+    # LDH A,(NR52); AND 0x01; JR NZ,-6
+    cache = create_code_cache([0xF0, 0x26, 0xE6, 0x01, 0x20, 0xFA])
+    block = cache.create_block(0, 256)
+    assert block.idle_loop
+    assert not block.reads_idle_inputs(None)
+    # LDH A,(LY); CP 0x90; JR NZ,-6
+    cache = create_code_cache([0xF0, 0x44, 0xFE, 0x90, 0x20, 0xFA])
+    block = cache.create_block(0, 256)
+    assert block.idle_loop
+    assert block.reads_idle_inputs(None)
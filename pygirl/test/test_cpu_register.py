@@ -0,0 +1,84 @@
+from pygirl.cpu_register import *
+
+
+class FakeCPU(object):
+    cycles = 0
+
+
+def test_pair_is_composed_from_its_halves():
+    check_pair(Register, DoubleRegister)
+
+
+def test_flat_pair_is_composed_from_its_halves():
+    check_pair(FlatRegister, FlatDoubleRegister)
+
+
+def check_pair(register_class, double_register_class):
+    cpu = FakeCPU()
+    b, c = register_class(cpu), register_class(cpu)
+    bc = double_register_class(cpu, b, c)
+    bc.set(0x1234)
+    assert (b.get(), c.get()) == (0x12, 0x34)
+    c.set(0x1FF)
+    assert bc.get() == 0x12FF
+    bc.inc()
+    assert (bc.get(), b.get(), c.get()) == (0x1300, 0x13, 0x00)
+    bc.add(-0x1301)
+    assert bc.get() == 0xFFFF
+    assert cpu.cycles == -1 - 1 - 2 - 3
+
+
+def test_af_goes_through_the_flags():
+    cpu = FakeCPU()
+    a, flag = Register(cpu), FlagRegister(cpu, 0x00)
+    af = FlagDoubleRegister(cpu, a, flag)
+    af.set(0x12B0, use_cycles=False)
+    assert a.get() == 0x12
+    assert flag.is_zero and flag.is_half_carry and flag.is_carry
+    assert not flag.is_subtraction
+    flag.is_carry = False
+    assert af.get() == 0x12A0
+    assert af.get_lo() == 0xA0
+
+
+def test_flags_are_computed_right_away():
+    flag = FlagRegister(FakeCPU(), 0x00)
+    flag.compare_check((0x11 - 0x20) & 0xFF, 0x11)
+    assert not flag.is_zero and flag.is_carry and flag.is_subtraction
+    assert flag.get(use_cycles=False) == 0x50
+    flag.add_check(0xFF + 0x01, 0xFF, 0x01)
+    assert flag.get(use_cycles=False) == 0xB0
+    flag.inc_dec_check(0x10, 0x00)
+    assert flag.get(use_cycles=False) == 0x30
+
+
+def test_flags_are_computed_when_read():
+    flag = LazyFlagRegister(FakeCPU(), 0x00)
+    # CP 0x20 with A = 0x11
+    flag.compare_check((0x11 - 0x20) & 0xFF, 0x11)
+    assert flag.operation == FLAGS_COMPARE
+    assert not flag.get_zero() and flag.get_carry()
+    assert flag.operation == FLAGS_COMPARE
+    assert flag.get(use_cycles=False) == 0x50
+    assert flag.operation == FLAGS_READY
+    # ADD A,0x01 with A = 0xFF
+    flag.add_check(0xFF + 0x01, 0xFF, 0x01)
+    assert flag.get(use_cycles=False) == 0xB0
+    # AND 0x00
+    flag.logic_check(0x00, half_carry=True)
+    assert flag.get(use_cycles=False) == 0xA0
+
+
+def test_inc_dec_keeps_the_recorded_carry():
+    flag = LazyFlagRegister(FakeCPU(), 0x00)
+    flag.shift_check(0x02, 0x81, 0x80)
+    # INC A from 0x0F, the carry of the shift is kept
+    flag.inc_dec_check(0x10, 0x00)
+    assert flag.get_carry() and flag.get_half_carry()
+    assert flag.get(use_cycles=False) == 0x30
+    flag.add_check(0x100, 0x80, 0x80)
+    flag.partial_reset(keep_is_carry=True)
+    assert flag.get(use_cycles=False) == 0x10
+    flag.add_check(0x100, 0x80, 0x80)
+    flag.partial_reset()
+    assert flag.get(use_cycles=False) == 0x00
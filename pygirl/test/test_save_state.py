@@ -0,0 +1,89 @@
+import py
+
+from pygirl import constants
+from pygirl.gameboy import GameBoy
+from pygirl.save_state import *
+
+ROM_PATH = str(py.path.local(__file__).dirpath().dirpath() / "rom")
+FRAME_CYCLES = constants.GAMEBOY_CLOCK / 64
+
+
+def create_gameboy(rom):
+    gameboy = GameBoy()
+    gameboy.load_cartridge_file(ROM_PATH + rom, verify=False)
+    gameboy.reset()
+    return gameboy
+
+
+def emulate_frames(gameboy, frames):
+    for frame in range(frames):
+        gameboy.emulate(FRAME_CYCLES)
+
+
+def get_machine(gameboy):
+    cpu = gameboy.cpu
+    return (hash(str(gameboy.video_driver.pixels)),
+            hash(str(gameboy.ram.work_ram)), hash(str(gameboy.ram.hi_ram)),
+            hash(str(gameboy.video.vram)), cpu.pc.get(use_cycles=False),
+            cpu.sp.get(use_cycles=False), cpu.af.get(use_cycles=False))
+
+
+def test_write_read_values():
+    writer = StateWriter()
+    writer.write_byte(0x1FF)
+    writer.write_bool(True)
+    writer.write_int(-2)
+    writer.write_int(0x12345678)
+    writer.write_buffer(bytearray("abc"))
+    reader = StateReader(writer.get_data())
+    assert reader.read_byte() == 0xFF
+    assert reader.read_bool()
+    assert reader.read_int() == -2
+    assert reader.read_int() == 0x12345678
+    buffer = bytearray("xyz")
+    reader.read_buffer(buffer)
+    assert buffer == bytearray("abc")
+    reader.check_end()
+
+
+def test_read_invalid_data():
+    py.test.raises(InvalidSaveStateException, StateReader, "PYGIRL")
+    data = StateWriter().get_data()
+    py.test.raises(InvalidSaveStateException, StateReader,
+                   data[:-1] + chr(STATE_VERSION + 1))
+    writer = StateWriter()
+    writer.write_buffer(bytearray("abcd"))
+    reader = StateReader(writer.get_data()[:-1])
+    py.test.raises(InvalidSaveStateException, reader.read_buffer,
+                   bytearray("abcd"))
+    reader = StateReader(writer.get_data())
+    py.test.raises(InvalidSaveStateException, reader.read_buffer,
+                   bytearray("abc"))
+
+
+def test_round_trip():
+    gameboy = create_gameboy("/rom9/rom9.gb")
+    emulate_frames(gameboy, 30)
+    state = gameboy.save_state()
+    emulate_frames(gameboy, 30)
+    copy = create_gameboy("/rom9/rom9.gb")
+    copy.load_state(state)
+    assert copy.save_state() == state
+    emulate_frames(copy, 30)
+    assert get_machine(copy) == get_machine(gameboy)
+
+
+def test_load_state_of_another_cartridge():
+    state = create_gameboy("/rom9/rom9.gb").save_state()
+    gameboy = create_gameboy("/rom3/rom3.gb")
+    py.test.raises(InvalidSaveStateException, gameboy.load_state, state)
+
+
+def test_fork():
+    gameboy = create_gameboy("/rom7/rom7.gb")
+    emulate_frames(gameboy, 20)
+    fork = gameboy.fork()
+    emulate_frames(gameboy, 20)
+    emulate_frames(fork, 20)
+    assert get_machine(fork) == get_machine(gameboy)
+    assert fork.ram.work_ram is not gameboy.ram.work_ram
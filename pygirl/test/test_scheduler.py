@@ -0,0 +1,108 @@
+from pygirl import constants
+from pygirl.scheduler import *
+from pygirl.test.test_save_state import create_gameboy
+
+
+class FakeCPU(object):
+    """
+    Executes 4 cycle instructions, a write is called once before the
+    instruction starting at its cycle of a slice
+    """
+    def __init__(self):
+        self.cycles = 0
+        self.writes = {}
+
+    def emulate(self, ticks):
+        self.cycles += ticks
+        executed = 0
+        while self.cycles > 0:
+            if executed in self.writes:
+                self.writes.pop(executed)()
+            self.cycles -= 4
+            executed += 4
+
+
+class FakeComponent(ScheduledComponent):
+    def __init__(self, cycles):
+        self.cycles = cycles
+        self.woken = []
+
+    def get_cycles(self):
+        return self.cycles
+
+    def emulate(self, ticks):
+        self.cycles -= ticks
+        self.woken.append(ticks)
+        if self.cycles <= 0:
+            self.cycles = NO_EVENT
+
+
+def create_scheduler(*components):
+    cpu = FakeCPU()
+    scheduler = Scheduler(cpu)
+    for component in components:
+        scheduler.add_component(component)
+    scheduler.reset()
+    return cpu, scheduler
+
+
+def test_queue_order():
+    late, early, same = FakeComponent(30), FakeComponent(10), FakeComponent(10)
+    cpu, scheduler = create_scheduler(late, early, same)
+    assert scheduler.queue == [early, same, late]
+    assert scheduler.get_cycles() == 10
+    early.cycles = 40
+    scheduler.schedule(early)
+    assert scheduler.queue == [same, late, early]
+    scheduler.schedule(late)
+    assert scheduler.queue == [same, late, early]
+
+
+def test_only_due_components_are_woken():
+    early, late = FakeComponent(8), FakeComponent(100)
+    cpu, scheduler = create_scheduler(early, late)
+    scheduler.emulate(40)
+    assert early.woken == [8]
+    assert late.woken == []
+    scheduler.sync_components()
+    assert late.woken == [40]
+    assert late.get_cycles() == 60
+
+
+def test_write_syncs_at_the_exact_cycle():
+    component = FakeComponent(NO_EVENT)
+    cpu, scheduler = create_scheduler(component)
+
+    def write():
+        component.sync()
+        component.cycles = 8
+        component.reschedule()
+    cpu.writes[12] = write
+    scheduler.emulate(100)
+    # caught up with the 12 cycles before the write, woken 8 cycles later
+    assert component.woken == [12, 8]
+
+
+def test_interrupt_flag_write_is_serviced_at_once():
+    gameboy = create_gameboy("/rom3/rom3.gb")
+    cpu = gameboy.cpu
+    # LD A,TIMER; LDH (IF),A; NOP in the high ram
+    for offset, data in enumerate([0x3E, constants.TIMER, 0xE0, 0x0F, 0x00]):
+        gameboy.write(0xFF80 + offset, data)
+    gameboy.write(constants.IE, constants.TIMER)
+    cpu.pc.set(0xFF80, use_cycles=False)
+    cpu.ime = True
+    gameboy.emulate_step()
+    gameboy.emulate_step()
+    assert cpu.pc.get(use_cycles=False) == 0x0050
+    assert not cpu.ime
+
+
+def test_pressed_button_is_polled_within_the_joypad_clock():
+    gameboy = create_gameboy("/rom3/rom3.gb")
+    gameboy.write(constants.JOYP, 0x10)
+    assert gameboy.read(constants.JOYP) & 0xF == 0xF
+    gameboy.joypad_driver.button_a()
+    gameboy.emulate(constants.JOYPAD_CLOCK)
+    assert gameboy.read(constants.JOYP) & 0xF == 0xE
+    assert not gameboy.joypad_driver.raised
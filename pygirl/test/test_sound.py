@@ -0,0 +1,69 @@
+from pygirl.constants import *
+from pygirl.sound import Sound
+
+
+def create_sound():
+    sound = Sound()
+    sound.set_sample_rate(44100)
+    # the reset leaves some channels playing, start with all of them off
+    sound.write(NR52, 0x00)
+    sound.write(NR52, 0x80)
+    return sound
+
+
+def mix(sound, samples=1024):
+    sound.mix_audio([0] * (samples << 1), samples << 1)
+
+
+def test_triggered_channels_read_as_on_before_they_are_mixed():
+    sound = create_sound()
+    assert sound.read(NR52) & 0x0F == 0
+    sound.write(NR14, 0x80)
+    sound.write(NR44, 0x80)
+    assert sound.read(NR52) & 0x0F == 0x09
+    mix(sound)
+    assert sound.read(NR52) & 0x0F == 0x09
+
+
+def test_expired_length_clears_the_channel():
+    sound = create_sound()
+    sound.write(NR21, 0x3F)
+    sound.write(NR24, 0xC0)
+    sound.write(NR41, 0x3F)
+    sound.write(NR44, 0xC0)
+    assert sound.read(NR52) & 0x0F == 0x0A
+    mix(sound)
+    assert sound.read(NR52) & 0x0F == 0
+
+
+def test_wave_channel_needs_to_be_enabled():
+    sound = create_sound()
+    sound.write(NR30, 0x00)
+    sound.write(NR34, 0x80)
+    assert sound.read(NR52) & 0x0F == 0
+    sound.write(NR30, 0x80)
+    sound.write(NR34, 0x80)
+    assert sound.read(NR52) & 0x0F == 0x04
+    sound.write(NR30, 0x00)
+    assert sound.read(NR52) & 0x0F == 0
+    mix(sound)
+    assert sound.read(NR52) & 0x0F == 0
+
+
+def test_switching_the_sound_off_stops_all_channels():
+    sound = create_sound()
+    sound.write(NR14, 0x80)
+    sound.write(NR52, 0x00)
+    assert sound.read(NR52) & 0x8F == 0
+    sound.write(NR52, 0x80)
+    assert sound.read(NR52) & 0x8F == 0x80
+    mix(sound)
+    assert sound.read(NR52) & 0x8F == 0x80
+    assert not sound.channel1.enabled
+
+
+def test_unused_registers_read_as_ones():
+    sound = create_sound()
+    for address in [NR20, NR40] + range(AUDUNUSED, AUDUNUSEDEND + 1):
+        sound.write(address, 0x00)
+        assert sound.read(address) == 0xFF
@@ -0,0 +1,22 @@
+from pygirl.constants import GAMEBOY_CLOCK
+from pygirl.timer import Clock
+
+
+def test_clock_ahead_of_the_wall_clock_is_not_moved_back():
+    clock = Clock()
+    clock.set_resync_interval(10)
+    start = clock.get_time()
+    # 100 emulated seconds in next to no wall clock time
+    for second in range(100):
+        clock.emulate(GAMEBOY_CLOCK)
+        assert clock.get_time() == start + second + 1
+    clock.resync()
+    assert clock.get_time() == start + 100
+
+
+def test_clock_behind_the_wall_clock_catches_up():
+    clock = Clock()
+    start = clock.get_time()
+    clock.time -= 1000
+    clock.resync()
+    assert start <= clock.get_time() < start + 1000
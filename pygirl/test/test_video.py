@@ -0,0 +1,117 @@
+from pygirl.constants import *
+from pygirl.video import PALETTE_ENTRIES
+from pygirl.test.test_save_state import create_gameboy
+
+
+def draw_screen(video):
+    """
+    Draws all lines and returns the ones which were not taken from the line
+    cache, a redrawn line starts a new list of tile rows
+    """
+    redrawn = []
+    for line_y in range(GAMEBOY_SCREEN_HEIGHT):
+        tiles = video.line_cache.line_tiles[line_y]
+        video.line_y = line_y
+        video.draw_line()
+        if video.line_cache.line_tiles[line_y] is not tiles:
+            redrawn.append(line_y)
+    return redrawn
+
+
+def test_tile_writes_redraw_only_the_lines_using_the_tile_row():
+    video = create_gameboy("/rom3/rom3.gb").video
+    for address in range(VRAM_ADDR, VRAM_ADDR + VRAM_SIZE):
+        video.set_vram(address, 0x00)
+    assert draw_screen(video) == range(GAMEBOY_SCREEN_HEIGHT)
+    assert draw_screen(video) == []
+    # the whole background shows tile 0, tile 1 is not used yet
+    video.set_vram(TILE_DATA_ADDR + 0x10, 0xFF)
+    assert draw_screen(video) == []
+    video.set_vram(TILE_DATA_ADDR + 2 * 3, 0xFF)
+    assert draw_screen(video) == range(3, GAMEBOY_SCREEN_HEIGHT, 8)
+    # show tile 1 in the third tile map row
+    video.set_vram(TILE_MAP_ADDR + 2 * TILE_GROUP_SIZE, 0x01)
+    assert draw_screen(video) == range(16, 24)
+    video.set_vram(TILE_DATA_ADDR + 0x10 + 2 * 5 + 1, 0xFF)
+    assert draw_screen(video) == [21]
+
+
+def scan_line_sprites(video, line_y):
+    shown = [sprite for sprite in video.sprites
+             if sprite.is_shown_on_line(line_y)][:SPRITES_PER_LINE]
+    return sorted([(sprite.x, sprite.index) for sprite in shown])
+
+
+def test_line_sprites_follow_the_oam_writes():
+    import random
+    video = create_gameboy("/rom3/rom3.gb").video
+    generator = random.Random(42)
+    for step in range(2000):
+        if step % 500 == 499:
+            video.control.write(video.control.read() ^ 0x04)
+        address = OAM_ADDR + generator.randrange(MAX_SPRITES) * 4 + \
+                  generator.choice([0, 0, 1, 2])
+        video.set_oam(address, generator.randrange(0x100))
+        if step % 50 == 0:
+            lines = range(GAMEBOY_SCREEN_HEIGHT)
+        else:
+            lines = [generator.randrange(GAMEBOY_SCREEN_HEIGHT)]
+        for line_y in lines:
+            line_sprites = video.get_line_sprites(line_y)
+            assert sorted([(sprite.x, sprite.index)
+                           for sprite in line_sprites]) == \
+                   scan_line_sprites(video, line_y)
+            xs = [sprite.x for sprite in line_sprites]
+            assert xs == sorted(xs, reverse=True)
+
+
+def test_dma_decodes_only_the_changed_sprites():
+    gameboy = create_gameboy("/rom3/rom3.gb")
+    video = gameboy.video
+    oam = [0x00] * OAM_SIZE
+    # sprite 1 on the lines 8 to 15, sprite 3 on the lines 20 to 27
+    oam[4:8] = [24, 40, 0x02, 0x10]
+    oam[12:16] = [36, 60, 0x05, 0x20]
+    for index in range(OAM_SIZE):
+        gameboy.write(0xC000 + index, oam[index])
+    video.set_dma(0xC0)
+    assert video.oam == oam
+    assert [video.sprites[1].get_data_at(index) for index in range(4)] == \
+           oam[4:8]
+    assert video.sprites_on_line[8] == [video.sprites[1]]
+    assert video.sprites_on_line[27] == [video.sprites[3]]
+    # moving sprite 3 down only touches the lines it covers
+    video.line_cache.dirty = [False] * GAMEBOY_SCREEN_HEIGHT
+    gameboy.write(0xC000 + 12, 40)
+    video.set_dma(0xC0)
+    assert [line_y for line_y in range(GAMEBOY_SCREEN_HEIGHT)
+            if video.line_cache.dirty[line_y]] == range(20, 32)
+    assert video.sprites_on_line[20] == []
+    assert video.sprites_on_line[31] == [video.sprites[3]]
+
+
+def test_dma_copies_from_the_mapped_pages():
+    gameboy = create_gameboy("/rom3/rom3.gb")
+    video = gameboy.video
+    for index in range(OAM_SIZE):
+        gameboy.write(0xC100 + index, index ^ 0x5A)
+    # the switchable ROM bank and the echo of the work RAM
+    for page in [0x40, 0x01, 0xE1]:
+        video.set_dma(page)
+        assert video.oam == [gameboy.read((page << 8) + index)
+                             for index in range(OAM_SIZE)]
+
+
+def test_palette_writes_update_the_entries_showing_their_colors():
+    video = create_gameboy("/rom3/rom3.gb").video
+    video.set_background_palette(0xE4)
+    video.set_object_palette_0(0x1B)
+    video.set_object_palette_1(0x93)
+    shown = {}
+    for table, data in [(0, 0xE4), (1, 0x1B), (2, 0x93)]:
+        for color in range(4):
+            for index in PALETTE_ENTRIES[table][color]:
+                shown[index] = (data >> (color << 1)) & 0x03
+    assert len(shown) == 64
+    for index, shade in shown.items():
+        assert video.palette[index] == shade
@@ -6,7 +6,7 @@ Timer and Divider
 
 from pygirl import constants
 from pygirl.interrupt import Interrupt
-from pygirl.ram import iMemory
+from pygirl.scheduler import ScheduledComponent, NO_EVENT
 
 import time
 import math
@@ -21,7 +21,13 @@ class TimerControl(object):
         pass
 
 
-class Timer(iMemory):
+class Timer(ScheduledComponent):
+    """
+    DIV and TIMA are evaluated lazily: they are brought up to date when they
+    are read or written, the scheduler only wakes the timer when TIMA
+    overflows.
+    """
+
     def __init__(self, interrupt):
         assert isinstance(interrupt, Interrupt)
         self.timer_interrupt_flag = interrupt.timer
@@ -36,6 +42,24 @@ class Timer(iMemory):
         self.timer_cycles = constants.TIMER_CLOCK[0]
         self.timer_clock = constants.TIMER_CLOCK[0]
 
+    def save_state(self, writer):
+        writer.write_int(self.divider)
+        writer.write_int(self.divider_cycles)
+        writer.write_int(self.timer_counter)
+        writer.write_int(self.timer_modulo)
+        writer.write_int(self.timer_control)
+        writer.write_int(self.timer_cycles)
+        writer.write_int(self.timer_clock)
+
+    def load_state(self, reader):
+        self.divider = reader.read_int()
+        self.divider_cycles = reader.read_int()
+        self.timer_counter = reader.read_int()
+        self.timer_modulo = reader.read_int()
+        self.timer_control = reader.read_int()
+        self.timer_cycles = reader.read_int()
+        self.timer_clock = reader.read_int()
+
     def write(self, address, data):
         if address == constants.DIV:
             self.set_divider(data)
@@ -58,6 +82,7 @@ class Timer(iMemory):
         return 0xFF
 
     def get_divider(self):
+        self.sync()
         return self.divider
 
     def set_divider(self, data):
@@ -65,9 +90,11 @@ class Timer(iMemory):
         This register is incremented at rate of 16384Hz (~16779Hz on SGB). 
         Writing any value to this register resets it to 00h. 
         """
+        self.sync()
         self.divider = 0
 
     def get_timer_counter(self):
+        self.sync()
         return self.timer_counter
 
     def set_timer_counter(self, data):
@@ -78,7 +105,9 @@ class Timer(iMemory):
         it will be reset to the value specified in TMA (FF06), and an interrupt
         will be requested, as described below.
         """
+        self.sync()
         self.timer_counter = data
+        self.reschedule()
 
     def get_timer_modulo(self):
         return self.timer_modulo
@@ -87,6 +116,7 @@ class Timer(iMemory):
         """
         When the TIMA overflows, this data will be loaded.
         """
+        self.sync()
         self.timer_modulo = data
 
     def get_timer_control(self):
@@ -101,16 +131,20 @@ class Timer(iMemory):
              10:  65536 Hz
              11:  16384 Hz
         """
+        self.sync()
         if (self.timer_control & 0x03) != (data & 0x03):
             self.timer_clock = constants.TIMER_CLOCK[data & 0x03]
             self.timer_cycles = constants.TIMER_CLOCK[data & 0x03]
         self.timer_control = data
+        self.reschedule()
 
     def get_cycles(self):
-        if (self.timer_control & 0x04) != 0 and \
-                        self.timer_cycles < self.divider_cycles:
-            return self.timer_cycles
-        return self.divider_cycles
+        # only the overflow of TIMA raises an interrupt, the divider is
+        # caught up whenever it is accessed
+        if (self.timer_control & 0x04) == 0:
+            return NO_EVENT
+        return self.timer_cycles + (0xFF - self.timer_counter) * \
+                                   self.timer_clock
 
     def emulate(self, ticks):
         self.emulate_divider(ticks)
@@ -129,28 +163,80 @@ class Timer(iMemory):
         if (self.timer_control & 0x04) == 0:
             return
         self.timer_cycles -= ticks
-        while self.timer_cycles <= 0:
-            self.timer_counter = (self.timer_counter + 1) & 0xFF
-            self.timer_cycles += self.timer_clock
-            self.timer_interrupt_check()
+        if self.timer_cycles > 0:
+            return
+        count = -self.timer_cycles / self.timer_clock + 1
+        self.timer_cycles += count * self.timer_clock
+        self.increment_timer_counter(count)
 
-    def timer_interrupt_check(self):
+    def increment_timer_counter(self, count):
         """
         Each time when the timer overflows (ie. when TIMA gets bigger than FFh),
         then an interrupt is requested by setting Bit 2 in the IF Register 
         (FF0F). When that interrupt is enabled, then the CPU will execute it by
         calling the timer interrupt vector at 0050h.
         """
-        if self.timer_counter == 0x00:
-            self.timer_counter = self.timer_modulo
-            self.timer_interrupt_flag.set_pending()
+        count += self.timer_counter
+        if count <= 0xFF:
+            self.timer_counter = count
+            return
+        # after the first overflow TIMA restarts at TMA every period counts
+        period = 0x100 - self.timer_modulo
+        self.timer_counter = self.timer_modulo + (count - 0x100) % period
+        self.timer_interrupt_flag.set_pending()
 
 
 # CLOCK DRIVER -----------------------------------------------------------------
 
-class Clock(object):
+class Clock(ScheduledComponent):
+    """
+    Time source of the cartridge RTCs in seconds. The seconds are derived
+    from the emulated cycles, so the RTC runs with the emulation no matter how
+    fast it is. It starts at the wall clock time and is only synced when an
+    RTC is latched or written. A resync interval in emulated seconds lets it
+    catch up with the wall clock from time to time when the emulation falls
+    behind. It never goes back, the RTCs count the elapsed time since their
+    last update.
+    """
+    use_emulated_time = True
+
     def __init__(self):
-        pass
+        self.time = 0
+        self.cycles = 0
+        self.resync_interval = 0
+        self.resync()
+
+    def set_resync_interval(self, interval):
+        self.resync_interval = interval
+
+    def save_state(self, writer):
+        self.sync()
+        writer.write_int(self.time)
+        writer.write_int(self.cycles)
+
+    def load_state(self, reader):
+        self.time = reader.read_int()
+        self.cycles = reader.read_int()
+        self.resync_time = self.time
+
+    def emulate(self, ticks):
+        self.cycles += ticks
 
     def get_time(self):
-        return int(time.time())
+        if not self.use_emulated_time:
+            return int(time.time())
+        self.sync()
+        self.time += self.cycles // constants.GAMEBOY_CLOCK
+        self.cycles %= constants.GAMEBOY_CLOCK
+        if self.resync_interval > 0 and \
+                self.time - self.resync_time >= self.resync_interval:
+            self.resync()
+        return self.time
+
+    def resync(self):
+        """
+        Moves the emulated time forward to the wall clock if it is behind,
+        the cycles into the current second are kept
+        """
+        self.time = max(self.time, int(time.time()))
+        self.resync_time = self.time
@@ -5,7 +5,7 @@
 import math
 import operator
 from pygirl.constants import *
-from pygirl.ram import iMemory
+from pygirl.scheduler import ScheduledComponent, NO_EVENT
 from pygirl.cpu import process_2s_complement
 from pygirl.video_register import ControlRegister, StatusRegister
 from pygirl.video_sprite import Sprite, Tile, Background, Window
@@ -14,25 +14,73 @@ from pygirl.video_mode import Mode0, Mode1, Mode2, Mode3
 
 # -----------------------------------------------------------------------------
 
-class Video(iMemory):
+BACKGROUND_SHADES = 0
+OBJECT_SHADES_0 = 1
+OBJECT_SHADES_1 = 2
+
+
+def create_palette_entries():
+    """
+    For each shade table and color number, returns the indices of the palette
+    entries showing that color. The palette holds an entry for each of the 64
+    pixel patterns a line can hold:
+    bit 4/0 = BG color,
+    bit 5/1 = OBJ color,
+    bit 2   = OBJ palette,
+    bit 3   = OBJ priority
+    """
+    entries = [[[] for color in range(4)] for table in range(3)]
+    for pattern in range(0, 64):
+        if pattern & 0x22 == 0 or (pattern & 0x08 != 0 and pattern & 0x11 != 0):
+            # OBJ behind BG color 1-3
+            table = BACKGROUND_SHADES
+            color = ((pattern >> 3) & 0x02) + (pattern & 0x01)
+        else:
+            # OBJ above BG
+            if (pattern & 0x04) == 0:
+                table = OBJECT_SHADES_0
+            else:
+                table = OBJECT_SHADES_1
+            color = ((pattern >> 4) & 0x02) + ((pattern >> 1) & 0x01)
+        entries[table][color].append(((pattern & 0x30) << 4) + (pattern & 0x0F))
+    return entries
+
+PALETTE_ENTRIES = create_palette_entries()
+
+
+# -----------------------------------------------------------------------------
+
+class Video(ScheduledComponent):
+    # redraw only the lines whose inputs changed since they were last drawn
+    use_line_cache = True
+
     def __init__(self, video_driver, interrupt, memory):
         assert isinstance(video_driver, VideoDriver)
         self.driver = video_driver
         self.v_blank_interrupt_flag = interrupt.v_blank
         self.lcd_interrupt_flag = interrupt.lcd
         self.create_tile_maps()
-        self.window = Window(self.tile_maps)
-        self.background = Background(self.tile_maps)
+        self.line_cache = LineCache()
+        self.window = Window(self.tile_maps, self.line_cache)
+        self.background = Background(self.tile_maps, self.line_cache)
         self.status = StatusRegister(self)
         self.control = ControlRegister(self, self.window,
                                        self.background)
         self.memory = memory
+        self.create_vram()
         self.create_tiles()
         self.create_sprites()
         self.reset()
 
     # -----------------------------------------------------------------------
 
+    def create_vram(self):
+        # Raw copy of the video memory, read directly through the memory map.
+        # Tiles and tile maps stay the decoded form used for drawing.
+        self.vram = bytearray("\x00" * VRAM_SIZE)
+
+    # -----------------------------------------------------------------------
+
     def create_tile_maps(self):
         # create the maximal possible sprites
         self.tile_map_0 = self.create_tile_map()
@@ -56,6 +104,7 @@ class Video(iMemory):
 
     def update_tile(self, address, data):
         self.get_tile(address).set_data_at(address, data)
+        self.line_cache.tile_data_version += 1
 
     def get_tile_at(self, tile_index):
         if tile_index < TILE_DATA_SIZE:
@@ -77,6 +126,10 @@ class Video(iMemory):
         tile_group = map[tile_map_index >> 5]
         return tile_group, tile_map_index & 0x1F
 
+    def get_tile_row_index(self, address):
+        # index of the row of 32 tiles over both tile maps
+        return (address - TILE_MAP_ADDR) >> 5
+
     def get_selected_tile_data_space(self):
         return self.tile_data[not self.control.lower_tile_data_selected]
 
@@ -87,12 +140,27 @@ class Video(iMemory):
     def update_tile_map(self, address, data):
         tile_group, group_index = self.select_tile_group_for(address)
         tile_group[group_index] = data
+        self.line_cache.tile_row_versions[self.get_tile_row_index(address)] += 1
 
     # -----------------------------------------------------------------------
     def create_sprites(self):
         self.sprites = [None] * MAX_SPRITES
         for i in range(MAX_SPRITES):
-            self.sprites[i] = Sprite(self)
+            self.sprites[i] = Sprite(self, i)
+        self.create_line_sprites()
+
+    def create_line_sprites(self):
+        # The sprites shown on every line in OAM order, kept up to date on
+        # every OAM write. The sprites drawn on a line in drawing order are
+        # sorted from them when the line is drawn and kept until the sprites
+        # on the line or their x positions change.
+        self.sprites_on_line = [[] for i in range(GAMEBOY_SCREEN_HEIGHT)]
+        self.line_sprites = [[] for i in range(GAMEBOY_SCREEN_HEIGHT)]
+        self.line_sprites_valid = [False] * GAMEBOY_SCREEN_HEIGHT
+
+    def invalidate_line_sprites(self, first_line, end_line):
+        for line_y in range(first_line, end_line):
+            self.line_sprites_valid[line_y] = False
 
     def update_all_sprites(self):
         # TODO: TEST!
@@ -102,13 +170,90 @@ class Video(iMemory):
                                      self.oam[address + 1],
                                      self.oam[address + 2],
                                      self.oam[address + 3])
+        self.rebuild_sprites_on_lines()
+
+    def rebuild_sprites_on_lines(self):
+        for line_y in range(GAMEBOY_SCREEN_HEIGHT):
+            self.sprites_on_line[line_y] = []
+        for sprite in self.sprites:
+            first_line, end_line = self.get_sprite_lines(sprite)
+            for line_y in range(first_line, end_line):
+                self.sprites_on_line[line_y].append(sprite)
+        self.invalidate_line_sprites(0, GAMEBOY_SCREEN_HEIGHT)
 
     def update_sprite(self, address, data):
-        self.get_sprite(address).set_data_at(address, data)
+        sprite = self.get_sprite(address)
+        first_line, end_line = self.get_sprite_lines(sprite)
+        x = sprite.x
+        sprite.set_data_at(address, data)
+        self.move_sprite(sprite, first_line, end_line, x)
+
+    def update_sprite_from_oam(self, sprite):
+        address = sprite.index * 4
+        oam = self.oam
+        if sprite.get_data_at(0) == oam[address + 0] and \
+                sprite.get_data_at(1) == oam[address + 1] and \
+                sprite.get_data_at(2) == oam[address + 2] and \
+                sprite.get_data_at(3) == oam[address + 3]:
+            return
+        first_line, end_line = self.get_sprite_lines(sprite)
+        x = sprite.x
+        sprite.set_data(oam[address + 0], oam[address + 1],
+                        oam[address + 2], oam[address + 3])
+        self.move_sprite(sprite, first_line, end_line, x)
+
+    def move_sprite(self, sprite, first_line, end_line, x):
+        """
+        Updates the lines after a change of the sprite which was shown from
+        first_line to end_line at x before
+        """
+        new_first_line, new_end_line = self.get_sprite_lines(sprite)
+        # the lines the sprite covered before and after the change
+        self.line_cache.invalidate_lines(first_line, end_line)
+        self.line_cache.invalidate_lines(new_first_line, new_end_line)
+        for line_y in range(first_line, end_line):
+            if not new_first_line <= line_y < new_end_line:
+                self.remove_sprite_from_line(sprite, line_y)
+        for line_y in range(new_first_line, new_end_line):
+            if not first_line <= line_y < end_line:
+                self.add_sprite_to_line(sprite, line_y)
+        if sprite.x != x:
+            self.invalidate_line_sprites(new_first_line, new_end_line)
+
+    def get_sprite_lines(self, sprite):
+        """
+        Returns the first and the end line of the screen the sprite is
+        shown on
+        """
+        if sprite.hidden:
+            return 0, 0
+        first_line = sprite.y - 2 * SPRITE_SIZE
+        end_line = min(first_line + sprite.get_height(), GAMEBOY_SCREEN_HEIGHT)
+        first_line = max(first_line, 0)
+        if end_line < first_line:
+            return 0, 0
+        return first_line, end_line
+
+    def add_sprite_to_line(self, sprite, line_y):
+        sprites = self.sprites_on_line[line_y]
+        index = 0
+        while index < len(sprites) and sprites[index].index < sprite.index:
+            index += 1
+        sprites.insert(index, sprite)
+        if index < SPRITES_PER_LINE:
+            self.line_sprites_valid[line_y] = False
+
+    def remove_sprite_from_line(self, sprite, line_y):
+        sprites = self.sprites_on_line[line_y]
+        index = sprites.index(sprite)
+        del sprites[index]
+        if index < SPRITES_PER_LINE:
+            self.line_sprites_valid[line_y] = False
 
     def update_sprite_size(self):
         for sprite in self.sprites:
             sprite.big_size = self.control.big_sprites
+        self.rebuild_sprites_on_lines()
 
     def get_sprite_at(self, sprite_index):
         return self.sprites[sprite_index]
@@ -134,24 +279,99 @@ class Video(iMemory):
         self.background_palette = 0xFC
         self.object_palette_0 = 0xFF
         self.object_palette_1 = 0xFF
+        # gray shades of the BG, OBP0 and OBP1 colors, all entries of the
+        # palette start with shade 0 as well
+        self.shades = [[0] * 4 for i in range(3)]
+        self.palette = [0] * 1024
+        self.update_all_shades()
 
         self.transfer = True
         self.display = True
         self.v_blank = True
-        self.dirty = True
 
-        # self.vram       = [0] * VRAM_SIZE
         # Object Attribute Memory
         self.oam = [0] * OAM_SIZE
+        self.update_all_sprites()
+        self.line_cache.invalidate()
 
         # XXX remove those dumb helper "shown_sprites"
         self.line = [0] * (SPRITE_SIZE + GAMEBOY_SCREEN_WIDTH + SPRITE_SIZE)
         self.shown_sprites = [None] * SPRITES_PER_LINE
-        self.palette = [0] * 1024
 
         self.frames = 0
         self.frame_skip = 0
 
+    # Save states --------------------------------------------------------------
+
+    def save_state(self, writer):
+        writer.write_byte(self.control.read())
+        writer.write_byte(self.status.read(extend=True))
+        writer.write_int(self.cycles)
+        writer.write_byte(self.line_y)
+        writer.write_byte(self.line_y_compare)
+        writer.write_byte(self.dma)
+        writer.write_byte(self.background_palette)
+        writer.write_byte(self.object_palette_0)
+        writer.write_byte(self.object_palette_1)
+        writer.write_byte(self.background.scroll_x)
+        writer.write_byte(self.background.scroll_y)
+        writer.write_byte(self.window.x)
+        writer.write_byte(self.window.y)
+        writer.write_bool(self.transfer)
+        writer.write_bool(self.display)
+        writer.write_bool(self.v_blank)
+        writer.write_int(self.frames)
+        for index in range(OAM_SIZE):
+            writer.write_byte(self.oam[index])
+        writer.write_buffer(self.vram)
+        writer.write_buffer(self.driver.pixels)
+
+    def load_state(self, reader):
+        control = reader.read_byte()
+        self.status.write(reader.read_byte(), write_all=True)
+        self.cycles = reader.read_int()
+        self.line_y = reader.read_byte()
+        self.line_y_compare = reader.read_byte()
+        self.dma = reader.read_byte()
+        self.background_palette = reader.read_byte()
+        self.object_palette_0 = reader.read_byte()
+        self.object_palette_1 = reader.read_byte()
+        self.update_all_shades()
+        self.background.scroll_x = reader.read_byte()
+        self.background.scroll_y = reader.read_byte()
+        self.window.x = reader.read_byte()
+        self.window.y = reader.read_byte()
+        self.transfer = reader.read_bool()
+        self.display = reader.read_bool()
+        self.v_blank = reader.read_bool()
+        self.frames = reader.read_int()
+        for index in range(OAM_SIZE):
+            self.oam[index] = reader.read_byte()
+        reader.read_buffer(self.vram)
+        reader.read_buffer(self.driver.pixels)
+        self.update_all_sprites()
+        self.control.restore(control)
+        self.update_tiles_from_vram()
+        self.line_cache.invalidate()
+
+    def update_tiles_from_vram(self):
+        """
+        Decodes the tiles and tile maps from the raw video memory
+        """
+        tile_size = 2 * SPRITE_SIZE
+        for tile_index in range(TILE_DATA_SIZE + TILE_DATA_SIZE / 2):
+            tile = self.get_tile_at(tile_index)
+            address = tile_index * tile_size
+            for index in range(tile_size):
+                tile.data[index] = self.vram[address + index]
+            tile.update_colors()
+        address = TILE_MAP_ADDR - VRAM_ADDR
+        for tile_map in self.tile_maps:
+            for tile_group in tile_map:
+                for index in range(TILE_GROUP_SIZE):
+                    tile_group[index] = self.vram[address + index]
+                address += TILE_GROUP_SIZE
+
     # Read Write shared memory -------------------------------------------------
 
     def write(self, address, data):
@@ -231,13 +451,17 @@ class Video(iMemory):
         self.frame_skip = frame_skip
 
     def get_cycles(self):
+        if not self.control.lcd_enabled:
+            return NO_EVENT
         return self.cycles
 
     def get_control(self):
         return self.control.read()
 
     def set_control(self, data):
+        self.sync()
         self.control.write(data)
+        self.reschedule()
 
     def get_status(self):
         return self.status.read(extend=True)
@@ -329,10 +553,11 @@ class Video(iMemory):
         screen).
         """
         self.dma = data
-        # copy the memory region
-        for index in range(OAM_SIZE):
-            self.oam[index] = self.memory.read((self.dma << 8) + index)
-        self.update_all_sprites()
+        # copy the memory region straight into the OAM, only the sprites
+        # whose attributes changed are decoded
+        self.memory.copy_block(self.dma << 8, self.oam, OAM_SIZE)
+        for sprite in self.sprites:
+            self.update_sprite_from_oam(sprite)
 
     def get_background_palette(self):
         """ see set_background_palette"""
@@ -354,7 +579,7 @@ class Video(iMemory):
         """
         if self.background_palette != data:
             self.background_palette = data
-            self.dirty = True
+            self.update_shades(BACKGROUND_SHADES, data)
 
     def get_object_palette_0(self):
         return self.object_palette_0
@@ -367,7 +592,7 @@ class Video(iMemory):
         """
         if self.object_palette_0 != data:
             self.object_palette_0 = data
-            self.dirty = True
+            self.update_shades(OBJECT_SHADES_0, data)
 
     def get_object_palette_1(self):
         return self.object_palette_1
@@ -380,7 +605,7 @@ class Video(iMemory):
         """
         if self.object_palette_1 != data:
             self.object_palette_1 = data
-            self.dirty = True
+            self.update_shades(OBJECT_SHADES_1, data)
 
     def get_window_y(self):
         """ see set_window.y """
@@ -422,6 +647,9 @@ class Video(iMemory):
         sets one byte of the video memory.
         The video memory contains the tiles used to display.
         """
+        if self.vram[address - VRAM_ADDR] == data & 0xFF:
+            return
+        self.vram[address - VRAM_ADDR] = data & 0xFF
         if address < TILE_MAP_ADDR:
             self.update_tile(address, data)
         else:
@@ -452,6 +680,7 @@ class Video(iMemory):
     def clear_frame(self):
         self.driver.clear_gb_pixels()
         self.driver.update_gb_display()
+        self.line_cache.invalidate()
 
     def tile_index_flip(self):
         if self.control.lower_tile_data_selected:
@@ -468,37 +697,61 @@ class Video(iMemory):
             window.draw_clean_line(self.line)
 
     def draw_line(self):
-        # XXX We should check if this is necessary for each line.
-        self.update_palette()
+        if self.use_line_cache and self.is_line_cached():
+            return
+        self.line_cache.begin_line(self.line_y)
         self.draw_window(self.background, self.line_y, self.line)
         self.draw_window(self.window, self.line_y, self.line)
         self.draw_sprites(self.line_y, self.line)
 
-        # Send a line of pixels to the driver.
-        colors = "".join([chr(self.palette[self.line[SPRITE_SIZE + x]])
-                          for x in range(GAMEBOY_SCREEN_WIDTH)])
-        self.driver.draw_gb_pixel_line(self.line_y, colors)
+        # Map the line through the palette straight into the driver's frame
+        pixels = self.driver.get_frame_buffer()
+        start = self.driver.get_line_start(self.line_y)
+        palette = self.palette
+        line = self.line
+        for x in range(GAMEBOY_SCREEN_WIDTH):
+            pixels[start + x] = palette[line[SPRITE_SIZE + x]]
+
+    def is_line_cached(self):
+        """
+        Returns True if the current line would be drawn from the same inputs
+        as the last time, its pixels in the driver are still valid then.
+        """
+        line_y = self.line_y
+        background = self.background
+        window = self.window
+        registers = self.control.read() + (background.scroll_x << 8) + \
+                    (background.scroll_y << 16) + (window.x << 24)
+        palettes = self.background_palette + (self.object_palette_0 << 8) + \
+                   (self.object_palette_1 << 16) + (window.y << 24)
+        background_row = (int(background.upper_tile_map_selected) <<
+                          5) + (((background.scroll_y + line_y) & 0xFF) >> 3)
+        window_row = -1
+        if window.enabled and \
+                0 <= line_y - window.y < GAMEBOY_SCREEN_HEIGHT:
+            window_row = (int(window.upper_tile_map_selected) << 5) + \
+                         ((line_y - window.y) >> 3)
+        return self.line_cache.check(line_y, registers, palettes,
+                                     background_row, window_row)
 
     def draw_sprites(self, line_y, line):
         if not self.control.sprites_enabled: return
-        count = self.scan_sprites(line_y)
         lastx = SPRITE_SIZE + GAMEBOY_SCREEN_WIDTH + SPRITE_SIZE
-        for index in range(count):
-            sprite = self.shown_sprites[index]
+        for sprite in self.get_line_sprites(line_y):
             sprite.draw(line, line_y, lastx)
             lastx = sprite.x
 
-    def scan_sprites(self, line_y):
-        # search active shown_sprites
-        count = 0
-        for sprite in self.sprites:
-            if sprite.is_shown_on_line(line_y):
-                self.shown_sprites[count] = sprite
-                count += 1
-                if count >= SPRITES_PER_LINE:
-                    break
-        self.sort_scan_sprite(count)
-        return count
+    def get_line_sprites(self, line_y):
+        if not self.line_sprites_valid[line_y]:
+            sprites = self.sprites_on_line[line_y]
+            # only the first sprites in OAM order are shown on a line
+            count = min(len(sprites), SPRITES_PER_LINE)
+            for index in range(count):
+                self.shown_sprites[index] = sprites[index]
+            self.sort_scan_sprite(count)
+            self.line_sprites[line_y] = self.shown_sprites[:count]
+            self.line_sprites_valid[line_y] = True
+        return self.line_sprites[line_y]
 
     def sort_scan_sprite(self, count):
         # TODO: optimize :)
@@ -511,29 +764,125 @@ class Video(iMemory):
             self.shown_sprites[index], self.shown_sprites[highest] = \
                 self.shown_sprites[highest], self.shown_sprites[index]
 
-    def update_palette(self):
-        if not self.dirty: return
-        # bit 4/0 = BG color, 
-        # bit 5/1 = OBJ color, 
-        # bit 2   = OBJ palette, 
-        # bit 3   = OBJ priority
-        for pattern in range(0, 64):
-            # color
-            if pattern & 0x22 == 0 or (pattern & 0x08 != 0 and pattern & 0x11 != 0):
-                # OBJ behind BG color 1-3
-                color = (self.background_palette >> ((((pattern >> 3) & 0x02) + \
-                                                      (pattern & 0x01)) << 1)) & 0x03
-                # OBJ above BG
-            elif (pattern & 0x04) == 0:
-                color = (self.object_palette_0 >> ((((pattern >> 4) & 0x02) + \
-                                                    ((pattern >> 1) & 0x01)) << 1)) & 0x03
-            else:
-                color = (self.object_palette_1 >> ((((pattern >> 4) & 0x02) + \
-                                                    ((pattern >> 1) & 0x01)) << 1)) & 0x03
-            index = ((pattern & 0x30) << 4) + (pattern & 0x0F)
-            # self.palette[index] = COLOR_MAP[color]
-            self.palette[index] = color
-        self.dirty = False
+    def update_all_shades(self):
+        self.update_shades(BACKGROUND_SHADES, self.background_palette)
+        self.update_shades(OBJECT_SHADES_0, self.object_palette_0)
+        self.update_shades(OBJECT_SHADES_1, self.object_palette_1)
+
+    def update_shades(self, table, data):
+        """
+        Decodes a palette register into the gray shades of its 4 colors and
+        writes the changed ones into the palette entries showing them.
+        """
+        shades = self.shades[table]
+        palette = self.palette
+        for color in range(4):
+            shade = (data >> (color << 1)) & 0x03
+            if shades[color] != shade:
+                shades[color] = shade
+                for index in PALETTE_ENTRIES[table][color]:
+                    palette[index] = shade
+
+
+# ------------------------------------------------------------------------------
+
+class LineCache(object):
+    """
+    Remembers the inputs every line of the screen was last drawn from: the
+    registers, the versions of the tile map rows it shows and the tile rows
+    it was drawn from. Sprites mark the lines they cover dirty when they
+    change.
+    A tile data write only redraws the lines which used the written tile row.
+    Row versions only grow, so with the same registers and tile map rows a
+    line used the same tile rows and their summed versions tell whether one
+    was written since. The count of all tile data writes spares the lines
+    from summing while no tile changes.
+    """
+
+    def __init__(self):
+        self.tile_data_version = 0
+        self.tile_row_versions = [0] * (2 * TILE_MAP_SIZE)
+        self.registers = [0] * GAMEBOY_SCREEN_HEIGHT
+        self.palettes = [0] * GAMEBOY_SCREEN_HEIGHT
+        self.tile_data_versions = [0] * GAMEBOY_SCREEN_HEIGHT
+        self.background_rows = [0] * GAMEBOY_SCREEN_HEIGHT
+        self.background_versions = [0] * GAMEBOY_SCREEN_HEIGHT
+        self.window_rows = [0] * GAMEBOY_SCREEN_HEIGHT
+        self.window_versions = [0] * GAMEBOY_SCREEN_HEIGHT
+        # the tile rows every line was drawn from and their summed versions
+        self.line_tiles = [[] for i in range(GAMEBOY_SCREEN_HEIGHT)]
+        self.line_tile_rows = [[] for i in range(GAMEBOY_SCREEN_HEIGHT)]
+        self.line_tile_versions = [0] * GAMEBOY_SCREEN_HEIGHT
+        self.line_y = 0
+        self.dirty = [True] * GAMEBOY_SCREEN_HEIGHT
+
+    def invalidate(self):
+        self.invalidate_lines(0, GAMEBOY_SCREEN_HEIGHT)
+
+    def invalidate_lines(self, first_line, end_line):
+        for line_y in range(max(first_line, 0),
+                            min(end_line, GAMEBOY_SCREEN_HEIGHT)):
+            self.dirty[line_y] = True
+
+    def get_row_version(self, row):
+        if row < 0:
+            return 0
+        return self.tile_row_versions[row]
+
+    def begin_line(self, line_y):
+        # the tile rows drawn from now on belong to line_y
+        self.line_y = line_y
+        self.line_tiles[line_y] = []
+        self.line_tile_rows[line_y] = []
+        self.line_tile_versions[line_y] = 0
+
+    def use_tile_row(self, tile, row):
+        line_y = self.line_y
+        self.line_tiles[line_y].append(tile)
+        self.line_tile_rows[line_y].append(row)
+        self.line_tile_versions[line_y] += tile.row_versions[row]
+
+    def get_tile_versions(self, line_y):
+        tiles = self.line_tiles[line_y]
+        rows = self.line_tile_rows[line_y]
+        versions = 0
+        for i in range(len(tiles)):
+            versions += tiles[i].row_versions[rows[i]]
+        return versions
+
+    def tiles_unchanged(self, line_y):
+        if self.tile_data_versions[line_y] == self.tile_data_version:
+            return True
+        if self.get_tile_versions(line_y) != self.line_tile_versions[line_y]:
+            return False
+        self.tile_data_versions[line_y] = self.tile_data_version
+        return True
+
+    def check(self, line_y, registers, palettes, background_row, window_row):
+        """
+        Compares the inputs with the ones the line was last drawn from and
+        stores them. Returns True if they are the same.
+        """
+        background_version = self.get_row_version(background_row)
+        window_version = self.get_row_version(window_row)
+        if not self.dirty[line_y] and \
+                self.registers[line_y] == registers and \
+                self.palettes[line_y] == palettes and \
+                self.background_rows[line_y] == background_row and \
+                self.background_versions[line_y] == background_version and \
+                self.window_rows[line_y] == window_row and \
+                self.window_versions[line_y] == window_version and \
+                self.tiles_unchanged(line_y):
+            return True
+        self.dirty[line_y] = False
+        self.registers[line_y] = registers
+        self.palettes[line_y] = palettes
+        self.tile_data_versions[line_y] = self.tile_data_version
+        self.background_rows[line_y] = background_row
+        self.background_versions[line_y] = background_version
+        self.window_rows[line_y] = window_row
+        self.window_versions[line_y] = window_version
+        return False
 
 
 # ------------------------------------------------------------------------------
@@ -550,15 +899,26 @@ class VideoDriver(object):
     def get_pixel(self, x, y): return self.pixels[x + self.width * y]
     def set_pixel(self, x, y, p): self.pixels[x + self.width * y] = p
 
+    def get_frame_buffer(self):
+        """
+        The frame itself, one color number per byte. Video draws its lines
+        directly into it, see get_line_start.
+        """
+        return self.pixels
+
+    def get_line_start(self, y):
+        return self.width * y
+
     def draw_gb_pixel_line(self, y, colors):
-        start = self.width * y
+        start = self.get_line_start(y)
         for i in range(len(colors)):
             self.pixels[start + i] = ord(colors[i])
 
     def clear_gb_pixels(self):
-        # XXX deliberately wasteful in order to accomodate metadata display?
         for y in range(GAMEBOY_SCREEN_HEIGHT):
-            self.draw_gb_pixel_line(y, "\x00" * GAMEBOY_SCREEN_WIDTH)
+            start = self.get_line_start(y)
+            for x in range(GAMEBOY_SCREEN_WIDTH):
+                self.pixels[start + x] = 0x00
 
     def update_gb_display(self): self.update_display()
 
@@ -133,7 +133,20 @@ class ControlRegister(object):
         if self.lcd_enabled != bool(value & (1 << 7)):
             self.switch_lcd_enabled()
 
-        was_enabled = self.window.enabled
+        self.write_flags(value)
+
+        if previous_big_sprites != self.big_sprites:
+            self.video.update_sprite_size()
+
+    def restore(self, value):
+        """
+        Sets all bits without switching the LCD, used to load a save state
+        """
+        self.lcd_enabled = bool(value & (1 << 7))
+        self.write_flags(value)
+        self.video.update_sprite_size()
+
+    def write_flags(self, value):
         self.window.enabled = bool(value & (1 << 5))
         self.window.upper_tile_map_selected = bool(value & (1 << 6))
         self.lower_tile_data_selected = bool(value & (1 << 4))
@@ -141,6 +154,3 @@ class ControlRegister(object):
         self.big_sprites = bool(value & (1 << 2))
         self.sprites_enabled = bool(value & (1 << 1))
         self.background.enabled = bool(value & (1 << 0))
-
-        if previous_big_sprites != self.big_sprites:
-            self.video.update_sprite_size()
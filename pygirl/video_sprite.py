@@ -19,8 +19,10 @@ class Sprite(object):
     
     """
 
-    def __init__(self, video):
+    def __init__(self, video, index):
         self.video = video
+        # position in the object attribute memory, lower ones are preferred
+        self.index = index
         self.big_size = False
         self.reset()
 
@@ -192,6 +194,7 @@ class Sprite(object):
     def draw(self, line, line_y, lastx):
         tile = self.get_tile_for_current_line(line_y)
         draw_y = self.get_draw_y(line_y)
+        self.video.line_cache.use_tile_row(tile, draw_y % SPRITE_SIZE)
         tile.draw_for_sprite(self, line, draw_y, lastx)
 
     def tile_mask(self):
@@ -202,17 +205,43 @@ class Sprite(object):
 # -----------------------------------------------------------------------------
 
 class Tile(object):
+    """
+    Besides the 16 raw bytes a tile keeps its 8x8 pixels decoded into the
+    color codes used in Video.line (bit 0 and bit 8 are the two bits of the
+    color number). A decoded row only changes when one of its two bytes is
+    written, drawing a row is a plain copy. Every row counts its writes so
+    the lines drawn from it can tell whether it changed.
+    """
+
     def __init__(self):
         self.data = [0x00 for i in range(2 * SPRITE_SIZE)]
+        self.colors = [0x0000 for i in range(SPRITE_SIZE * SPRITE_SIZE)]
+        self.row_versions = [0 for i in range(SPRITE_SIZE)]
 
     def set_tile_data(self, data):
         self.data = data
+        self.update_colors()
+        for y in range(SPRITE_SIZE):
+            self.row_versions[y] += 1
 
     def get_data_at(self, address):
         return self.data[address % (2 * SPRITE_SIZE)]
 
     def set_data_at(self, address, data):
-        self.data[address % (2 * SPRITE_SIZE)] = data
+        address %= 2 * SPRITE_SIZE
+        self.data[address] = data
+        self.update_row(address >> 1)
+        self.row_versions[address >> 1] += 1
+
+    def update_colors(self):
+        for y in range(SPRITE_SIZE):
+            self.update_row(y)
+
+    def update_row(self, y):
+        pattern = self.get_pattern_at(y << 1)
+        start = y * SPRITE_SIZE
+        for i in range(SPRITE_SIZE):
+            self.colors[start + i] = (pattern >> (SPRITE_SIZE - 1 - i)) & 0x0101
 
     def get_data(self):
         return self.data
@@ -222,10 +251,11 @@ class Tile(object):
                (self.get_data_at(address + 1) << 8)
 
     def draw(self, line, x, y):
-        pattern = self.get_pattern_at(y << 1)
+        # an index loop, RPython cannot prove x to be a valid slice start
+        start = (y % SPRITE_SIZE) * SPRITE_SIZE
+        colors = self.colors
         for i in range(SPRITE_SIZE):
-            color = (pattern >> (SPRITE_SIZE - 1 - i)) & 0x0101
-            line[x + i] = color
+            line[x + i] = colors[start + i]
 
     def draw_for_sprite(self, sprite, line, y, lastx):
         if sprite.x_flipped:
@@ -249,8 +279,9 @@ class Tile(object):
 # -----------------------------------------------------------------------------
 
 class Drawable(object):
-    def __init__(self, tile_maps):
+    def __init__(self, tile_maps, line_cache):
         self.tile_maps = tile_maps
+        self.line_cache = line_cache
         self.enabled = False
         self.upper_tile_map_selected = False
         self.reset()
@@ -267,6 +298,7 @@ class Drawable(object):
             tile_index = tile_group[group_index % TILE_GROUP_SIZE]
             tile_index ^= index_flip
             tile = tile_data[tile_index]
+            self.line_cache.use_tile_row(tile, y % SPRITE_SIZE)
             tile.draw(line, x, y)
             group_index += 1
             x += SPRITE_SIZE